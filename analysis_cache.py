@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+from collections import Counter
+from pathlib import Path
+
+# Per-file analysis results and content fingerprints, reused across runs
+CACHE_DIR = Path('results/analysis_cache')
+FINGERPRINTS_FILE = 'fingerprints.json'
+
+HASH_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def fingerprint(value):
+    """Stable short hash of any JSON-serializable value (e.g. filter rules or a cohort id list)."""
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def _atomic_write_json(path, payload):
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f, default=str)
+    os.replace(tmp_path, path)
+
+
+class AnalysisCache:
+    """
+    JSON cache of per-file results keyed by (file content, cohort, rules).
+
+    File content is identified by a SHA-1 of its bytes. The hash is remembered
+    together with the file's size and mtime, so an unchanged file is not
+    re-hashed on the next run; a touched-but-identical file still hits the cache.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._fingerprints_path = self.cache_dir / FINGERPRINTS_FILE
+        try:
+            with open(self._fingerprints_path) as f:
+                self._fingerprints = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._fingerprints = {}
+        self._fingerprints_dirty = False
+        # Lookups per namespace
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def file_fingerprint(self, path):
+        """Content hash of a file, recomputed only when its size or mtime changed."""
+        path = Path(path)
+        st = path.stat()
+        key = str(path.resolve())
+        known = self._fingerprints.get(key)
+        if known and known['size'] == st.st_size and known['mtime_ns'] == st.st_mtime_ns:
+            return known['sha1']
+        sha1 = _hash_file(path)
+        self._fingerprints[key] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': sha1}
+        self._fingerprints_dirty = True
+        return sha1
+
+    def _entry_path(self, namespace, key):
+        return self.cache_dir / namespace / f"{key}.json"
+
+    def get(self, namespace, key):
+        """Return the cached value for key, or None."""
+        try:
+            with open(self._entry_path(namespace, key)) as f:
+                value = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses[namespace] += 1
+            return None
+        self.hits[namespace] += 1
+        return value
+
+    def put(self, namespace, key, value):
+        entry_path = self._entry_path(namespace, key)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        _atomic_write_json(entry_path, value)
+
+    def save(self):
+        """Persist the remembered file fingerprints."""
+        if self._fingerprints_dirty:
+            _atomic_write_json(self._fingerprints_path, self._fingerprints)
+            self._fingerprints_dirty = False
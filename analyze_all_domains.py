@@ -1,39 +1,101 @@
+import argparse
 import pandas as pd
 import numpy as np
 from pathlib import Path
 import os
 import re
+from pipeline_profiling import PipelineProfiler
+from subject_index import SubjectIndex, SUBJECT_ID_DTYPE
+from analysis_cache import AnalysisCache, fingerprint
+from column_catalog import load_column_catalog
+from csv_reader import prefetch_csv
+from missing_codes import mask_sentinels, SENTINEL_POLICIES, COLUMN_POLICY_OVERRIDES
+from artifacts import write_artifact, input_fingerprints
+from sharding import in_shard, run_shards, save_shard_result, load_shard_results, add_shard_arguments
+
+# Collects per-stage and per-file timings for this run (see pipeline_profiling.py)
+PROFILER = PipelineProfiler('analyze_all_domains')
+
+# Header-only index of every file under data/core, used to pick columns before reading a file
+COLUMN_CATALOG = load_column_catalog()
+
+# Per-file results from earlier runs; only files whose content, cohort or rules changed are re-analyzed
+ANALYSIS_CACHE = AnalysisCache()
+# Bump when analyze_variable/analyze_file logic changes so old cache entries are ignored
+ANALYSIS_CACHE_VERSION = 2
+# Variables kept for merge_all_variables.py, with their summary statistics
+OUTPUT_PATH = os.path.join('results', 'variable_analysis_results.parquet')
+# Variables need more than this fraction of the reference cohort with valid data
+MIN_VALID_FRACTION = 0.75
+# Variables where more than this fraction of valid responses share one value are low variance
+LOW_VARIANCE_FRACTION = 0.95
+
+# Domains and their paths
+DOMAINS = {
+    'Mental Health': Path('data/core/mental-health'),
+    'Substance Use': Path('data/core/substance-use'),
+    'Physical Health': Path('data/core/physical-health'),
+    'Culture & Environment': Path('data/core/culture-environment'),
+    'ABCD General': Path('data/core/abcd-general')
+}
+
+# Define specific time variables to exclude
+EXCLUDED_TIME_VARS = {
+    'su_y_plus.csv': ['pls1_sess_date_time'],
+    'ph_y_sal_horm.csv': ['hormone_sal_start_y', 'hormone_sal_end_y', 'hormone_sal_wake_y', 'hormone_sal_freezer_y'],
+    'ph_p_meds.csv': ['curr_time'],
+    'ph_y_anthro.csv': ['anthroheightcalc', 'anthroweightcalc']
+}
 
 def get_reference_cohort():
     """Get the cohort of subjects with valid cbcl_scr_dsm5_depress_r at three-year follow-up."""
     cbcl_file = Path('data/core/mental-health/mh_p_cbcl.csv')
     if not cbcl_file.exists():
         raise FileNotFoundError("Could not find mh_p_cbcl.csv")
+
+    cache_key = fingerprint([ANALYSIS_CACHE_VERSION, ANALYSIS_CACHE.file_fingerprint(cbcl_file), SENTINEL_POLICIES])
+    cached = ANALYSIS_CACHE.get('reference_cohort', cache_key)
+    if cached is not None:
+        print(f"Reference cohort loaded from cache ({len(cached)} subjects, {cbcl_file.name} unchanged).")
+        return np.array(cached, dtype=object)
     
-    # Read the CBCL file with low_memory=False to handle mixed types
-    print("Reading CBCL file...")
-    df = pd.read_csv(cbcl_file, low_memory=False)
-    
-    # Print column names to debug
+    # Print column names to debug (from the catalog, without reading the file)
     print("\nAvailable columns in CBCL file:")
-    for col in df.columns:
+    for col in COLUMN_CATALOG.columns(cbcl_file):
         print(f"  - {col}")
     
+    # Read only the columns the cohort definition needs, with low_memory=False to handle mixed types
+    print("Reading CBCL file...")
+    with PROFILER.file(cbcl_file, stage_name='get_reference_cohort') as rec:
+        df = pd.read_csv(cbcl_file, usecols=['src_subject_id', 'eventname', 'cbcl_scr_dsm5_depress_r'], low_memory=False)
+        rec.set_input(df)
+    
     # Filter for three-year follow-up
     three_year_df = df[df['eventname'] == '3_year_follow_up_y_arm_1']
     print(f"\nNumber of rows at 3-year follow-up: {len(three_year_df)}")
     
-    # Define invalid values
-    invalid_values = [555, 999, 777, np.nan]
-    
-    # Get subjectkeys with valid responses for cbcl_scr_dsm5_depress_r
-    valid_subjects = three_year_df[~three_year_df['cbcl_scr_dsm5_depress_r'].isin(invalid_values)]['src_subject_id'].unique()
+    # Get subjectkeys with valid responses for cbcl_scr_dsm5_depress_r (sentinel codes masked to NaN)
+    three_year_df, _ = mask_sentinels(three_year_df, ['cbcl_scr_dsm5_depress_r'])
+    valid_subjects = three_year_df[three_year_df['cbcl_scr_dsm5_depress_r'].notna()]['src_subject_id'].unique()
     
     print(f"\nReference cohort size (subjects with valid cbcl_scr_dsm5_depress_r at 3-year follow-up): {len(valid_subjects)}")
+    rec.set_output(valid_subjects)
+    ANALYSIS_CACHE.put('reference_cohort', cache_key, list(valid_subjects))
     return valid_subjects
 
-# Get reference cohort
-REFERENCE_COHORT = get_reference_cohort()
+# Reference cohort, loaded on first use (inside a profiled run, not at import)
+_REFERENCE_COHORT = None
+
+def reference_cohort():
+    """
+    (cohort subject IDs, SubjectIndex of integer codes used for all subject
+    filtering, cohort fingerprint), loaded once per process on first use.
+    """
+    global _REFERENCE_COHORT
+    if _REFERENCE_COHORT is None:
+        cohort = get_reference_cohort()
+        _REFERENCE_COHORT = (cohort, SubjectIndex(cohort), fingerprint(list(cohort)))
+    return _REFERENCE_COHORT
 
 # Define patterns for redundant variables
 REDUNDANT_PATTERNS = {
@@ -57,49 +119,69 @@ def is_redundant_variable(column_name):
     
     return False
 
-def analyze_variable(df, column):
-    # Define invalid values (excluding 888 which represents branching logic)
-    invalid_values = [555, 999, 777, np.nan]
-    
-    # Special handling for family history yes/no variables
-    if 'fam_history' in column.lower() and 'yes_no' in column.lower():
-        # Replace 7 with NaN for family history yes/no variables
-        df[column] = df[column].replace(7, np.nan)
-    
-    # Filter out invalid values but keep 888s for analysis
-    valid_data = df[~df[column].isin(invalid_values)][column]
+def variable_partial_stats(df, column):
+    """
+    Mergeable summary of one column for a block of subjects: counts per valid value,
+    whether the column is numeric, and its range. Blocks of disjoint subjects (shards)
+    combine exactly with merge_variable_stats.
+    """
+    valid_data = df[column].dropna()
+    is_numeric = pd.api.types.is_numeric_dtype(valid_data)
+    has_range = is_numeric and len(valid_data) > 0
+    return {
+        'value_counts': valid_data.value_counts(sort=False),
+        'is_numeric': is_numeric,
+        'min': valid_data.min() if has_range else None,
+        'max': valid_data.max() if has_range else None,
+    }
+
+def merge_variable_stats(partials):
+    """Combine partial statistics of the same column from disjoint blocks of subjects."""
+    partials = list(partials)
+    if len(partials) == 1:
+        return partials[0]
+    counts = pd.concat([p['value_counts'] for p in partials])
+    mins = [p['min'] for p in partials if p['min'] is not None]
+    maxs = [p['max'] for p in partials if p['max'] is not None]
+    return {
+        'value_counts': counts.groupby(level=0, sort=False).sum(),
+        'is_numeric': all(p['is_numeric'] for p in partials),
+        'min': min(mins) if mins else None,
+        'max': max(maxs) if maxs else None,
+    }
+
+def finalize_variable_stats(stats, column):
+    """Turn (merged) partial statistics into the variable summary: valid/unique counts, range and type."""
+    value_counts = stats['value_counts']
+    value_counts = value_counts[value_counts > 0]
     
-    # Count valid subjects (excluding 888s)
-    n_valid = len(valid_data[valid_data != 888])
+    # Count valid subjects
+    n_valid = int(value_counts.sum())
     
     # If no valid data, return None
     if n_valid == 0:
         return None
     
-    # Count unique values (excluding 888s)
-    n_unique = valid_data[valid_data != 888].nunique()
+    # Count unique values
+    n_unique = len(value_counts)
     
     # Check for low variance - if more than 95% of valid responses are the same value
-    value_counts = valid_data[valid_data != 888].value_counts()
-    if len(value_counts) > 0:  # Only check if there are valid responses
-        most_common_count = value_counts.iloc[0]
-        if most_common_count / n_valid > 0.95:
-            return {
-                'n_valid': n_valid,
-                'n_unique': n_unique,
-                'value_range': None,
-                'var_type': 'low_variance'
-            }
+    most_common_count = value_counts.max()
+    if most_common_count / n_valid > LOW_VARIANCE_FRACTION:
+        return {
+            'n_valid': n_valid,
+            'n_unique': n_unique,
+            'value_range': None,
+            'var_type': 'low_variance'
+        }
     
     # Determine if numeric
-    is_numeric = pd.api.types.is_numeric_dtype(valid_data)
+    is_numeric = stats['is_numeric']
     
-    # Get range if numeric (excluding 888s)
+    # Get range if numeric
     value_range = None
     if is_numeric:
-        valid_numeric_data = valid_data[valid_data != 888]
-        if len(valid_numeric_data) > 0:  # Only get range if there are valid responses
-            value_range = f"{valid_numeric_data.min()} - {valid_numeric_data.max()}"
+        value_range = f"{stats['min']} - {stats['max']}"
     
     # Determine variable type - binary, ordinal, continuous, or categorical
     var_type = "unknown"
@@ -131,13 +213,188 @@ def analyze_variable(df, column):
         'var_type': var_type
     }
 
-def analyze_domain(data_dir, domain_name):
+def analyze_variable(df, column):
+    """Summarize one column of a frame whose sentinel codes (including 888) were masked at load time."""
+    return finalize_variable_stats(variable_partial_stats(df, column), column)
+
+def select_candidate_columns(filename, columns):
+    """
+    Apply the name-based filters to a file's header and return the columns worth analyzing,
+    in file order. Needs only the column names, so it can run before the file is read.
+    """
+    file_exclusions = EXCLUDED_TIME_VARS.get(filename, [])
+
+    # Identify first variable for each redundancy category
+    keep_vars = {}
+    for category, patterns in REDUNDANT_PATTERNS.items():
+        for col in columns:
+            col_lower = col.lower()
+            if any(pattern in col_lower for pattern in patterns):
+                keep_vars[category] = col
+                break
+
+    candidates = []
+    is_cbcl_or_asr = filename in ['mh_p_cbcl.csv', 'mh_p_asr.csv']
+    for column in columns:
+        col_lower = column.lower()
+        # For CBCL and ASR files, only include variables with 'q' in their name
+        if is_cbcl_or_asr and 'q' not in col_lower:
+            continue
+        # Always keep the first variable for each redundancy category
+        keep_redundant = any(column == v for v in keep_vars.values())
+        # Skip redundant variables, ID columns, event column, metadata columns, columns containing timestamp/language/lang/duration, and demo_brthdat_v2
+        if ((not is_redundant_variable(column) or keep_redundant) and
+            column not in ['src_subject_id', 'eventname', 'demo_brthdat_v2'] and 
+            'timestamp' not in col_lower and 
+            'language' not in col_lower and
+            'lang' not in col_lower and
+            'duration' not in col_lower and
+            column not in file_exclusions and
+            not column.endswith('_nm') and
+            not column.endswith('_nt')):
+            candidates.append(column)
+    return candidates
+
+def file_cache_key(file):
+    """Cache key for one file's results: its content, the cohort and every rule that affects the output."""
+    return fingerprint([
+        ANALYSIS_CACHE_VERSION,
+        ANALYSIS_CACHE.file_fingerprint(file),
+        file.name,
+        reference_cohort()[2],
+        REDUNDANT_PATTERNS,
+        EXCLUDED_TIME_VARS.get(file.name, []),
+        SENTINEL_POLICIES,
+        COLUMN_POLICY_OVERRIDES,
+        MIN_VALID_FRACTION,
+        LOW_VARIANCE_FRACTION,
+    ])
+
+def file_read_kwargs(file, header):
+    """Read options for one file: only the ID/event columns and the columns that pass the name filters."""
+    return {'usecols': ['src_subject_id', 'eventname'] + select_candidate_columns(file.name, header),
+            'dtype': SUBJECT_ID_DTYPE}
+
+def file_partial_stats(df, shard=None):
+    """
+    Partial statistics of one file's reference-cohort baseline rows: per-column
+    partial stats, row count and masked sentinel codes. With shard=(index, count)
+    only that subject shard's rows are used; results of all shards combine
+    exactly with merge_file_stats.
+    """
+    candidates = [col for col in df.columns if col not in ('src_subject_id', 'eventname')]
+    baseline_df = df[df['eventname'] == 'baseline_year_1_arm_1']
+    keep = reference_cohort()[1].contains(baseline_df['src_subject_id'])
+    if shard is not None:
+        keep &= in_shard(baseline_df['src_subject_id'], *shard)
+    baseline_df = baseline_df[keep]
+    # One masking pass over all candidate columns; integer columns stay integer-valued
+    baseline_df, sentinel_counts = mask_sentinels(baseline_df, candidates, integer_na=True)
+    return {
+        'n_rows': len(baseline_df),
+        'columns': {column: variable_partial_stats(baseline_df, column) for column in candidates},
+        'sentinel_counts': {int(code): int(n) for code, n in sentinel_counts.groupby('code')['count'].sum().items()},
+    }
+
+def merge_file_stats(partials):
+    """Combine file_partial_stats results of disjoint subject shards."""
+    partials = list(partials)
+    if len(partials) == 1:
+        return partials[0]
+    sentinel_counts = {}
+    for partial in partials:
+        for code, n in partial['sentinel_counts'].items():
+            sentinel_counts[code] = sentinel_counts.get(code, 0) + n
+    return {
+        'n_rows': sum(p['n_rows'] for p in partials),
+        'columns': {column: merge_variable_stats(p['columns'][column] for p in partials)
+                    for column in partials[0]['columns']},
+        'sentinel_counts': sentinel_counts,
+    }
+
+def file_summary_rows(file, domain_name, file_stats, file_record):
+    """Apply the validity and variance filters to a file's statistics and return summary rows for the variables that pass."""
+    file_rows = []
+    n_cohort = len(reference_cohort()[0])
+    file_record.extra['sentinel_counts'] = file_stats['sentinel_counts']
+    total_subjects = file_stats['n_rows']
+    print(f"Total number of subjects in reference cohort: {total_subjects}")
+    if total_subjects == 0:
+        print(f"Warning: No subjects from reference cohort found in {file.name}")
+        return file_rows
+
+    for column, column_stats in file_stats['columns'].items():
+        analysis = finalize_variable_stats(column_stats, column)
+        if analysis is None:
+            continue
+        if analysis['var_type'] == 'low_variance':
+            print(f"Variable {column} filtered out: Low variance (95% or more subjects have the same value)")
+        elif analysis['n_valid'] / n_cohort <= MIN_VALID_FRACTION:
+            print(f"Variable {column} filtered out: {analysis['n_valid']} valid entries out of {n_cohort} ({analysis['n_valid']/n_cohort*100:.1f}%)")
+        if analysis['n_valid'] / n_cohort > MIN_VALID_FRACTION and analysis['var_type'] != 'low_variance':
+            file_rows.append({
+                'domain': domain_name,
+                'filename': file.name,
+                'variable': column,
+                'n_valid': int(analysis['n_valid']),
+                'n_total': n_cohort,
+                'n_unique': int(analysis['n_unique']),
+                'value_range': analysis['value_range'],
+                'var_type': analysis['var_type']
+            })
+    # Baseline cohort rows x (ID, event and candidate columns), as the frame they were computed from
+    file_record.rows_out, file_record.cols_out = total_subjects, len(file_stats['columns']) + 2
+    file_record.extra['variables_kept'] = len(file_rows)
+    return file_rows
+
+def analyze_file(file, domain_name, df_future):
+    """Analyze one parent-reported file (being read by the prefetcher) and return summary rows for the variables that pass the filters."""
+    with PROFILER.file(file) as file_record:
+        df = df_future.result()
+        file_record.set_input(df)
+        file_record.extra['columns_read'] = len(df.columns)
+        file_record.extra['columns_in_file'] = len(COLUMN_CATALOG.columns(file))
+        return file_summary_rows(file, domain_name, file_partial_stats(df), file_record)
+
+def combine_shard_file(file, domain_name, shard_partials):
+    """Summary rows for one file from the partial statistics its subject shards computed."""
+    with PROFILER.file(file) as file_record:
+        file_record.extra['shards'] = len(shard_partials)
+        return file_summary_rows(file, domain_name, merge_file_stats(shard_partials), file_record)
+
+def domain_files(data_dir):
+    """Parent-reported files of one domain (only files with '_p_' in their names)."""
+    return [f for f in data_dir.glob('*.csv') if '_p_' in f.name]
+
+def plan_files(files):
+    """
+    Check the cache for each file: returns (file, cache_key, cached rows or None, header)
+    tuples; files that need re-analysis are planned from their header alone.
+    """
+    plans = []
+    for file in files:
+        try:
+            cache_key = file_cache_key(file)
+            cached_rows = ANALYSIS_CACHE.get('file_rows', cache_key)
+            header = COLUMN_CATALOG.columns(file) if cached_rows is None else None
+        except Exception as e:
+            print(f"Error processing {file.name}: {str(e)}")
+            continue
+        plans.append((file, cache_key, cached_rows, header))
+    return plans
+
+def analyze_domain(data_dir, domain_name, shard_stats=None):
+    """
+    Analyze every parent-reported file of one domain. shard_stats optionally maps
+    file paths to the partial statistics computed by subject-shard workers; those
+    files are combined from the shards instead of being read here.
+    """
     print(f"\nAnalyzing {domain_name} data...")
     print("=" * 100)
     
     summary_rows = []
-    # Only get files with '_p_' in their names
-    files = [f for f in data_dir.glob('*.csv') if '_p_' in f.name]
+    files = domain_files(data_dir)
+    shard_stats = shard_stats or {}
     
     print(f"\nFound {len(files)} parent-reported files in {domain_name}:")
     for f in files:
@@ -147,102 +404,101 @@ def analyze_domain(data_dir, domain_name):
         print(f"Warning: No parent-reported CSV files found in {data_dir}")
         return summary_rows
     
-    # Define specific time variables to exclude
-    excluded_time_vars = {
-        'su_y_plus.csv': ['pls1_sess_date_time'],
-        'ph_y_sal_horm.csv': ['hormone_sal_start_y', 'hormone_sal_end_y', 'hormone_sal_wake_y', 'hormone_sal_freezer_y'],
-        'ph_p_meds.csv': ['curr_time'],
-        'ph_y_anthro.csv': ['anthroheightcalc', 'anthroweightcalc']
-    }
+    plans = plan_files(files)
+
+    # Read the files to analyze in background threads, a few files ahead of the analysis below
+    reader = prefetch_csv((file, file, file_read_kwargs(file, header))
+                          for file, _, cached_rows, header in plans
+                          if cached_rows is None and 'eventname' in header and str(file) not in shard_stats)
     
-    for file in files:
+    for file, cache_key, file_rows, header in plans:
         print(f"\nProcessing {file.name}:")
         print("-" * 50)
         try:
-            df = pd.read_csv(file)
-            if 'eventname' not in df.columns:
+            if file_rows is not None:
+                print(f"Unchanged since the last run: reusing {len(file_rows)} cached variables.")
+            elif 'eventname' not in header:
                 print(f"Warning: No 'eventname' column found in {file.name}")
-                continue
-            baseline_df = df[df['eventname'] == 'baseline_year_1_arm_1']
-            baseline_df = baseline_df[baseline_df['src_subject_id'].isin(REFERENCE_COHORT)]
-            total_subjects = len(baseline_df)
-            print(f"Total number of subjects in reference cohort: {total_subjects}")
-            if total_subjects == 0:
-                print(f"Warning: No subjects from reference cohort found in {file.name}")
-                continue
-            file_exclusions = excluded_time_vars.get(file.name, [])
-
-            # Identify first variable for each redundancy category
-            keep_vars = {}
-            for category, patterns in REDUNDANT_PATTERNS.items():
-                for col in baseline_df.columns:
-                    col_lower = col.lower()
-                    if any(pattern in col_lower for pattern in patterns):
-                        keep_vars[category] = col
-                        break
-
-            is_cbcl_or_asr = file.name in ['mh_p_cbcl.csv', 'mh_p_asr.csv']
-            for column in baseline_df.columns:
-                col_lower = column.lower()
-                # For CBCL and ASR files, only include variables with 'q' in their name
-                if is_cbcl_or_asr and 'q' not in col_lower:
-                    continue
-                # Always keep the first variable for each redundancy category
-                keep_redundant = any(column == v for v in keep_vars.values())
-                # Skip redundant variables, ID columns, event column, metadata columns, columns containing timestamp/language/lang/duration, and demo_brthdat_v2
-                if ((not is_redundant_variable(column) or keep_redundant) and
-                    column not in ['src_subject_id', 'eventname', 'demo_brthdat_v2'] and 
-                    'timestamp' not in col_lower and 
-                    'language' not in col_lower and
-                    'lang' not in col_lower and
-                    'duration' not in col_lower and
-                    column not in file_exclusions and
-                    not column.endswith('_nm') and
-                    not column.endswith('_nt')):
-                    analysis = analyze_variable(baseline_df, column)
-                    if analysis is None:
-                        continue
-                    if analysis['var_type'] == 'low_variance':
-                        print(f"Variable {column} filtered out: Low variance (95% or more subjects have the same value)")
-                    elif analysis['n_valid'] / len(REFERENCE_COHORT) <= 0.75:
-                        print(f"Variable {column} filtered out: {analysis['n_valid']} valid entries out of {len(REFERENCE_COHORT)} ({analysis['n_valid']/len(REFERENCE_COHORT)*100:.1f}%)")
-                    if analysis['n_valid'] / len(REFERENCE_COHORT) > 0.75 and analysis['var_type'] != 'low_variance':
-                        summary_rows.append({
-                            'domain': domain_name,
-                            'filename': file.name,
-                            'variable': column,
-                            'n_valid': analysis['n_valid'],
-                            'n_total': len(REFERENCE_COHORT),
-                            'n_unique': analysis['n_unique'],
-                            'value_range': analysis['value_range'],
-                            'var_type': analysis['var_type']
-                        })
+                file_rows = []
+                ANALYSIS_CACHE.put('file_rows', cache_key, file_rows)
+            elif str(file) in shard_stats:
+                file_rows = combine_shard_file(file, domain_name, shard_stats[str(file)])
+                ANALYSIS_CACHE.put('file_rows', cache_key, file_rows)
+            else:
+                _, df_future = next(reader)
+                file_rows = analyze_file(file, domain_name, df_future)
+                ANALYSIS_CACHE.put('file_rows', cache_key, file_rows)
+            summary_rows.extend(dict(row, domain=domain_name) for row in file_rows)
         
         except Exception as e:
             print(f"Error processing {file.name}: {str(e)}")
             continue
+    reader.close()
     
     return summary_rows
 
+def analyze_shard(shard_index, n_shards):
+    """
+    Partial statistics of one subject shard for every file that needs analysis
+    (files with cached results are skipped). Returns {file path: file_partial_stats}.
+    Runs as a local worker process or as a separate --shard-index command.
+    """
+    plans = [plan for data_dir in DOMAINS.values() if data_dir.exists()
+             for plan in plan_files(domain_files(data_dir))]
+    reads = ((file, file, file_read_kwargs(file, header))
+             for file, _, cached_rows, header in plans if cached_rows is None and 'eventname' in header)
+    partials = {}
+    reader = prefetch_csv(reads)
+    for file, df_future in reader:
+        try:
+            partials[str(file)] = file_partial_stats(df_future.result(), shard=(shard_index, n_shards))
+        except Exception as e:
+            print(f"Error processing {file.name} in shard {shard_index}: {str(e)}")
+    reader.close()
+    print(f"Shard {shard_index + 1}/{n_shards}: {len(partials)} files summarized.")
+    return partials
+
+def collect_shard_stats(args):
+    """Partial statistics from all subject shards, by file: run locally or loaded from --shard-index runs."""
+    if args.combine:
+        shard_results = load_shard_results('analysis', args.shards)
+    else:
+        with PROFILER.stage('analyze_shards') as rec:
+            shard_results = run_shards(analyze_shard, args.shards, args.workers)
+            rec.extra['shards'] = args.shards
+    shard_stats = {}
+    for partials in shard_results:
+        for path, partial in partials.items():
+            shard_stats.setdefault(path, []).append(partial)
+    # Only files that every shard summarized can be combined exactly
+    return {path: partials for path, partials in shard_stats.items() if len(partials) == args.shards}
+
 def main():
-    # Define domains and their paths
-    domains = {
-        'Mental Health': Path('data/core/mental-health'),
-        'Substance Use': Path('data/core/substance-use'),
-        'Physical Health': Path('data/core/physical-health'),
-        'Culture & Environment': Path('data/core/culture-environment'),
-        'ABCD General': Path('data/core/abcd-general')
-    }
+    parser = argparse.ArgumentParser(description="Profile the parent-reported variables of every domain.")
+    args = add_shard_arguments(parser).parse_args()
+    PROFILER.start()
+    reference_cohort()
+
+    # Sharded mode: subject shards are summarized independently, then combined below
+    shard_stats = None
+    if args.shard_index is not None:
+        save_shard_result(analyze_shard(args.shard_index, args.shards), 'analysis', args.shard_index, args.shards)
+        PROFILER.write_report()
+        return
+    if args.shards > 1:
+        shard_stats = collect_shard_stats(args)
     
     all_summary_rows = []
     
     # Analyze each domain
-    for domain_name, data_dir in domains.items():
+    for domain_name, data_dir in DOMAINS.items():
         if not data_dir.exists():
             print(f"Warning: Directory {data_dir} does not exist")
             continue
             
-        domain_rows = analyze_domain(data_dir, domain_name)
+        with PROFILER.stage(f"analyze_domain/{domain_name}") as rec:
+            domain_rows = analyze_domain(data_dir, domain_name, shard_stats)
+            rec.extra['variables_kept'] = len(domain_rows)
         all_summary_rows.extend(domain_rows)
     
     # Print combined summary table
@@ -285,10 +541,22 @@ def main():
     final_table = pd.DataFrame(all_summary_rows)
     print(final_table.to_string(index=False))
     
-    # Save the table to CSV
-    output_csv_path = os.path.join('results', 'variable_analysis_results.csv')
-    final_table.to_csv(output_csv_path, index=False)
-    print(f"\nResults saved to: {output_csv_path}")
+    # Save the table with the fingerprints of every file it summarizes
+    with PROFILER.stage('save_results') as rec:
+        input_files = [f for data_dir in DOMAINS.values() if data_dir.exists() for f in domain_files(data_dir)]
+        output_path = write_artifact(final_table, OUTPUT_PATH, stage='analyze_all_domains',
+                                     parameters={'min_valid_fraction': MIN_VALID_FRACTION,
+                                                 'low_variance_fraction': LOW_VARIANCE_FRACTION,
+                                                 'cache_version': ANALYSIS_CACHE_VERSION, 'shards': args.shards},
+                                     inputs=input_fingerprints(input_files, ANALYSIS_CACHE))
+        rec.set_output(final_table)
+    print(f"\nResults saved to: {output_path}")
+
+    ANALYSIS_CACHE.save()
+    print(f"Analysis cache: {ANALYSIS_CACHE.hits['file_rows']} files reused, {ANALYSIS_CACHE.misses['file_rows']} analyzed.")
+
+    PROFILER.print_summary()
+    PROFILER.write_report()
 
 if __name__ == "__main__":
     main() 
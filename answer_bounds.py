@@ -0,0 +1,249 @@
+import numpy as np
+
+from prediction_contributions import _node_values
+
+# Remaining answer combinations (after merging answers the forest cannot tell apart) up to which
+# the bounds are computed exactly with one batched predict_proba call; above it the per-tree bound is used
+MAX_EXACT_COMPLETIONS = 2048
+# get_prediction reports Higher Risk when P(Higher Risk) is above this
+DECISION_CUTOFF = 0.5
+
+
+class AnswerBounds:
+    """
+    Minimum and maximum P(Higher Risk) a fitted forest can still give for a partly
+    answered questionnaire, over every way of answering the remaining questions.
+
+    answer_encodings is {question id: {answer option: encoded model input}}; all
+    other model inputs stay at 0 as in get_prediction. Options of one question that
+    fall between the same pair of split thresholds everywhere in the forest give the
+    same prediction, so each question is reduced to one representative option per
+    threshold interval, and questions the forest never splits on are dropped.
+
+    When few completions remain they are all scored in one batch (exact bounds).
+    Otherwise each tree contributes the smallest and largest leaf value it can still
+    reach given the answered inputs; averaging those over trees gives bounds that
+    always contain the exact ones. Reachability is propagated one tree depth at a
+    time over all trees at once, and several partial answer sets can be bounded in
+    the same pass.
+    """
+
+    def __init__(self, model, feature_names, answer_encodings, positive_class=1):
+        forest = getattr(model, 'regressor', model)
+        self.model = model
+        self.feature_names = list(feature_names)
+        self.n_features = len(self.feature_names)
+        position = {name: i for i, name in enumerate(self.feature_names)}
+        classes = list(getattr(forest, 'classes_', [0, 1]))
+        class_index = classes.index(positive_class) if positive_class in classes else len(classes) - 1
+
+        parents, is_left, split_features, split_thresholds, depths = [], [], [], [], []
+        leaves, leaf_values, tree_starts = [], [], []
+        thresholds_by_feature = {}
+        offset = n_leaves = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            values = _node_values(tree, class_index)
+            internal = np.flatnonzero(tree.children_left >= 0)
+            node_parent = np.full(tree.node_count, -1)
+            node_parent[tree.children_left[internal]] = internal
+            node_parent[tree.children_right[internal]] = internal
+            node_is_left = np.zeros(tree.node_count, dtype=bool)
+            node_is_left[tree.children_left[internal]] = True
+            # Node ids are assigned depth-first, so a parent always precedes its children
+            node_depth = np.zeros(tree.node_count, dtype=int)
+            for node in range(1, tree.node_count):
+                node_depth[node] = node_depth[node_parent[node]] + 1
+            children = np.arange(1, tree.node_count)
+            parents.append(node_parent[children] + offset)
+            is_left.append(node_is_left[children])
+            split_features.append(tree.feature[node_parent[children]])
+            split_thresholds.append(tree.threshold[node_parent[children]])
+            depths.append(node_depth[children])
+            tree_leaves = np.flatnonzero(tree.children_left < 0)
+            tree_starts.append(n_leaves)
+            n_leaves += len(tree_leaves)
+            leaves.append(tree_leaves + offset)
+            leaf_values.append(values[tree_leaves])
+            for feature, threshold in zip(tree.feature[internal], tree.threshold[internal]):
+                thresholds_by_feature.setdefault(int(feature), set()).add(float(threshold))
+            offset += tree.node_count
+
+        self.n_trees = len(forest.estimators_)
+        self.n_nodes = offset
+        self.roots = np.cumsum([0] + [e.tree_.node_count for e in forest.estimators_[:-1]])
+        child_ids = np.concatenate([np.arange(1, e.tree_.node_count) + root
+                                    for e, root in zip(forest.estimators_, self.roots)])
+        depths = np.concatenate(depths)
+        order = np.argsort(depths, kind='stable')
+        self.child_ids = child_ids[order]
+        self.parents = np.concatenate(parents)[order]
+        self.is_left = np.concatenate(is_left)[order]
+        self.split_features = np.concatenate(split_features)[order]
+        self.split_thresholds = np.concatenate(split_thresholds)[order]
+        # Boundaries of each depth level in the sorted node arrays
+        self.level_bounds = np.searchsorted(depths[order], np.arange(1, depths.max() + 2)) if len(depths) else np.array([0])
+        self.leaves = np.concatenate(leaves)
+        self.leaf_values = np.concatenate(leaf_values)
+        self.tree_starts = np.array(tree_starts)
+
+        # One representative option per threshold interval for every question the forest splits on
+        self.question_options = {}
+        self.question_columns = {}
+        for question_id, encodings in answer_encodings.items():
+            column = position.get(question_id)
+            if column is None or column not in thresholds_by_feature or not encodings:
+                continue
+            thresholds = np.array(sorted(thresholds_by_feature[column]))
+            representatives = {}
+            for option, value in encodings.items():
+                interval = int(np.searchsorted(thresholds, value, side='left'))
+                representatives.setdefault(interval, (option, float(value)))
+            if len(representatives) > 1:
+                self.question_options[question_id] = [representatives[k] for k in sorted(representatives)]
+                self.question_columns[question_id] = column
+        self.answer_encodings = answer_encodings
+
+    @property
+    def relevant_questions(self):
+        """Questions whose answer can change the prediction."""
+        return list(self.question_options)
+
+    def encode(self, answers):
+        """Model input row for the answered questions (everything else 0, as in get_prediction)."""
+        row = np.zeros(self.n_features)
+        for question_id, option in answers.items():
+            column = self.question_columns.get(question_id)
+            if column is not None:
+                row[column] = self.answer_encodings[question_id].get(option, 0.0)
+        return row
+
+    def remaining(self, answers):
+        return [q for q in self.question_options if q not in answers]
+
+    def n_completions(self, answers):
+        return int(np.prod([len(self.question_options[q]) for q in self.remaining(answers)]))
+
+    def bounds(self, answers):
+        """
+        Return {'min', 'max', 'exact', 'remaining', 'decided'} for a partial answer dict.
+        decided is the class the full questionnaire must end in (0 or 1), or None if
+        the remaining answers can still move the estimate across DECISION_CUTOFF.
+        """
+        remaining = self.remaining(answers)
+        base = self.encode(answers)
+        exact = self.n_completions(answers) <= MAX_EXACT_COMPLETIONS
+        if exact:
+            grid = np.repeat(base[None, :], self.n_completions(answers), axis=0)
+            if remaining:
+                columns = [self.question_columns[q] for q in remaining]
+                values = [[value for _, value in self.question_options[q]] for q in remaining]
+                grid[:, columns] = np.array(np.meshgrid(*values, indexing='ij')).reshape(len(remaining), -1).T
+            probabilities = self.model.predict_proba(grid)[:, 1]
+            low, high = float(probabilities.min()), float(probabilities.max())
+        else:
+            lows, highs = self.tree_bounds(*self._intervals(base, [remaining]))
+            low, high = float(lows[0]), float(highs[0])
+        return {'min': low, 'max': high, 'exact': exact, 'remaining': remaining,
+                'decided': decided_class(low, high)}
+
+    def completion(self, answers, target=None, random_state=0):
+        """
+        A full answer set extending `answers` whose estimate is achievable: of the
+        remaining completions (all of them, or MAX_EXACT_COMPLETIONS random ones when
+        there are more), the one scored closest to `target` (default: the middle of
+        their range). Returns (completed answers, P(Higher Risk) of the completion).
+        """
+        remaining = self.remaining(answers)
+        base = self.encode(answers)
+        if not remaining:
+            return dict(answers), float(self.model.predict_proba(base[None, :])[0, 1])
+        sizes = [len(self.question_options[q]) for q in remaining]
+        if self.n_completions(answers) <= MAX_EXACT_COMPLETIONS:
+            choices = np.array(np.meshgrid(*[np.arange(n) for n in sizes], indexing='ij')).reshape(len(remaining), -1).T
+        else:
+            rng = np.random.default_rng(random_state)
+            choices = np.column_stack([rng.integers(n, size=MAX_EXACT_COMPLETIONS) for n in sizes])
+        grid = np.repeat(base[None, :], len(choices), axis=0)
+        for j, question_id in enumerate(remaining):
+            values = np.array([value for _, value in self.question_options[question_id]])
+            grid[:, self.question_columns[question_id]] = values[choices[:, j]]
+        probabilities = self.model.predict_proba(grid)[:, 1]
+        if target is None:
+            target = (probabilities.min() + probabilities.max()) / 2
+        best = int(np.argmin(np.abs(probabilities - target)))
+        completed = dict(answers)
+        for j, question_id in enumerate(remaining):
+            completed[question_id] = self.question_options[question_id][choices[best, j]][0]
+        return completed, float(probabilities[best])
+
+    def question_priority(self, answers):
+        """
+        Rank the unanswered questions by how much answering each one is expected to
+        narrow the achievable range (average over its options, per-tree bounds).
+        Returns [(question id, narrowing in probability points), ...], largest first.
+        """
+        remaining = self.remaining(answers)
+        if not remaining:
+            return []
+        base = self.encode(answers)
+        scenarios = [(None, remaining)]
+        for question_id in remaining:
+            others = [q for q in remaining if q != question_id]
+            for _, value in self.question_options[question_id]:
+                row = base.copy()
+                row[self.question_columns[question_id]] = value
+                scenarios.append((row, others))
+        rows = [base if row is None else row for row, _ in scenarios]
+        lows, highs = self.tree_bounds(*self._intervals(np.array(rows), [free for _, free in scenarios]))
+        widths = highs - lows
+        priority, i = [], 1
+        for question_id in remaining:
+            n_options = len(self.question_options[question_id])
+            priority.append((question_id, float(widths[0] - widths[i:i + n_options].mean())))
+            i += n_options
+        return sorted(priority, key=lambda item: -item[1])
+
+    def _intervals(self, rows, free_questions):
+        """Per-feature [low, high] input ranges for each scenario: answered inputs fixed, free ones spanning their options."""
+        low = np.atleast_2d(np.array(rows, dtype=np.float64))
+        high = low.copy()
+        for s, free in enumerate(free_questions):
+            for question_id in free:
+                values = [value for _, value in self.question_options[question_id]]
+                column = self.question_columns[question_id]
+                low[s, column], high[s, column] = min(values), max(values)
+        return low, high
+
+    def tree_bounds(self, low, high):
+        """
+        Per-tree leaf bounds for inputs constrained to [low, high] (one scenario per row).
+        A node is reachable when its parent is and some input in the range takes its
+        branch: the left branch (x <= threshold) needs low <= threshold, the right one
+        needs high > threshold.
+        """
+        n_scenarios = low.shape[0]
+        allowed = np.where(self.is_left,
+                           low[:, self.split_features] <= self.split_thresholds,
+                           high[:, self.split_features] > self.split_thresholds)
+        reachable = np.zeros((n_scenarios, self.n_nodes), dtype=bool)
+        reachable[:, self.roots] = True
+        start = 0
+        for end in self.level_bounds:
+            if end > start:
+                level = slice(start, end)
+                reachable[:, self.child_ids[level]] = reachable[:, self.parents[level]] & allowed[:, level]
+            start = end
+        leaf_reachable = reachable[:, self.leaves]
+        tree_min = np.minimum.reduceat(np.where(leaf_reachable, self.leaf_values, np.inf), self.tree_starts, axis=1)
+        tree_max = np.maximum.reduceat(np.where(leaf_reachable, self.leaf_values, -np.inf), self.tree_starts, axis=1)
+        return np.clip(tree_min.mean(axis=1), 0.0, 1.0), np.clip(tree_max.mean(axis=1), 0.0, 1.0)
+
+
+def decided_class(low, high, cutoff=DECISION_CUTOFF):
+    """The class every completion ends in, or None if the range straddles the cutoff."""
+    if low > cutoff:
+        return 1
+    if high <= cutoff:
+        return 0
+    return None
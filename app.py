@@ -2,9 +2,18 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import os
 # Ensure these imports point to the correct, updated logic and mappings
-from prediction_calculator_logic import get_prediction, ALL_MODEL_FEATURES
+from prediction_calculator_logic import (get_prediction, get_model_version, get_cohort_percentile, get_answer_bounds,
+                                         get_answer_completion, get_question_priority, get_what_if, ALL_MODEL_FEATURES,
+                                         start_model_watcher)
 from question_mappings import QUESTION_MAPPINGS
+from serving_metrics import SERVING_METRICS, METRICS_DUMP_PATH
+from audit_log import AUDIT_LOG
+from datetime import datetime
+
+# Hot-reload the served model when its registry pointer moves (started once per server process)
+start_model_watcher()
 
 # --- Page Configuration ---
 st.set_page_config(page_title="Child Behavioral Insights Estimator", layout="wide")
@@ -290,13 +299,31 @@ def init_session_state():
         st.session_state.prediction_probs = None
     if 'show_recommendation' not in st.session_state:
         st.session_state.show_recommendation = False
+    if 'prediction_contributions' not in st.session_state:
+        st.session_state.prediction_contributions = None
+    if 'prediction_percentile' not in st.session_state:
+        st.session_state.prediction_percentile = None
+    if 'prediction_bounds' not in st.session_state:
+        st.session_state.prediction_bounds = None
+    if 'prediction_what_if' not in st.session_state:
+        st.session_state.prediction_what_if = None
+    if 'prediction_assumed' not in st.session_state:
+        st.session_state.prediction_assumed = {}
 
 init_session_state()
 
+def answer_label(answer, labels, assumed=None):
+    """'Your answer' cell: the option label (raw value for numeric questions), or which answer was assumed if it was left open."""
+    if answer is not None:
+        return labels.get(answer, answer)
+    if assumed is not None:
+        return f"Not answered (assumed {labels.get(assumed, assumed)})"
+    return 'Not answered'
+
 # --- Reset Function ---
 def start_again():
     # ... (reset function remains the same) ...
-    keys_to_reset = ['answers', 'show_results', 'prediction_class', 'prediction_probs', 'show_recommendation']
+    keys_to_reset = ['answers', 'show_results', 'prediction_class', 'prediction_probs', 'show_recommendation', 'prediction_contributions', 'prediction_percentile', 'prediction_bounds', 'prediction_what_if', 'prediction_assumed']
     for key in keys_to_reset:
         if key in st.session_state:
             del st.session_state[key]
@@ -384,7 +411,7 @@ if not st.session_state.show_results:
 
             if submitted:
                 collected_answers = {}
-                all_answered = True
+                unanswered = []
                 for question_map in QUESTION_MAPPINGS: # Iterate again to collect based on type
                     feature_id = question_map['id']
                     options_dict = question_map['options']
@@ -396,34 +423,66 @@ if not st.session_state.show_results:
                         if val_from_input is not None: # Should always have a value from number_input
                             collected_answers[feature_id] = val_from_input
                         else:
-                            # This case should ideally not be hit if number_input has a default
-                            all_answered = False 
-                            st.warning(f"Please ensure a value is entered for: {question_map['question_text']}", icon="⚠️")
-                            break
+                            unanswered.append(feature_id)
                     else: # Radio button based inputs
                         selected_label = st.session_state.get(f"{feature_id}_radio")
                         if selected_label is not None:
                             collected_answers[feature_id] = options_dict[selected_label] # Map label back to value
                         else:
-                            all_answered = False # A radio option was not selected
-                            st.warning(f"Please answer question: {question_map['question_text']}", icon="⚠️")
-                            break
-                
-                if not all_answered:
-                    st.session_state.answers = collected_answers # Store partially collected answers for pre-filling
-                    st.warning("Please answer all questions before submitting.", icon="⚠️")
+                            unanswered.append(feature_id) # A radio option was not selected
+
+                st.session_state.answers = collected_answers # Also keeps partial answers for pre-filling
+                # With questions left open, estimate anyway if no way of answering them could change the outcome
+                answer_bounds = get_answer_bounds(collected_answers) if unanswered else None
+                decided_early = answer_bounds is not None and answer_bounds['decided'] is not None
+                pred_class = pred_probs = contributions = None
+                scored_answers = collected_answers
+                if decided_early:
+                    # get_prediction would encode the open questions as 0, which is not an answer anyone
+                    # can give; score an achievable completion from the middle of the range instead
+                    scored_answers = get_answer_completion(collected_answers, (answer_bounds['min'] + answer_bounds['max']) / 2)
+                    decided_early = scored_answers is not None
+                if not unanswered or decided_early:
+                    pred_class, pred_probs, contributions = get_prediction(scored_answers, return_contributions=True)
+                    if decided_early and pred_class != answer_bounds['decided']:
+                        pred_class = pred_probs = None
+                        decided_early = False
+
+                if unanswered and not decided_early:
+                    question_numbers = {q['id']: i + 1 for i, q in enumerate(QUESTION_MAPPINGS)}
+                    open_questions = [q for q in get_question_priority(collected_answers) if q in unanswered]
+                    st.warning("Please answer all questions before submitting. Still open: questions "
+                               + ", ".join(str(question_numbers[q]) for q in open_questions) + ".", icon="⚠️")
+                    if answer_bounds is not None:
+                        st.info(f"Depending on the remaining answers, the estimate could still range from "
+                                f"{answer_bounds['min']*100:.1f}% to {answer_bounds['max']*100:.1f}%. "
+                                f"The questions listed first can change it the most.")
                     # No rerun here, let user fix on the same page
+                elif pred_class is not None and pred_probs is not None:
+                    # Record the estimate; this only queues it, the file write happens in the background
+                    AUDIT_LOG.submit({
+                        'timestamp': datetime.now().isoformat(timespec='milliseconds'),
+                        'model_version': get_model_version(),
+                        'answers': st.session_state.answers,
+                        'predicted_class': pred_class,
+                        'probabilities': pred_probs,
+                        # Early estimates are partial: scored on a completion of the open questions
+                        **({'unanswered': unanswered, 'bounds': answer_bounds, 'scored_answers': scored_answers}
+                           if unanswered else {}),
+                    })
+                    st.session_state.prediction_class = pred_class
+                    st.session_state.prediction_probs = pred_probs
+                    st.session_state.prediction_contributions = contributions
+                    st.session_state.prediction_percentile = get_cohort_percentile(pred_probs[1])
+                    st.session_state.prediction_bounds = answer_bounds if unanswered else None
+                    # Scored on the completion too, so the open questions are not encoded as 0
+                    st.session_state.prediction_what_if = get_what_if(scored_answers)[1]
+                    # Answers assumed for the open questions, labelled as such in the results tables
+                    st.session_state.prediction_assumed = {q: scored_answers[q] for q in unanswered}
+                    st.session_state.show_results = True
+                    st.rerun()
                 else:
-                    st.session_state.answers = collected_answers
-                    # Assuming get_prediction can handle the raw numerical values collected
-                    pred_class, pred_probs = get_prediction(st.session_state.answers)
-                    if pred_class is not None and pred_probs is not None:
-                        st.session_state.prediction_class = pred_class
-                        st.session_state.prediction_probs = pred_probs
-                        st.session_state.show_results = True
-                        st.rerun()
-                    else:
-                        st.error("Could not retrieve prediction. Please ensure the model is loaded correctly.")
+                    st.error("Could not retrieve prediction. Please ensure the model is loaded correctly.")
 
 # --- Results Section ---
 if st.session_state.show_results:
@@ -464,8 +523,76 @@ if st.session_state.show_results:
             st.markdown(f'<p class="probability-title">{prob_title}</p>', unsafe_allow_html=True)
             st.progress(float(max_prob))
             st.markdown(f'<p class="probability-value">{max_prob*100:.2f}%</p>', unsafe_allow_html=True)
+            # Where this estimate sits among the children of the study cohort
+            percentile = st.session_state.prediction_percentile
+            if percentile is not None:
+                st.markdown(f'<p class="bottom-line-summary">This estimate is higher than for about '
+                            f'<strong>{percentile:.0f}%</strong> of children in the ABCD study cohort.</p>',
+                            unsafe_allow_html=True)
+            # Estimate given before every question was answered (the open ones could not change the outcome)
+            bounds = st.session_state.prediction_bounds
+            if bounds is not None:
+                st.caption(f"{len(QUESTION_MAPPINGS) - len(st.session_state.answers)} question(s) were left unanswered. "
+                           f"Whatever the answers, the estimate would stay between {bounds['min']*100:.1f}% and "
+                           f"{bounds['max']*100:.1f}%, so the outcome would be the same. The percentage shown "
+                           f"is for one possible way of answering them, from the middle of that range.")
             st.markdown('</div>', unsafe_allow_html=True)
 
+        # Per-answer breakdown: how much each answer moved the estimate away from the cohort average
+        contributions = st.session_state.prediction_contributions
+        assumed = st.session_state.prediction_assumed
+        if contributions:
+            with st.expander("Which answers influenced this estimate?"):
+                rows = []
+                assumed_effect = 0.0
+                for question_map in QUESTION_MAPPINGS:
+                    effect = contributions.get(question_map['id'], 0.0)
+                    answer = st.session_state.answers.get(question_map['id'])
+                    # Show the option label for radio questions, the raw value for numeric ones
+                    labels = {v: k for k, v in question_map['options'].items()} if question_map['scale_type'] != 'Continuous' else {}
+                    if answer is None:
+                        # The effect comes from the assumed answer, not from anything the parent said
+                        assumed_effect += effect
+                        effect = None
+                    rows.append({
+                        'Question': question_map['question_text'].replace('**', ''),
+                        'Your answer': answer_label(answer, labels, assumed.get(question_map['id'])),
+                        'Effect (percentage points)': None if effect is None else round(effect * 100, 2),
+                    })
+                breakdown_df = pd.DataFrame(rows)
+                breakdown_df = breakdown_df.reindex(breakdown_df['Effect (percentage points)'].abs().sort_values(ascending=False, na_position='last').index)
+                st.markdown(f"Average estimate across the study cohort: **{contributions['baseline']*100:.2f}%**. "
+                            "Positive values raised this estimate, negative values lowered it.")
+                st.dataframe(breakdown_df, hide_index=True, use_container_width=True)
+                if assumed:
+                    st.caption(f"Unanswered questions have no effect listed; together, the answers assumed for them "
+                               f"moved this estimate by {assumed_effect*100:+.2f} percentage points.")
+                if abs(contributions.get('other', 0.0)) >= 0.0005:
+                    st.caption(f"Other model inputs not asked in this questionnaire: {contributions['other']*100:+.2f} percentage points.")
+
+        # What-if view: the estimate with any single answer changed
+        what_if_rows = st.session_state.prediction_what_if
+        if what_if_rows:
+            with st.expander("How would the estimate change if one answer were different?"):
+                questions = {q['id']: q for q in QUESTION_MAPPINGS}
+                rows = []
+                for row in what_if_rows:
+                    question_map = questions[row['question_id']]
+                    labels = {v: k for k, v in question_map['options'].items()} if question_map['scale_type'] != 'Continuous' else {}
+                    rows.append({
+                        'Question': question_map['question_text'].replace('**', ''),
+                        'Your answer': answer_label(None if row['question_id'] in assumed else row['answer'], labels,
+                                                    assumed.get(row['question_id'])),
+                        'Alternative answer': labels.get(row['alternative'], row['alternative']),
+                        'Estimate': f"{row['probability']*100:.1f}%",
+                        'Change (percentage points)': round(row['delta'] * 100, 2),
+                    })
+                what_if_df = pd.DataFrame(rows)
+                what_if_df = what_if_df.reindex(what_if_df['Change (percentage points)'].abs().sort_values(ascending=False, kind='stable').index)
+                st.markdown("Each row changes one answer and keeps all others as submitted"
+                            + (", with unanswered questions at the assumed answers shown." if assumed else "."))
+                st.dataframe(what_if_df, hide_index=True, use_container_width=True)
+
 
         # Disclaimer box
         st.markdown("""
@@ -531,5 +658,27 @@ if st.session_state.show_results:
 
         st.markdown('</div>', unsafe_allow_html=True) # Close .results-column
 
+# --- Admin Panel: serving metrics ---
+# Shown only when the server is started with APP_ADMIN_PANEL=1; visitors cannot turn it on
+def render_admin_panel():
+    with st.sidebar.expander("Admin: Serving Metrics", expanded=True):
+        snapshot = SERVING_METRICS.snapshot()
+        st.write(f"Process {snapshot['pid']}, up {snapshot['uptime_s']:.0f}s")
+        st.write(f"Serving model version: {get_model_version()}")
+        st.table(pd.DataFrame([snapshot['counters']]).T.rename(columns={0: 'count'}))
+        latency_df = pd.DataFrame(snapshot['latency']).T[['count', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']]
+        st.table(latency_df)
+        st.write("Audit log:")
+        st.table(pd.DataFrame([AUDIT_LOG.stats()]).T.rename(columns={0: 'count'}))
+        if st.button("Dump metrics to file", key="dump_metrics_btn"):
+            dump_path = SERVING_METRICS.dump(METRICS_DUMP_PATH)
+            st.success(f"Metrics written to {dump_path}")
+        if st.button("Reset metrics", key="reset_metrics_btn"):
+            SERVING_METRICS.reset()
+            st.rerun()
+
+if os.environ.get('APP_ADMIN_PANEL') == '1':
+    render_admin_panel()
+
 # --- Footer Placeholder (Optional) ---
 # st.markdown("<div style='text-align: center; margin-top: 2rem; color: grey;'>App Footer</div>", unsafe_allow_html=True)
@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from analysis_cache import AnalysisCache
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Without pyarrow, artifacts are written and read as CSV
+    pa = pq = None
+
+# Intermediate tables in results/ are stored as Parquet: typed columns, compressed, with
+# the schema and producer metadata embedded in the file
+ARTIFACT_SUFFIX = '.parquet'
+ARTIFACT_COMPRESSION = os.environ.get('ARTIFACT_COMPRESSION', 'zstd')
+# Set to 1 to also write a CSV copy of every artifact (for spreadsheets or older scripts)
+EXPORT_CSV = os.environ.get('EXPORT_CSV', '0') == '1'
+# Schema metadata key holding the producer metadata
+METADATA_KEY = b'pipeline_artifact'
+
+
+def artifact_path(path):
+    """Artifact file for a table name or path, e.g. results/merged_variables(.csv) -> results/merged_variables.parquet"""
+    return Path(path).with_suffix(ARTIFACT_SUFFIX)
+
+
+def csv_path_for(path):
+    return Path(path).with_suffix('.csv')
+
+
+def input_fingerprints(paths, cache=None):
+    """
+    {path: content hash} of the files a stage read. Hashes are remembered in the
+    analysis cache by size and mtime, so files seen by an earlier stage are not re-read.
+    """
+    cache = cache or AnalysisCache()
+    fingerprints = {}
+    for path in paths:
+        path = Path(path)
+        if path.exists():
+            fingerprints[str(path)] = cache.file_fingerprint(path)
+    cache.save()
+    return fingerprints
+
+
+def write_artifact(df, path, stage, parameters=None, inputs=None, export_csv=None):
+    """
+    Write df as a typed, compressed Parquet artifact with producer metadata
+    (stage, parameters, input fingerprints) in its schema. A CSV copy is written
+    only when export_csv (default: EXPORT_CSV) is set, or when pyarrow is missing.
+    Returns the path written.
+    """
+    export_csv = EXPORT_CSV if export_csv is None else export_csv
+    path = artifact_path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if pq is None:
+        print("Warning: pyarrow is not installed; writing the artifact as CSV only")
+        export_csv = True
+    else:
+        metadata = {
+            'stage': stage,
+            'parameters': parameters or {},
+            'inputs': inputs or {},
+            'n_rows': len(df),
+            'n_columns': len(df.columns),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                               METADATA_KEY: json.dumps(metadata, default=str).encode()})
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        pq.write_table(table, tmp_path, compression=ARTIFACT_COMPRESSION)
+        os.replace(tmp_path, path)
+    if export_csv:
+        df.to_csv(csv_path_for(path), index=False)
+        if pq is None:
+            return csv_path_for(path)
+    return path
+
+
+def stored_file(path):
+    """The file read_artifact loads for path: the Parquet artifact, else a CSV of the same name (None if neither exists)."""
+    if pq is not None and artifact_path(path).exists():
+        return artifact_path(path)
+    if csv_path_for(path).exists():
+        return csv_path_for(path)
+    return None
+
+
+def read_artifact(path, columns=None):
+    """
+    Load an artifact, reading only `columns` when given (names not in the table are
+    ignored). Falls back to the CSV of the same name when there is no Parquet file
+    (results from before artifacts were written as Parquet, or no pyarrow).
+    """
+    source = stored_file(path)
+    if source is None:
+        raise FileNotFoundError(f"Artifact not found: {artifact_path(path)} (or {csv_path_for(path)})")
+    if source.suffix == ARTIFACT_SUFFIX:
+        if columns is not None:
+            available = set(pq.read_schema(source).names)
+            columns = [c for c in columns if c in available]
+        return pq.read_table(source, columns=columns).to_pandas()
+    if columns is not None:
+        wanted_cols = set(columns)
+        return pd.read_csv(source, usecols=lambda c: c in wanted_cols)
+    return pd.read_csv(source)
+
+
+def artifact_metadata(path):
+    """Producer metadata of an artifact (read from the file footer only), or {} if it has none."""
+    if pq is None or not artifact_path(path).exists():
+        return {}
+    schema_metadata = pq.read_schema(artifact_path(path)).metadata or {}
+    return json.loads(schema_metadata.get(METADATA_KEY, b'{}'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the schema and producer metadata of results/ artifacts, or export them as CSV.")
+    parser.add_argument('paths', nargs='+', help="Artifact files or table names, e.g. results/merged_variables")
+    parser.add_argument('--csv', action='store_true', help="Write a CSV copy next to each artifact.")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        metadata = artifact_metadata(path)
+        print(f"{artifact_path(path)}: stage {metadata.get('stage', 'unknown')}, "
+              f"{metadata.get('n_rows', '?')} rows x {metadata.get('n_columns', '?')} columns, created {metadata.get('created_at', '?')}")
+        if metadata.get('parameters'):
+            print(f"  parameters: {json.dumps(metadata['parameters'])}")
+        print(f"  inputs: {len(metadata.get('inputs', {}))} fingerprinted files")
+        if pq is not None and artifact_path(path).exists():
+            schema = pq.read_schema(artifact_path(path))
+            dtypes = pd.Series([str(field.type) for field in schema]).value_counts()
+            print(f"  column types: {', '.join(f'{t} ({n})' for t, n in dtypes.items())}")
+        if args.csv:
+            read_artifact(path).to_csv(csv_path_for(path), index=False)
+            print(f"  CSV export saved to: {csv_path_for(path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Append-only JSON-lines files, one record per estimate
+AUDIT_LOG_DIR = Path(os.environ.get('AUDIT_LOG_DIR', 'results/audit_log'))
+# Set to 1 to discard records instead of writing them (load tests, local experiments)
+AUDIT_LOG_DISABLED = os.environ.get('AUDIT_LOG_DISABLED', '0') == '1'
+# What submit() does when the queue is full: 'drop_new', 'drop_oldest', or 'block' (wait up to block_timeout)
+AUDIT_BACKPRESSURE = os.environ.get('AUDIT_BACKPRESSURE', 'drop_oldest')
+
+BACKPRESSURE_POLICIES = ('drop_new', 'drop_oldest', 'block')
+
+_STOP = object()
+
+
+class AuditLog:
+    """
+    Non-blocking audit sink.
+
+    submit() only puts the record on a bounded in-memory queue; a background
+    thread serializes queued records and appends them to the current file in
+    batches (one write + fsync per batch). Files rotate by size and by day.
+    When the queue is full the backpressure policy decides whether the new or
+    the oldest record is dropped, or the caller waits briefly; drops are
+    counted. Remaining records are flushed at interpreter exit. A disabled log
+    (enabled=False) discards every record without starting the writer.
+    """
+
+    def __init__(self, log_dir=AUDIT_LOG_DIR, max_queue=10000, batch_size=256, flush_interval=1.0,
+                 max_file_bytes=50 * 1024 * 1024, backpressure=AUDIT_BACKPRESSURE, block_timeout=0.05,
+                 enabled=not AUDIT_LOG_DISABLED):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {backpressure} (expected one of {', '.join(BACKPRESSURE_POLICIES)})")
+        self.log_dir = Path(log_dir)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_file_bytes = max_file_bytes
+        self.backpressure = backpressure
+        self.block_timeout = block_timeout
+        self.enabled = enabled
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._file = None
+        self._file_day = None
+        self.counters = {'submitted': 0, 'written': 0, 'dropped': 0, 'batches': 0, 'write_errors': 0, 'files': 0, 'discarded': 0}
+
+    def submit(self, record):
+        """Queue one record for writing. Never touches the disk; returns False if the record was dropped or discarded."""
+        if not self.enabled:
+            self._count('discarded')
+            return False
+        self._ensure_started()
+        self._count('submitted')
+        try:
+            if self.backpressure == 'block':
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            pass
+        if self.backpressure == 'drop_oldest':
+            try:
+                self._queue.get_nowait()
+                self._queue.put_nowait(record)
+                self._count('dropped')
+                return True
+            except (queue.Empty, queue.Full):
+                pass
+        self._count('dropped')
+        return False
+
+    def close(self, timeout=5.0):
+        """Flush everything still queued and stop the writer thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, queued=self._queue.qsize())
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            if stopping:
+                # Drain whatever arrived before the stop marker was processed
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+            if batch:
+                self._write_batch(batch)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _current_file(self):
+        today = datetime.now().strftime('%Y%m%d')
+        if self._file is not None and (self._file_day != today or self._file.tell() >= self.max_file_bytes):
+            self._file.close()
+            self._file = None
+        if self._file is None:
+            self.log_dir.mkdir(parents=True, exist_ok=True)
+            path = self.log_dir / f"audit_{datetime.now():%Y%m%d_%H%M%S}_{os.getpid()}_{self.counters['files']:04d}.jsonl"
+            self._file = open(path, 'a', encoding='utf-8')
+            self._file_day = today
+            self._count('files')
+        return self._file
+
+    def _write_batch(self, batch):
+        try:
+            lines = ''.join(json.dumps(record, default=str) + '\n' for record in batch)
+            f = self._current_file()
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+            self._count('written', len(batch))
+            self._count('batches')
+        except Exception as e:
+            print(f"Error writing audit log batch of {len(batch)} records: {e}")
+            self._count('write_errors')
+
+
+# Process-wide audit log used by app.py
+AUDIT_LOG = AuditLog()
@@ -0,0 +1,111 @@
+import argparse
+import json
+import time
+
+import numpy as np
+from scipy import sparse
+
+# Sorted P(Higher Risk) of the held-out subjects of the processed cohort, stored in each model bundle
+COHORT_SCORES_FILE = 'cohort_scores.npy'
+# IDs of the subjects the model was not trained on (the rows behind COHORT_SCORES_FILE)
+HOLDOUT_SUBJECTS_FILE = 'holdout_subjects.json'
+# Cohorts larger than this are reduced to evenly spaced order statistics (a quantile sketch),
+# which bounds the bundle size and keeps percentiles accurate to 100 / MAX_COHORT_POINTS points
+MAX_COHORT_POINTS = 20001
+
+
+def score_cohort(model, feature_names, X):
+    """
+    Score every row of X with the model and return the sorted positive-class
+    probabilities. X should only hold rows the model was not trained on (e.g. the
+    test split): forest scores on training rows are pushed toward 0 and 1, which
+    would bias every percentile shown. Columns are aligned to feature_names; a feature
+    missing from X gets 0 (the cohort mean after z-scoring), as at serving time.
+    A sparse X (FEATURE_ENCODING=sparse) is already in feature_names order and is scored as is.
+    """
+    if not sparse.issparse(X):
+        X = X.reindex(columns=list(feature_names), fill_value=0.0)
+        # Pass a frame only to models fitted on one, so sklearn does not warn about feature names
+        X = X if hasattr(model, 'feature_names_in_') else X.to_numpy(dtype=np.float64)
+    scores = np.sort(np.asarray(model.predict_proba(X)[:, 1], dtype=np.float64))
+    if len(scores) > MAX_COHORT_POINTS:
+        positions = np.linspace(0, len(scores) - 1, MAX_COHORT_POINTS).round().astype(int)
+        scores = scores[positions]
+    return scores
+
+
+def save_cohort_scores(scores, path):
+    with open(path, 'wb') as f:
+        np.save(f, np.asarray(scores, dtype=np.float64))
+
+
+def save_holdout_subjects(subject_ids, path):
+    with open(path, 'w') as f:
+        json.dump([str(s) for s in subject_ids], f)
+
+
+def load_holdout_subjects(bundle_dir):
+    """Held-out subject IDs stored in a bundle, or None for bundles published without them."""
+    path = bundle_dir / HOLDOUT_SUBJECTS_FILE
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+class CohortPercentiles:
+    """Percentile of an estimate within the cohort, by binary search over the sorted cohort scores."""
+
+    def __init__(self, sorted_scores):
+        self.scores = np.asarray(sorted_scores, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.scores)
+
+    def percentile(self, probability):
+        """
+        Share (0-100) of the cohort scored below `probability`; cohort members with
+        exactly the same score count as half, so a tie with many subjects lands in the middle.
+        """
+        if not len(self.scores):
+            return None
+        below = np.searchsorted(self.scores, probability, side='left')
+        at_or_below = np.searchsorted(self.scores, probability, side='right')
+        return float(100.0 * (below + at_or_below) / (2 * len(self.scores)))
+
+    @classmethod
+    def load(cls, path):
+        return cls(np.load(path, allow_pickle=False))
+
+
+def main():
+    from model_registry import ModelRegistry, DEFAULT_POINTER
+
+    parser = argparse.ArgumentParser(description="Show the cohort score distribution stored in a model bundle.")
+    parser.add_argument('--pointer', default=DEFAULT_POINTER, help="Registry pointer to inspect (default: current).")
+    parser.add_argument('--version', help="Model version to inspect instead of a pointer.")
+    args = parser.parse_args()
+
+    registry = ModelRegistry()
+    version = args.version or registry.get_pointer(args.pointer)
+    if version is None:
+        print(f"Pointer '{args.pointer}' is not set.")
+        return
+    path = registry.version_path(version) / COHORT_SCORES_FILE
+    if not path.exists():
+        print(f"Model version {version} has no {COHORT_SCORES_FILE}; retrain to generate it.")
+        return
+    cohort = CohortPercentiles.load(path)
+    print(f"Model version {version}: {len(cohort)} cohort scores")
+    for q in (10, 25, 50, 75, 90, 95, 99):
+        print(f"  p{q}: {np.percentile(cohort.scores, q):.4f}")
+
+    probes = np.random.default_rng(0).random(10000)
+    start = time.perf_counter()
+    for probability in probes:
+        cohort.percentile(probability)
+    print(f"Lookup latency: {(time.perf_counter() - start) / len(probes) * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import argparse
+import csv
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+
+# Root of the ABCD tables and where the header index is kept between runs
+DATA_ROOT = Path('data/core')
+CATALOG_PATH = Path('results/column_catalog.json')
+
+
+def read_header(path):
+    """Return the column names of a CSV file by reading only its first line."""
+    with open(path, newline='') as f:
+        return next(csv.reader(f), [])
+
+
+def sample_dtypes(path, sample_rows):
+    """Infer column dtypes from the first sample_rows rows."""
+    sample = pd.read_csv(path, nrows=sample_rows)
+    return {col: str(dtype) for col, dtype in sample.dtypes.items()}
+
+
+class ColumnCatalog:
+    """
+    Index of every CSV under the data tree: its header, optionally sampled
+    dtypes, and a variable -> [(domain directory, file, dtype)] lookup.
+
+    Building it reads one line per file (plus sample_rows rows when dtypes
+    are requested). Entries are keyed by path and reused while the file's
+    size and mtime are unchanged, so refreshing the catalog is mostly stat calls.
+    """
+
+    def __init__(self, files=None, root=DATA_ROOT):
+        self.root = Path(root)
+        self.files = files or {}
+        self._variables = None
+
+    @classmethod
+    def build(cls, root=DATA_ROOT, sample_rows=0, previous=None):
+        root = Path(root)
+        previous_files = previous.files if previous is not None else {}
+        files = {}
+        for path in sorted(root.glob('*/*.csv')):
+            st = path.stat()
+            key = str(path)
+            entry = previous_files.get(key)
+            if (entry is None or entry['size'] != st.st_size or entry['mtime_ns'] != st.st_mtime_ns
+                    or (sample_rows and not entry.get('dtypes'))):
+                entry = {
+                    'domain_dir': path.parent.name,
+                    'filename': path.name,
+                    'size': st.st_size,
+                    'mtime_ns': st.st_mtime_ns,
+                    'columns': read_header(path),
+                    'dtypes': sample_dtypes(path, sample_rows) if sample_rows else {},
+                }
+            files[key] = entry
+        return cls(files, root)
+
+    @classmethod
+    def load(cls, path=CATALOG_PATH, root=DATA_ROOT):
+        """Load a saved catalog, or return an empty one if none exists."""
+        try:
+            with open(path) as f:
+                payload = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return cls(root=root)
+        return cls(payload.get('files', {}), payload.get('root', root))
+
+    def save(self, path=CATALOG_PATH):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({'root': str(self.root), 'files': self.files}, f)
+        os.replace(tmp_path, path)
+
+    def columns(self, path):
+        """Header of one file, read from disk if the file is not in the catalog."""
+        entry = self.files.get(str(Path(path)))
+        if entry is not None:
+            return entry['columns']
+        return read_header(path)
+
+    @property
+    def variables(self):
+        """Dict mapping each column name to the list of files it appears in."""
+        if self._variables is None:
+            self._variables = {}
+            for key, entry in self.files.items():
+                for col in entry['columns']:
+                    self._variables.setdefault(col, []).append({
+                        'domain_dir': entry['domain_dir'],
+                        'filename': entry['filename'],
+                        'path': key,
+                        'dtype': entry['dtypes'].get(col),
+                    })
+        return self._variables
+
+    def locate(self, variable):
+        """Return the files that contain a variable (empty list if none)."""
+        return self.variables.get(variable, [])
+
+    def find_file(self, filename):
+        """Return the path of a file by name anywhere in the tree, or None."""
+        for key, entry in self.files.items():
+            if entry['filename'] == filename:
+                return Path(key)
+        return None
+
+
+def load_column_catalog(root=DATA_ROOT, path=CATALOG_PATH, sample_rows=0):
+    """Load the saved catalog, refresh entries for new or changed files, and save it if anything changed."""
+    previous = ColumnCatalog.load(path, root)
+    catalog = ColumnCatalog.build(root, sample_rows=sample_rows, previous=previous)
+    if catalog.files != previous.files and catalog.files:
+        catalog.save(path)
+    return catalog
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a header-only column catalog of the data tree.")
+    parser.add_argument('--root', default=str(DATA_ROOT), help="Data directory to scan (default: data/core).")
+    parser.add_argument('--output', default=str(CATALOG_PATH), help="Where to write the catalog JSON.")
+    parser.add_argument('--sample-rows', type=int, default=0,
+                        help="Also infer dtypes from this many rows per file (default: headers only).")
+    parser.add_argument('--find', nargs='*', default=[], metavar='VARIABLE',
+                        help="Print the files that contain these variables.")
+    args = parser.parse_args()
+
+    catalog = load_column_catalog(args.root, args.output, sample_rows=args.sample_rows)
+    print(f"Catalog of {len(catalog.files)} files and {len(catalog.variables)} distinct columns saved to {args.output}")
+    for variable in args.find:
+        locations = catalog.locate(variable)
+        if not locations:
+            print(f"{variable}: not found")
+        for location in locations:
+            dtype = f" ({location['dtype']})" if location['dtype'] else ''
+            print(f"{variable}: {location['domain_dir']}/{location['filename']}{dtype}")
+
+
+if __name__ == "__main__":
+    main()
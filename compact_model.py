@@ -0,0 +1,149 @@
+import argparse
+import copy
+import os
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import train_test_split
+
+from prepare_rf_data import load_processed_data, define_features_target, save_model_artifacts
+from question_mappings import QUESTION_MAPPINGS
+from distilled_model import DistilledClassifier
+
+# Where the accuracy-versus-latency table is written
+COMPACTION_RESULTS_PATH = os.path.join('results', 'model_compaction.csv')
+
+TREE_COUNTS = [10, 25, 50]
+DEPTH_CAPS = [4, 6, 8, 12]
+
+
+def truncate_forest(forest, n_trees):
+    """Return a copy of a fitted forest that only keeps its first n_trees trees."""
+    small = copy.copy(forest)
+    small.estimators_ = forest.estimators_[:n_trees]
+    small.n_estimators = len(small.estimators_)
+    return small
+
+
+def measure_candidate(name, model, features, X_test, y_test, teacher_probs=None, latency_rows=200):
+    """AUC, on-disk size, load time and single-row latency for one candidate model."""
+    X_eval = X_test[features]
+    probs = model.predict_proba(X_eval)[:, 1]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_path = os.path.join(tmp_dir, 'model.joblib')
+        joblib.dump(model, model_path)
+        size_bytes = os.path.getsize(model_path)
+        start = time.perf_counter()
+        joblib.load(model_path)
+        load_time_s = time.perf_counter() - start
+
+    # Per-row latency as seen by get_prediction: one row at a time
+    rows = X_eval.to_numpy()[:latency_rows]
+    timings = []
+    for row in rows:
+        start = time.perf_counter()
+        model.predict_proba(row.reshape(1, -1))
+        timings.append(time.perf_counter() - start)
+
+    return {
+        'candidate': name,
+        'n_features': len(features),
+        'auc': roc_auc_score(y_test, probs),
+        'teacher_mae': float(np.mean(np.abs(probs - teacher_probs))) if teacher_probs is not None else 0.0,
+        'size_bytes': size_bytes,
+        'load_time_ms': load_time_s * 1000,
+        'latency_p50_ms': float(np.percentile(timings, 50) * 1000),
+        'latency_p95_ms': float(np.percentile(timings, 95) * 1000),
+    }
+
+
+def build_candidates(teacher, X_train, y_train, random_state=42):
+    """
+    Yield (name, model, feature list) for each compaction strategy:
+    fewer trees, depth caps, features pruned to the questionnaire inputs (or to
+    features the teacher actually splits on), and a distilled student.
+    """
+    all_features = X_train.columns.tolist()
+    yield 'teacher', teacher, all_features
+
+    for n_trees in TREE_COUNTS:
+        if n_trees < teacher.n_estimators:
+            yield f'first_{n_trees}_trees', truncate_forest(teacher, n_trees), all_features
+
+    for depth in DEPTH_CAPS:
+        model = RandomForestClassifier(n_estimators=teacher.n_estimators, max_depth=depth, random_state=random_state)
+        yield f'max_depth_{depth}', model.fit(X_train, y_train), all_features
+
+    # The app only sets the questionnaire inputs; every other feature is left at 0
+    question_features = [q['id'] for q in QUESTION_MAPPINGS if q['id'] in all_features]
+    if question_features:
+        model = RandomForestClassifier(n_estimators=50, random_state=random_state)
+        yield 'question_features_only', model.fit(X_train[question_features], y_train), question_features
+
+    used_features = [f for f, importance in zip(all_features, teacher.feature_importances_) if importance > 0]
+    if len(used_features) < len(all_features):
+        model = RandomForestClassifier(n_estimators=teacher.n_estimators, random_state=random_state)
+        yield 'used_features_only', model.fit(X_train[used_features], y_train), used_features
+
+    # Student regressor trained on the teacher's soft outputs
+    soft_targets = teacher.predict_proba(X_train)[:, 1]
+    student = RandomForestRegressor(n_estimators=20, max_depth=8, random_state=random_state)
+    student.fit(X_train, soft_targets)
+    yield 'distilled_20x8', DistilledClassifier(student, all_features), all_features
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare compacted serving models on accuracy, size and latency.")
+    parser.add_argument('--publish', metavar='CANDIDATE',
+                        help="Publish this candidate to the model registry after the comparison.")
+    parser.add_argument('--pointer', default='current',
+                        help="Registry pointer to move when publishing (default: current).")
+    args = parser.parse_args()
+
+    processed_df = load_processed_data()
+    X, y = define_features_target(processed_df, binarize_target=True, percentile_threshold=0.75)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y if y.nunique() > 1 else None)
+
+    print("Training the default forest as the teacher...")
+    teacher = RandomForestClassifier(random_state=42)
+    teacher.fit(X_train, y_train)
+    teacher_probs = teacher.predict_proba(X_test)[:, 1]
+
+    results = []
+    models = {}
+    for name, model, features in build_candidates(teacher, X_train, y_train):
+        print(f"Measuring candidate {name}...")
+        results.append(measure_candidate(name, model, features, X_test, y_test, teacher_probs))
+        models[name] = (model, features)
+
+    results_df = pd.DataFrame(results)
+    print("\nAccuracy versus latency frontier:")
+    print(results_df.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    results_df.to_csv(COMPACTION_RESULTS_PATH, index=False)
+    print(f"\nComparison table saved to: {COMPACTION_RESULTS_PATH}")
+
+    if args.publish:
+        if args.publish not in models:
+            print(f"Unknown candidate '{args.publish}'. Choose one of: {', '.join(models)}")
+            return
+        model, features = models[args.publish]
+        row = results_df.set_index('candidate').loc[args.publish].to_dict()
+        # Cohort scores from the test rows only: scores of training rows are pushed toward 0 and 1
+        save_model_artifacts(model, features, pointer=args.pointer, cohort_X=X_test,
+                             holdout_subjects=processed_df.loc[X_test.index, 'src_subject_id'], metadata={
+            'model_type': type(model).__name__,
+            'compaction_candidate': args.publish,
+            'target': '3_yr_depress_score',
+            'percentile_threshold': 0.75,
+            'metrics': row,
+        })
+
+
+if __name__ == "__main__":
+    main()
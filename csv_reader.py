@@ -0,0 +1,66 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  (only needed for the multi-threaded 'pyarrow' engine)
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Parser engine: 'pyarrow' parses each file on multiple threads; 'c' is pandas' single-threaded parser
+CSV_ENGINE = os.environ.get('CSV_ENGINE', 'pyarrow' if HAS_PYARROW else 'c')
+# Number of files read at the same time, and how many files may be read ahead of the consumer
+CSV_READ_CONCURRENCY = int(os.environ.get('CSV_READ_CONCURRENCY', '4'))
+CSV_PREFETCH = int(os.environ.get('CSV_PREFETCH', str(CSV_READ_CONCURRENCY)))
+
+
+def read_csv(path, usecols=None, dtype=None, engine=None, **kwargs):
+    """
+    pd.read_csv with the configured engine. With the pyarrow engine, dtypes it
+    cannot apply while parsing (e.g. 'category') are applied after the read,
+    and options it does not support (low_memory) are dropped.
+    """
+    engine = engine or CSV_ENGINE
+    if engine == 'pyarrow' and not HAS_PYARROW:
+        engine = 'c'
+    if engine != 'pyarrow':
+        return pd.read_csv(path, usecols=usecols, dtype=dtype, engine=engine, **kwargs)
+
+    kwargs.pop('low_memory', None)
+    if callable(usecols):
+        usecols = [col for col in pd.read_csv(path, nrows=0).columns if usecols(col)]
+    df = pd.read_csv(path, usecols=usecols, engine='pyarrow', **kwargs)
+    if dtype:
+        df = df.astype({col: col_dtype for col, col_dtype in dtype.items() if col in df.columns})
+    return df
+
+
+def prefetch_csv(requests, concurrency=None, prefetch=None, engine=None):
+    """
+    Read CSV files in background threads while the caller works on earlier ones.
+
+    requests is an iterable of (key, path, read_kwargs). Yields (key, future)
+    in request order; future.result() returns the DataFrame or raises the
+    read error. At most `prefetch` files are read ahead of the consumer, so
+    memory stays bounded however many files are requested.
+    """
+    concurrency = max(1, concurrency or CSV_READ_CONCURRENCY)
+    prefetch = max(1, prefetch or CSV_PREFETCH)
+    requests = iter(requests)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='csv-reader') as executor:
+        def submit_next():
+            for key, path, read_kwargs in requests:
+                pending.append((key, executor.submit(read_csv, path, engine=engine, **read_kwargs)))
+                return True
+            return False
+
+        while len(pending) < prefetch and submit_next():
+            pass
+        while pending:
+            key, future = pending.popleft()
+            submit_next()
+            yield key, future
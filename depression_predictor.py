@@ -0,0 +1,213 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score
+from sklearn.model_selection import train_test_split
+
+from pipeline_profiling import PipelineProfiler
+from prepare_rf_data import load_processed_data, save_model_artifacts
+from model_registry import family_pointer
+
+# Collects per-stage timings for this run (see pipeline_profiling.py)
+PROFILER = PipelineProfiler('depression_predictor')
+
+TARGET_COLUMN = '3_yr_depress_score'
+# Median split, as in the original notebook (prepare_rf_data.py uses 0.75)
+DEFAULT_PERCENTILE = 0.5
+
+# Model families trained side by side; each factory takes the random state
+MODEL_FAMILIES = {
+    'lasso': lambda random_state: LogisticRegression(C=0.1, penalty='l1', solver='liblinear', max_iter=1000,
+                                                     random_state=random_state),
+    'random_forest': lambda random_state: RandomForestClassifier(n_estimators=200, max_depth=20, min_samples_split=5,
+                                                                 min_samples_leaf=2, random_state=random_state),
+    'extra_trees': lambda random_state: ExtraTreesClassifier(n_estimators=200, min_samples_leaf=2,
+                                                             random_state=random_state),
+}
+
+# One row per model family: test metrics, fit time and published version
+COMPARISON_RESULTS_PATH = os.path.join('results', 'model_family_comparison.csv')
+
+
+def fit_model_family(name, X, y, n_train, random_state=42):
+    """
+    Train one model family on the first n_train rows of the shared matrix and
+    evaluate it on the rest. X[:n_train] and X[n_train:] are views, so a worker
+    reading a memory-mapped X never copies it (the trees work on float32 natively).
+    """
+    model = MODEL_FAMILIES[name](random_state)
+    start = time.perf_counter()
+    model.fit(X[:n_train], y[:n_train])
+    fit_time = time.perf_counter() - start
+
+    X_test, y_test = X[n_train:], y[n_train:]
+    y_pred = model.predict(X_test)
+    probs = model.predict_proba(X_test)[:, -1]
+    metrics = {
+        'accuracy': accuracy_score(y_test, y_pred),
+        'precision': precision_score(y_test, y_pred, zero_division=0),
+        'recall': recall_score(y_test, y_pred, zero_division=0),
+        'f1': f1_score(y_test, y_pred, zero_division=0),
+        'roc_auc': roc_auc_score(y_test, probs) if len(np.unique(y_test)) > 1 else float('nan'),
+    }
+    return name, model, metrics, fit_time
+
+
+class DepressionPredictor:
+    """
+    Trains and compares several model families on one processed cohort.
+
+    The features are held once as a read-only, C-contiguous float32 matrix with the
+    training rows first and the test rows after them. Workers get that matrix
+    memory-mapped by joblib and slice it, so no per-model or per-process copies
+    (and no separately scaled copies) are made. The processed matrix is already
+    z-scored by merge_all_variables.py, so no second scaling step is applied and
+    the fitted models take the same inputs as the served model.
+    """
+
+    def __init__(self, df, target_column=TARGET_COLUMN, percentile_threshold=DEFAULT_PERCENTILE,
+                 test_size=0.2, random_state=42):
+        self.target_column = target_column
+        self.percentile_threshold = percentile_threshold
+        self.random_state = random_state
+        df = df.dropna(subset=[target_column])
+        self.feature_names = [c for c in df.columns if c not in ('src_subject_id', target_column)]
+
+        # Binarize on the whole cohort, as define_features_target does
+        scores = df[target_column].to_numpy(dtype=np.float64)
+        self.threshold_value = float(np.quantile(scores, percentile_threshold))
+        y = (scores > self.threshold_value).astype(int)
+        train_rows, test_rows = train_test_split(np.arange(len(df)), test_size=test_size, random_state=random_state,
+                                                 stratify=y if len(np.unique(y)) > 1 else None)
+        order = np.concatenate([train_rows, test_rows])
+        self.X = np.ascontiguousarray(df[self.feature_names].to_numpy(dtype=np.float32, na_value=np.nan)[order])
+        self.X.flags.writeable = False
+        self.y = y[order]
+        self.n_train = len(train_rows)
+        self.subject_ids = df['src_subject_id'].to_numpy()[order] if 'src_subject_id' in df.columns else None
+
+        print(f"Median score: {np.median(scores):.2f}; cutoff at percentile {percentile_threshold:g}: {self.threshold_value:.2f}")
+        print(f"Higher risk cases: {int(self.y.sum())}, lower risk cases: {int((self.y == 0).sum())}")
+        self.models = {}
+        self.results = None
+
+    @property
+    def X_train(self):
+        return self.X[:self.n_train]
+
+    @property
+    def X_test(self):
+        return self.X[self.n_train:]
+
+    @property
+    def y_train(self):
+        return self.y[:self.n_train]
+
+    @property
+    def y_test(self):
+        return self.y[self.n_train:]
+
+    def train(self, families=None, n_jobs=-1):
+        """
+        Fit the given model families (default: all) at the same time in worker
+        processes and return a comparison table of their test metrics and fit times.
+        """
+        families = list(families or MODEL_FAMILIES)
+        unknown = [f for f in families if f not in MODEL_FAMILIES]
+        if unknown:
+            raise ValueError(f"Unknown model families: {', '.join(unknown)} (expected some of {', '.join(MODEL_FAMILIES)})")
+        start = time.perf_counter()
+        # Arrays above max_nbytes are dumped once and memory-mapped read-only into every worker
+        fitted = Parallel(n_jobs=n_jobs, max_nbytes='1M', mmap_mode='r')(
+            delayed(fit_model_family)(name, self.X, self.y, self.n_train, self.random_state) for name in families)
+        wall_time = time.perf_counter() - start
+
+        rows = []
+        for name, model, metrics, fit_time in fitted:
+            self.models[name] = model
+            rows.append({'family': name, 'model_type': type(model).__name__, **metrics, 'fit_time_s': fit_time})
+        self.results = pd.DataFrame(rows)
+        fit_total = self.results['fit_time_s'].sum()
+        print(f"Trained {len(families)} model families in {wall_time:.2f}s wall "
+              f"({fit_total:.2f}s of fitting, {fit_total / wall_time if wall_time else 0:.1f}x parallel speedup)")
+        return self.results
+
+    def feature_importance(self, name):
+        """Absolute coefficients (linear models) or impurity importances (forests), largest first."""
+        model = self.models[name]
+        if hasattr(model, 'coef_'):
+            frame = pd.DataFrame({'feature': self.feature_names, 'coefficient': np.abs(model.coef_[0])})
+            return frame.sort_values('coefficient', ascending=False)
+        frame = pd.DataFrame({'feature': self.feature_names, 'importance': model.feature_importances_})
+        return frame.sort_values('importance', ascending=False)
+
+    def publish(self, name, pointer=None):
+        """Publish one trained family as a registry bundle (same format as prepare_rf_data.py); returns the version."""
+        metrics = {}
+        if self.results is not None:
+            row = self.results.set_index('family').loc[name]
+            metrics = {k: float(row[k]) for k in ('accuracy', 'precision', 'recall', 'f1', 'roc_auc')}
+        # Cohort scores from the test rows only: scores of training rows are pushed toward 0 and 1
+        cohort_X = pd.DataFrame(self.X_test, columns=self.feature_names, copy=False)
+        holdout = self.subject_ids[self.n_train:] if self.subject_ids is not None else None
+        return save_model_artifacts(self.models[name], self.feature_names, pointer=pointer or family_pointer(name),
+                                    cohort_X=cohort_X, holdout_subjects=holdout, metadata={
+            'model_type': type(self.models[name]).__name__,
+            'model_family': name,
+            'target': self.target_column,
+            'percentile_threshold': self.percentile_threshold,
+            'threshold_value': self.threshold_value,
+            'metrics': metrics,
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train several model families concurrently on one shared feature matrix and compare them.")
+    parser.add_argument('--families', nargs='*', default=None, choices=list(MODEL_FAMILIES),
+                        help="Model families to train (default: all).")
+    parser.add_argument('--percentile', type=float, default=DEFAULT_PERCENTILE,
+                        help="Percentile cutoff of the score for the Higher Risk class (default: 0.5, the median).")
+    parser.add_argument('--n-jobs', type=int, default=-1, help="Families trained at the same time (default: all CPUs).")
+    parser.add_argument('--publish', action='store_true',
+                        help="Publish every trained family under its 'family-<name>' registry pointer.")
+    args = parser.parse_args()
+    PROFILER.start()
+
+    with PROFILER.stage('load_processed_data'):
+        processed_df = load_processed_data()
+
+    with PROFILER.stage('prepare_arrays') as rec:
+        rec.set_input(processed_df)
+        predictor = DepressionPredictor(processed_df, percentile_threshold=args.percentile)
+        rec.set_output(predictor.X)
+    print(f"Shared feature matrix: {predictor.X.shape[0]} rows x {predictor.X.shape[1]} features, "
+          f"{predictor.X.nbytes / 1e6:.1f} MB float32 ({predictor.n_train} training rows)")
+
+    with PROFILER.stage('train_models') as rec:
+        rec.set_input(predictor.X_train)
+        results_df = predictor.train(args.families, n_jobs=args.n_jobs)
+
+    if args.publish:
+        with PROFILER.stage('publish_models'):
+            results_df['version'] = [predictor.publish(name) for name in results_df['family']]
+
+    print("\nModel family comparison:")
+    print(results_df.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    results_df.to_csv(COMPARISON_RESULTS_PATH, index=False)
+    print(f"\nComparison table saved to: {COMPARISON_RESULTS_PATH}")
+    for name in results_df['family']:
+        print(f"\nTop 10 features ({name}):")
+        print(predictor.feature_importance(name).head(10).to_string(index=False))
+
+    PROFILER.print_summary()
+    PROFILER.write_report()
+
+
+if __name__ == "__main__":
+    main()
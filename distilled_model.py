@@ -0,0 +1,25 @@
+import numpy as np
+
+
+class DistilledClassifier:
+    """
+    Classifier-compatible wrapper around a regressor trained on a teacher
+    forest's class-1 probabilities, so it can be served by get_prediction.
+
+    Lives in its own module (not compact_model.py, which runs as __main__) so
+    published bundles pickle it as distilled_model.DistilledClassifier and can
+    be loaded by the registry and the app.
+    """
+
+    def __init__(self, regressor, feature_names_in=None):
+        self.regressor = regressor
+        self.classes_ = np.array([0, 1])
+        if feature_names_in is not None:
+            self.feature_names_in_ = np.asarray(feature_names_in, dtype=object)
+
+    def predict_proba(self, X):
+        p1 = np.clip(self.regressor.predict(X), 0.0, 1.0)
+        return np.column_stack([1.0 - p1, p1])
+
+    def predict(self, X):
+        return (self.predict_proba(X)[:, 1] > 0.5).astype(int)
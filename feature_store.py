@@ -0,0 +1,171 @@
+import json
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from artifacts import read_artifact, stored_file
+
+# Files inside a store version directory
+MATRIX_FILE = 'matrix.npy'
+INDEX_FILE = 'index.json'
+# Pointer file in the store directory naming the current version directory
+CURRENT_FILE = 'CURRENT'
+
+
+def store_path_for(path):
+    """Feature store directory that sits next to an artifact, e.g. results/merged_variables.store"""
+    return Path(path).with_suffix('.store')
+
+
+def current_store_dir(store_dir):
+    """Directory holding the current matrix and index of a store (the store itself for the older flat layout)."""
+    store_dir = Path(store_dir)
+    try:
+        with open(store_dir / CURRENT_FILE) as f:
+            return store_dir / f.read().strip()
+    except FileNotFoundError:
+        return store_dir
+
+
+def write_feature_store(df, store_dir, id_column='src_subject_id', dtype=np.float64):
+    """
+    Persist the numeric columns of df as a column-major memory-mapped matrix.
+
+    matrix.npy has shape (n_columns, n_rows), so each column is one contiguous
+    block on disk. index.json holds the column names, their original dtypes and
+    the row IDs. Each write goes to a new version directory inside the store, and
+    the CURRENT pointer file is then switched to it with a single os.replace, so a
+    reader sees either the old or the new store, never a half-written or missing one.
+    The previous version is kept for readers that resolved the pointer just before.
+    """
+    store_dir = Path(store_dir)
+    row_ids = df[id_column].astype(str).tolist() if id_column in df.columns else None
+    columns = [c for c in df.columns if c != id_column]
+    skipped = [c for c in columns if not (pd.api.types.is_numeric_dtype(df[c]) or pd.api.types.is_bool_dtype(df[c]))]
+    if skipped:
+        print(f"Warning: Skipping non-numeric columns in feature store: {skipped}")
+        columns = [c for c in columns if c not in skipped]
+
+    store_dir.mkdir(parents=True, exist_ok=True)
+    version = f"v{datetime.now():%Y%m%d%H%M%S%f}_{os.getpid()}"
+    version_dir = store_dir / version
+    version_dir.mkdir()
+
+    matrix = np.lib.format.open_memmap(version_dir / MATRIX_FILE, mode='w+', dtype=dtype, shape=(len(columns), len(df)))
+    for i, col in enumerate(columns):
+        matrix[i] = df[col].to_numpy(dtype=dtype, na_value=np.nan)
+    matrix.flush()
+    del matrix
+
+    index = {
+        'id_column': id_column,
+        'row_ids': row_ids,
+        'columns': columns,
+        'dtypes': {c: str(df[c].dtype) for c in columns},
+        'n_rows': len(df),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+    }
+    with open(version_dir / INDEX_FILE, 'w') as f:
+        json.dump(index, f)
+
+    # Switch readers to the new version atomically
+    previous_dir = current_store_dir(store_dir)
+    tmp_pointer = store_dir / f".{CURRENT_FILE}.{os.getpid()}.tmp"
+    with open(tmp_pointer, 'w') as f:
+        f.write(version)
+    os.replace(tmp_pointer, store_dir / CURRENT_FILE)
+
+    # Remove versions older than the previous one, and the files of the older flat layout
+    for path in store_dir.iterdir():
+        if path.is_dir() and path.name.startswith('v') and path not in (version_dir, previous_dir):
+            shutil.rmtree(path)
+    if previous_dir == store_dir:
+        for name in (MATRIX_FILE, INDEX_FILE):
+            (store_dir / name).unlink(missing_ok=True)
+    print(f"Feature store saved to: {store_dir} ({len(columns)} columns x {len(df)} rows)")
+    return store_dir
+
+
+class FeatureStore:
+    """
+    Read-only view over a store written by write_feature_store.
+
+    Opening only reads the small index file and maps the matrix, so it takes
+    milliseconds; pages are loaded on demand and shared between processes that
+    open the same store.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = Path(store_dir)
+        self.version_dir = current_store_dir(self.store_dir)
+        with open(self.version_dir / INDEX_FILE) as f:
+            self.index = json.load(f)
+        self.matrix = np.load(self.version_dir / MATRIX_FILE, mmap_mode='r')
+        self.columns = self.index['columns']
+        self.id_column = self.index['id_column']
+        self.row_ids = self.index['row_ids']
+        self._positions = {c: i for i, c in enumerate(self.columns)}
+
+    @property
+    def shape(self):
+        """(n_rows, n_columns), as for a DataFrame."""
+        return self.matrix.shape[1], self.matrix.shape[0]
+
+    def column(self, name):
+        """Return one column as a read-only view (no copy)."""
+        return self.matrix[self._positions[name]]
+
+    def select(self, columns):
+        """Return {column: read-only view} for the requested columns (no copy)."""
+        return {c: self.column(c) for c in columns}
+
+    def to_frame(self, columns=None, include_ids=True, restore_dtypes=True):
+        """
+        pandas adapter over the mapped matrix. Without a column list the whole
+        matrix is wrapped as a single block without copying. Requested columns that
+        are not in the store are ignored, as when reading the artifact itself.
+        Columns stored from another dtype (e.g. bool dummies) get it back, which copies
+        just those columns; pass restore_dtypes=False for an all-float64 view.
+        """
+        if columns is None:
+            frame = pd.DataFrame(self.matrix.T, columns=self.columns, copy=False)
+        else:
+            columns = [c for c in columns if c != self.id_column and c in self._positions]
+            frame = pd.DataFrame(self.select(columns), copy=False)
+        if restore_dtypes:
+            recorded = self.index.get('dtypes', {})
+            for col in frame.columns:
+                dtype = recorded.get(col)
+                if dtype is None or dtype == str(frame[col].dtype):
+                    continue
+                try:
+                    # Integer/bool columns that hold NaN stay float
+                    if not frame[col].isna().any() or pd.api.types.is_extension_array_dtype(pd.api.types.pandas_dtype(dtype)):
+                        frame[col] = frame[col].astype(dtype)
+                except (TypeError, ValueError):
+                    pass
+        if include_ids and self.row_ids is not None:
+            frame.insert(0, self.id_column, self.row_ids)
+        return frame
+
+
+def load_feature_frame(path, columns=None):
+    """
+    Load a processed matrix, preferring its feature store when it is at least as
+    new as the stored artifact. Falls back to reading only the needed columns of
+    the artifact (Parquet, or CSV for older results).
+    """
+    store_dir = store_path_for(path)
+    source = stored_file(path)
+    index_path = current_store_dir(store_dir) / INDEX_FILE
+    store_is_current = index_path.exists() and (
+        source is None or os.path.getmtime(index_path) >= os.path.getmtime(source))
+    if store_is_current:
+        return FeatureStore(store_dir).to_frame(columns)
+    if columns is not None:
+        return read_artifact(path, columns=['src_subject_id'] + [c for c in columns if c != 'src_subject_id'])
+    return read_artifact(path)
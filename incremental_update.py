@@ -0,0 +1,283 @@
+import argparse
+import copy
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score, f1_score, roc_auc_score
+from sklearn.model_selection import train_test_split
+
+from pipeline_profiling import PipelineProfiler
+from feature_store import write_feature_store, store_path_for
+from artifacts import write_artifact, read_artifact, artifact_metadata, stored_file, input_fingerprints
+from model_registry import ModelRegistry, DEFAULT_POINTER
+from cohort_percentiles import load_holdout_subjects
+from merge_all_variables import (get_valid_variables, get_reference_cohort, load_and_prepare_data,
+                                 apply_preprocessing_stats, PREPROCESSING_STATS_PATH, MERGED_VARIABLES_PATH)
+from prepare_rf_data import load_processed_data, save_model_artifacts
+
+# Collects per-stage timings for this run (see pipeline_profiling.py)
+PROFILER = PipelineProfiler('incremental_update')
+
+PROCESSED_DATA_PATH = MERGED_VARIABLES_PATH
+INCREMENTAL_RESULTS_PATH = os.path.join('results', 'incremental_update.csv')
+TARGET_COLUMN = '3_yr_depress_score'
+UPDATE_MODES = ('grow', 'replace')
+
+
+def find_new_subjects(existing_ids):
+    """Subjects of the current reference cohort that are not in the processed data yet."""
+    reference_cohort, depress_scores = get_reference_cohort()
+    existing = set(map(str, existing_ids))
+    new_subjects = np.array([s for s in reference_cohort if str(s) not in existing], dtype=object)
+    return new_subjects, depress_scores[depress_scores['src_subject_id'].isin(new_subjects)]
+
+
+def preprocess_new_subjects(new_subjects, depress_scores, processed_columns):
+    """Merge the new subjects' variables and apply the saved preprocessing fit (nothing is refitted)."""
+    valid_vars = get_valid_variables()
+    merged_df, _ = load_and_prepare_data(valid_vars, new_subjects, depress_scores)
+    with open(PREPROCESSING_STATS_PATH) as f:
+        stats = json.load(f)
+    new_df = apply_preprocessing_stats(merged_df, stats)
+    missing = [c for c in processed_columns if c not in new_df.columns]
+    if missing:
+        print(f"Warning: {len(missing)} processed columns have no statistics; filled with 0: {', '.join(missing[:5])}")
+    return new_df.reindex(columns=processed_columns, fill_value=0.0)
+
+
+def append_processed_rows(new_df, path=PROCESSED_DATA_PATH):
+    """Append the new rows to the processed data artifact and rebuild its feature store."""
+    # Parquet cannot be appended to in place, so the typed artifact (not the all-float store) is
+    # read back and rewritten as a whole; the new rows take the existing column types
+    existing = read_artifact(path)
+    new_df = new_df.reindex(columns=existing.columns).astype(existing.dtypes.to_dict())
+    combined = pd.concat([existing, new_df], ignore_index=True)
+    previous = artifact_metadata(path)
+    write_artifact(combined, path, stage='incremental_update',
+                   parameters={**previous.get('parameters', {}), 'appended_rows': len(new_df)},
+                   inputs={**previous.get('inputs', {}),
+                           **input_fingerprints([stored_file(path), PREPROCESSING_STATS_PATH])})
+    # The store is column-major, so it is rewritten as a whole (a sequential copy, no preprocessing)
+    write_feature_store(combined, store_path_for(path))
+    return combined
+
+
+def update_forest(model, X, y, n_trees, mode='grow', random_state=None):
+    """
+    Return an updated copy of a fitted forest that has seen X, y.
+
+    'grow' keeps every existing tree and adds n_trees new ones (warm start).
+    'replace' retrains only the n_trees oldest trees on X, y, so the forest size
+    stays the same. Either way only the new trees are fitted, on X alone, and are
+    appended at the end: estimators_ stays ordered oldest first, so the next
+    'replace' update retires the next-oldest trees rather than these.
+    """
+    if mode not in UPDATE_MODES:
+        raise ValueError(f"Unknown update mode: {mode} (expected one of {', '.join(UPDATE_MODES)})")
+    # Both modes fit new trees on X alone, which must contain every class the old trees know
+    if set(np.unique(y)) != set(model.classes_):
+        raise ValueError("The new subjects do not contain every class the model was trained on")
+    if mode == 'grow':
+        updated = copy.deepcopy(model)
+        updated.set_params(warm_start=True, n_estimators=len(model.estimators_) + n_trees)
+        if random_state is not None:
+            updated.set_params(random_state=random_state)
+        updated.fit(X, y)
+        updated.set_params(warm_start=False)
+        return updated
+    n_trees = min(n_trees, len(model.estimators_))
+    fresh = clone(model).set_params(n_estimators=n_trees, warm_start=False,
+                                    random_state=random_state if random_state is not None else model.random_state)
+    fresh.fit(X, y)
+    updated = copy.deepcopy(model)
+    updated.estimators_ = list(model.estimators_[n_trees:]) + list(fresh.estimators_)
+    return updated
+
+
+def check_replace_order(n_estimators=10, n_trees=3, n_updates=3, random_state=0):
+    """
+    Regression check for update_forest: repeated 'replace' updates must retire the
+    oldest trees in turn, so after k updates the first n_estimators - k * n_trees
+    trees are the original forest's trees k * n_trees onwards. Raises AssertionError.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.default_rng(random_state)
+    X = pd.DataFrame(rng.normal(size=(200, 5)))
+    y = pd.Series((X[0] + rng.normal(scale=0.5, size=len(X)) > 0).astype(int))
+    model = RandomForestClassifier(n_estimators=n_estimators, random_state=random_state).fit(X, y)
+    # (generation, position) of every tree, keyed by object identity
+    ages = {id(tree): (0, i) for i, tree in enumerate(model.estimators_)}
+    for update in range(1, n_updates + 1):
+        model = update_forest(model, X, y, n_trees, mode='replace', random_state=random_state + update)
+        assert len(model.estimators_) == n_estimators, "replace changed the forest size"
+        for i, tree in enumerate(model.estimators_):
+            ages.setdefault(id(tree), (update, i))
+        order = [ages[id(tree)] for tree in model.estimators_]
+        assert order == sorted(order), f"trees are not oldest first after update {update}: {order}"
+        retired = min(update * n_trees, n_estimators)
+        originals = [pos for gen, pos in order if gen == 0]
+        assert originals == list(range(retired, n_estimators)), \
+            f"update {update} did not retire the oldest original trees: {originals}"
+    print(f"Replace-order check passed ({n_updates} updates of {n_trees} trees on a {n_estimators}-tree forest).")
+
+
+def training_rows(X_new, y_new, X_old, y_old, replay_rows, random_state=42):
+    """New rows plus up to replay_rows previously seen rows, so new trees still reflect the earlier cohort."""
+    if not replay_rows or X_old is None or not len(X_old):
+        return X_new, y_new
+    rng = np.random.default_rng(random_state)
+    keep = rng.choice(len(X_old), size=min(replay_rows, len(X_old)), replace=False)
+    return pd.concat([X_new, X_old.iloc[keep]]), pd.concat([y_new, y_old.iloc[keep]])
+
+
+def score(model, X, y):
+    probs = model.predict_proba(X)[:, 1]
+    preds = (probs > 0.5).astype(int)
+    return {'test_auc': roc_auc_score(y, probs) if y.nunique() > 1 else float('nan'),
+            'accuracy': accuracy_score(y, preds), 'f1': f1_score(y, preds, zero_division=0)}, probs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update the served forest with subjects added since the last training run.")
+    parser.add_argument('--mode', choices=UPDATE_MODES, default='grow',
+                        help="'grow' adds trees (warm start); 'replace' retrains the oldest trees (default: grow).")
+    parser.add_argument('--trees', type=int, default=20, help="Trees to add or replace (default: 20).")
+    parser.add_argument('--replay-rows', type=int, default=None,
+                        help="Previously seen rows mixed into the new trees' data (default: as many as new rows).")
+    parser.add_argument('--pointer', default=DEFAULT_POINTER, help="Registry pointer of the model to update (default: current).")
+    parser.add_argument('--evaluate', action='store_true',
+                        help="Hold out 20%% of the new subjects and compare against a full retrain on all data.")
+    parser.add_argument('--no-publish', action='store_true', help="Do not publish the updated model.")
+    parser.add_argument('--no-append', action='store_true', help="Do not append the new rows to the processed data.")
+    parser.add_argument('--check-order', action='store_true',
+                        help="Only run the replace-order regression check on a synthetic forest and exit.")
+    args = parser.parse_args()
+    if args.check_order:
+        check_replace_order()
+        return
+    PROFILER.start()
+
+    registry = ModelRegistry()
+    bundle = registry.load_pointer(args.pointer)
+    if bundle is None:
+        print(f"Pointer '{args.pointer}' is not set; train a model with prepare_rf_data.py first.")
+        return
+    if not hasattr(bundle.model, 'estimators_') or not hasattr(bundle.model, 'classes_'):
+        print(f"Model version {bundle.version} ({type(bundle.model).__name__}) is not a forest classifier; cannot update it.")
+        return
+
+    with PROFILER.stage('load_processed_data'):
+        existing_df = load_processed_data(PROCESSED_DATA_PATH)
+    with PROFILER.stage('find_new_subjects') as rec:
+        new_subjects, depress_scores = find_new_subjects(existing_df['src_subject_id'])
+        rec.extra['n_new_subjects'] = len(new_subjects)
+    if not len(new_subjects):
+        print("No new subjects in the reference cohort; nothing to update.")
+        return
+    print(f"{len(new_subjects)} new subjects (processed data has {len(existing_df)}).")
+
+    with PROFILER.stage('preprocess_new_subjects') as rec:
+        new_df = preprocess_new_subjects(new_subjects, depress_scores, existing_df.columns)
+        rec.set_output(new_df)
+
+    # Keep the served model's target definition: the cutoff it was trained with
+    existing = existing_df.dropna(subset=[TARGET_COLUMN])
+    cutoff = bundle.metadata.get('threshold_value')
+    if cutoff is None:
+        cutoff = existing[TARGET_COLUMN].quantile(bundle.metadata.get('percentile_threshold', 0.75))
+    feature_names = bundle.feature_names
+    new_rows = new_df.dropna(subset=[TARGET_COLUMN])
+    X_new = new_rows.reindex(columns=feature_names, fill_value=0.0).astype(np.float64)
+    y_new = (new_rows[TARGET_COLUMN] > cutoff).astype(int)
+    X_old = existing.reindex(columns=feature_names, fill_value=0.0).astype(np.float64)
+    y_old = (existing[TARGET_COLUMN] > cutoff).astype(int)
+
+    # Old subjects the served model never saw stay out of the update: they score the cohort
+    # percentiles and the evaluation. Bundles without a stored list get prepare_rf_data's split.
+    holdout = load_holdout_subjects(bundle.path) if bundle.path is not None else None
+    if holdout is not None:
+        held_out = existing['src_subject_id'].astype(str).isin(set(holdout)).to_numpy()
+    else:
+        _, test_rows = train_test_split(np.arange(len(existing)), test_size=0.2, random_state=42,
+                                        stratify=y_old if y_old.nunique() > 1 else None)
+        held_out = np.isin(np.arange(len(existing)), test_rows)
+    X_old_train, X_old_test = X_old[~held_out], X_old[held_out]
+    y_old_train, y_old_test = y_old[~held_out], y_old[held_out]
+    holdout_ids = existing['src_subject_id'].to_numpy()[held_out]
+    X_new_test = X_new.iloc[:0]
+    if args.evaluate:
+        # A 20% hold-out of the new subjects, which also stays unseen
+        X_new, X_new_test, y_new, y_new_test = train_test_split(
+            X_new, y_new, test_size=0.2, random_state=42, stratify=y_new if y_new.value_counts().min() > 1 else None)
+
+    replay_rows = len(X_new) if args.replay_rows is None else args.replay_rows
+    X_update, y_update = training_rows(X_new, y_new, X_old_train, y_old_train, replay_rows)
+    if set(y_update) != set(bundle.model.classes_):
+        print(f"The update rows only contain class(es) {sorted(set(y_update))}; the new trees need every class "
+              f"the model was trained on. Mix in earlier subjects with --replay-rows.")
+        return
+    print(f"Updating model version {bundle.version} ({args.mode}, {args.trees} trees) on {len(X_update)} rows "
+          f"({len(X_new)} new, {len(X_update) - len(X_new)} replayed)...")
+    with PROFILER.stage('update_forest') as rec:
+        rec.set_input(X_update)
+        start = time.perf_counter()
+        updated = update_forest(bundle.model, X_update, y_update, args.trees, args.mode)
+        update_s = time.perf_counter() - start
+
+    if args.evaluate:
+        X_test = pd.concat([X_old_test, X_new_test])
+        y_test = pd.concat([y_old_test, y_new_test])
+        with PROFILER.stage('full_retrain') as rec:
+            X_full, y_full = pd.concat([X_old_train, X_new]), pd.concat([y_old_train, y_new])
+            rec.set_input(X_full)
+            start = time.perf_counter()
+            retrained = clone(updated).set_params(n_estimators=len(updated.estimators_), warm_start=False).fit(X_full, y_full)
+            retrain_s = time.perf_counter() - start
+        rows, test_probs = [], []
+        for name, model, fit_s, n_rows in [('previous', bundle.model, 0.0, 0),
+                                           (f"incremental_{args.mode}", updated, update_s, len(X_update)),
+                                           ('full_retrain', retrained, retrain_s, len(X_full))]:
+            metrics, probs = score(model, X_test, y_test)
+            new_metrics, _ = score(model, X_new_test, y_new_test)
+            rows.append({'model': name, 'n_trees': len(model.estimators_), 'fit_rows': n_rows, 'fit_s': fit_s,
+                         **metrics, 'new_subjects_auc': new_metrics['test_auc']})
+            test_probs.append(probs)
+        # How closely each model's estimates track the full retrain
+        for row, probs in zip(rows, test_probs):
+            row['mean_abs_diff_vs_retrain'] = float(np.abs(probs - test_probs[-1]).mean())
+        results_df = pd.DataFrame(rows)
+        print("\nIncremental update versus full retrain (held-out old + new subjects):")
+        print(results_df.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+        results_df.to_csv(INCREMENTAL_RESULTS_PATH, index=False)
+        print(f"\nComparison saved to: {INCREMENTAL_RESULTS_PATH}")
+
+    if not args.no_append:
+        with PROFILER.stage('append_processed_rows'):
+            append_processed_rows(new_df, PROCESSED_DATA_PATH)
+        print(f"Appended {len(new_df)} rows to {PROCESSED_DATA_PATH}")
+
+    if not args.no_publish:
+        with PROFILER.stage('save_model'):
+            # Cohort scores from the rows no tree was trained on: scores of training rows are pushed toward 0 and 1
+            cohort_X = pd.concat([X_old_test, X_new_test])
+            holdout_ids = np.concatenate([holdout_ids, new_rows.loc[X_new_test.index, 'src_subject_id'].to_numpy()])
+            version = save_model_artifacts(updated, feature_names, pointer=args.pointer, cohort_X=cohort_X,
+                                           holdout_subjects=holdout_ids,
+                                           metadata={**{k: v for k, v in bundle.metadata.items() if k not in ('version', 'created_at')},
+                                                     'threshold_value': float(cutoff),
+                                                     'incremental_update': {'base_version': bundle.version, 'mode': args.mode,
+                                                                            'trees': args.trees, 'new_subjects': len(new_df),
+                                                                            'fit_rows': len(X_update), 'fit_s': update_s}})
+        print(f"Updated model saved as version {version}.")
+
+    PROFILER.print_summary()
+    PROFILER.write_report()
+
+
+if __name__ == "__main__":
+    main()
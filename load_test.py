@@ -0,0 +1,209 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from question_mappings import QUESTION_MAPPINGS
+
+# One JSON report per run
+LOAD_TEST_DIR = Path('results/load_tests')
+
+
+def random_answers(rng):
+    """One randomized, complete answer set in the format app.py passes to get_prediction."""
+    answers = {}
+    for question_map in QUESTION_MAPPINGS:
+        options = question_map['options']
+        if question_map['scale_type'] == 'Continuous':
+            answers[question_map['id']] = rng.randint(options['min_value'], options['max_value'])
+        else:
+            answers[question_map['id']] = rng.choice(list(options.values()))
+    return answers
+
+
+def load_recorded_answers(path):
+    """Answer sets recorded one JSON object per line (e.g. from the audit log's 'answers' field)."""
+    answer_sets = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                answer_sets.append(record.get('answers', record))
+    return answer_sets
+
+
+def predict_request(answers):
+    """One request against the prediction layer, as app.py issues it."""
+    from prediction_calculator_logic import get_prediction
+    predicted_class, probabilities, _ = get_prediction(answers, return_contributions=True)
+    if predicted_class is None:
+        raise RuntimeError("model unavailable")
+
+
+def disable_audit_log():
+    """Keep synthetic sessions out of the prediction audit log: app.py runs in this process under AppTest."""
+    os.environ['AUDIT_LOG_DISABLED'] = '1'
+    from audit_log import AUDIT_LOG
+    AUDIT_LOG.enabled = False
+
+
+def app_request(answers):
+    """One full questionnaire session through Streamlit's headless AppTest: render, fill in, submit."""
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file('app.py', default_timeout=30)
+    at.run()
+    for question_map in QUESTION_MAPPINGS:
+        feature_id = question_map['id']
+        value = answers[feature_id]
+        if question_map['scale_type'] == 'Continuous':
+            at.number_input(key=f"{feature_id}_input").set_value(value)
+        else:
+            label = next(label for label, option_value in question_map['options'].items() if option_value == value)
+            at.radio(key=f"{feature_id}_radio").set_value(label)
+    next(button for button in at.button if button.label == "Get Estimate").click()
+    at.run()
+    if at.exception:
+        raise RuntimeError(str(at.exception[0].message))
+    if not at.session_state['show_results']:
+        raise RuntimeError("no estimate shown")
+
+
+class LoadTestResult:
+    """Thread-safe collection of per-request latencies and errors."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.errors = {}
+
+    def record(self, seconds, error=None):
+        with self._lock:
+            self.latencies.append(seconds)
+            if error is not None:
+                key = f"{type(error).__name__}: {error}"
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def summary(self, wall_seconds, concurrency, target):
+        latencies = np.array(self.latencies) * 1000
+        n_errors = sum(self.errors.values())
+        return {
+            'target': target,
+            'concurrency': concurrency,
+            'requests': len(latencies),
+            'errors': n_errors,
+            'error_rate': n_errors / len(latencies) if len(latencies) else None,
+            'wall_s': wall_seconds,
+            'throughput_rps': len(latencies) / wall_seconds if wall_seconds > 0 else None,
+            'latency_ms': {
+                'mean': float(latencies.mean()) if len(latencies) else None,
+                **{f"p{q}": float(np.percentile(latencies, q)) if len(latencies) else None for q in (50, 90, 95, 99)},
+                'max': float(latencies.max()) if len(latencies) else None,
+            },
+            'error_types': self.errors,
+        }
+
+
+def format_value(value, spec, suffix=''):
+    """Format a summary value, or 'n/a' when there were no completed requests to compute it from."""
+    return 'n/a' if value is None else f"{value:{spec}}{suffix}"
+
+
+def run_load_test(request_fn, answer_sets, concurrency, n_requests=None, duration_s=None, seed=42):
+    """
+    Closed-loop load: `concurrency` virtual users each send requests back to back
+    until n_requests have been sent in total or duration_s has elapsed.
+    Answer sets are drawn at random from answer_sets.
+    """
+    result = LoadTestResult()
+    counter = iter(range(n_requests)) if n_requests else None
+    counter_lock = threading.Lock()
+    deadline = time.perf_counter() + duration_s if duration_s else None
+
+    def next_request():
+        if deadline is not None and time.perf_counter() >= deadline:
+            return False
+        if counter is not None:
+            with counter_lock:
+                return next(counter, None) is not None
+        return True
+
+    def virtual_user(user_id):
+        rng = random.Random(seed + user_id)
+        while next_request():
+            answers = rng.choice(answer_sets)
+            start = time.perf_counter()
+            try:
+                request_fn(answers)
+                result.record(time.perf_counter() - start)
+            except Exception as e:
+                result.record(time.perf_counter() - start, e)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='virtual-user') as executor:
+        list(executor.map(virtual_user, range(concurrency)))
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local load test of the prediction layer or the Streamlit app.")
+    parser.add_argument('--target', choices=['prediction', 'app'], default='prediction',
+                        help="'prediction' calls get_prediction directly; 'app' drives app.py with Streamlit's AppTest.")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16],
+                        help="Numbers of simultaneous virtual users; one run per value (default: 1 4 16).")
+    parser.add_argument('--requests', type=int, default=None, help="Total requests per run (default: 2000, or 50 for the app).")
+    parser.add_argument('--duration', type=float, default=None, help="Run for this many seconds instead of a request count.")
+    parser.add_argument('--answers-file', help="Replay recorded answer sets (JSON lines) instead of random ones.")
+    parser.add_argument('--n-random', type=int, default=500, help="Number of distinct random answer sets (default: 500).")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if args.answers_file:
+        answer_sets = load_recorded_answers(args.answers_file)
+        print(f"Replaying {len(answer_sets)} recorded answer sets from {args.answers_file}")
+    else:
+        rng = random.Random(args.seed)
+        answer_sets = [random_answers(rng) for _ in range(args.n_random)]
+
+    request_fn = predict_request if args.target == 'prediction' else app_request
+    if args.target == 'app':
+        disable_audit_log()
+    n_requests = args.requests or (None if args.duration else (2000 if args.target == 'prediction' else 50))
+
+    # Warm up: load the model (and, for the app, compile the script) outside the measured runs
+    try:
+        request_fn(answer_sets[0])
+    except Exception as e:
+        print(f"Warning: warm-up request failed ({type(e).__name__}: {e}); failures will be counted as errors.")
+    from serving_metrics import SERVING_METRICS
+
+    summaries = []
+    for concurrency in args.concurrency:
+        SERVING_METRICS.reset()
+        result, wall_s = run_load_test(request_fn, answer_sets, concurrency, n_requests, args.duration, args.seed)
+        summary = result.summary(wall_s, concurrency, args.target)
+        summary['serving_latency'] = SERVING_METRICS.snapshot()['latency']
+        summaries.append(summary)
+        latency = summary['latency_ms']
+        print(f"concurrency={concurrency:<4} requests={summary['requests']:<6} "
+              f"throughput={format_value(summary['throughput_rps'], '.1f', '/s')}  "
+              f"p50={format_value(latency['p50'], '.2f', 'ms')}  p95={format_value(latency['p95'], '.2f', 'ms')}  "
+              f"p99={format_value(latency['p99'], '.2f', 'ms')}  errors={format_value(summary['error_rate'], '.2%')}")
+        for error, count in result.errors.items():
+            print(f"    {count} x {error}")
+
+    LOAD_TEST_DIR.mkdir(parents=True, exist_ok=True)
+    report_path = LOAD_TEST_DIR / f"{args.target}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(report_path, 'w') as f:
+        json.dump({'pid': os.getpid(), 'cpu_count': os.cpu_count(), 'runs': summaries}, f, indent=2)
+    print(f"\nLoad test report saved to: {report_path}")
+
+
+if __name__ == "__main__":
+    main()
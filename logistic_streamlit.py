@@ -3,6 +3,7 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
+from feature_store import load_feature_frame
 
 # ----------------------------------------
 # 1. Setup
@@ -23,13 +24,14 @@ Use this scale:
 # ----------------------------------------
 @st.cache_data
 def load_baseline():
-    df = pd.read_csv("filtered_merged_variables.csv")
     top_vars = [
         'ksads_sleepprob_raw_814_p', 'cbcl_q71_p', 'cbcl_q04_p', 
         'famhx_ss_parent_prf_p', 'sds_p_ss_does', 'cbcl_q86_p', 
         'cbcl_q09_p', 'asr_q59_p', 'asr_q47_p', 
         'cbcl_q112_p', 'sds_p_ss_total', 'cbcl_q22_p'
     ]
+    # Only the plotted columns are read (from the feature store when present, else from the Parquet artifact)
+    df = load_feature_frame("results/filtered_merged_variables", columns=top_vars)
     return df[top_vars].dropna()
 
 baseline_df = load_baseline()
@@ -0,0 +1,141 @@
+import argparse
+import os
+
+import pandas as pd
+
+from merge_all_variables import (
+    get_valid_variables,
+    get_reference_cohort,
+    get_data_file_path,
+    group_variables_by_file,
+)
+from pipeline_profiling import PipelineProfiler
+from subject_index import SubjectIndex, SUBJECT_ID_DTYPE
+
+# Collects per-stage and per-file timings for this run (see pipeline_profiling.py)
+PROFILER = PipelineProfiler('longitudinal_builder')
+
+# ABCD event names and the short labels used in wide column names
+EVENT_LABELS = {
+    'baseline_year_1_arm_1': 'baseline',
+    '1_year_follow_up_y_arm_1': '1yr',
+    '2_year_follow_up_y_arm_1': '2yr',
+    '3_year_follow_up_y_arm_1': '3yr',
+}
+DEFAULT_EVENTS = ['baseline_year_1_arm_1']
+
+
+def resolve_events(variables, events=None, events_per_variable=None):
+    """Return {variable: [events]} using per-variable overrides, falling back to `events`."""
+    events = list(events or DEFAULT_EVENTS)
+    events_per_variable = events_per_variable or {}
+    return {v: list(events_per_variable.get(v, events)) for v in variables}
+
+
+def pivot_file(df, variables, variable_events):
+    """
+    Pivot long-format rows (one row per subject and event) into a wide block with
+    (variable, event) columns using a single unstack. Rows are keyed by the
+    integer 'subject_code' column.
+    """
+    wanted_events = sorted({e for v in variables for e in variable_events[v]})
+    df = df[df['eventname'].isin(wanted_events)]
+    # A subject should have one row per event; keep the last if a table has duplicates
+    df = df.drop_duplicates(subset=['subject_code', 'eventname'], keep='last')
+    wide = df.set_index(['subject_code', 'eventname'])[variables].unstack('eventname')
+    keep_cols = [(v, e) for v in variables for e in variable_events[v] if (v, e) in wide.columns]
+    return wide.reindex(columns=pd.MultiIndex.from_tuples(keep_cols, names=['variable', 'eventname']))
+
+
+def build_longitudinal_matrix(valid_vars, reference_cohort, events=None, events_per_variable=None, flatten_columns=True):
+    """
+    Build a subject x (variable, event) matrix for the reference cohort.
+
+    Each source table is read once (only its needed columns) and pivoted in one
+    step, so the cost is roughly linear in the number of rows read regardless of
+    how many events are requested.
+
+    Args:
+        valid_vars: DataFrame with domain, filename and variable columns (see get_valid_variables).
+        reference_cohort: array of src_subject_id values defining the rows.
+        events: default list of event names to take for every variable.
+        events_per_variable: optional {variable: [event names]} overrides.
+        flatten_columns: if True, name columns '<variable>__<event label>' instead of a MultiIndex.
+    """
+    subjects = SubjectIndex(reference_cohort)
+    cohort_codes = pd.RangeIndex(len(subjects), name='subject_code')
+    variable_events = resolve_events(valid_vars['variable'].unique(), events, events_per_variable)
+
+    blocks = []
+    for (domain, filename), variables in group_variables_by_file(valid_vars).items():
+        variables = [v for v in variables if variable_events[v]]
+        file_path = get_data_file_path(domain, filename)
+        if not variables:
+            continue
+        if not file_path.exists():
+            print(f"Warning: Could not find {file_path}")
+            continue
+
+        try:
+            with PROFILER.file(file_path) as rec:
+                wanted_cols = set(['src_subject_id', 'eventname'] + variables)
+                df = pd.read_csv(file_path, usecols=lambda c: c in wanted_cols, dtype=SUBJECT_ID_DTYPE)
+                rec.set_input(df)
+                # Filter and key rows on integer subject codes instead of ID strings
+                codes = subjects.encode(df['src_subject_id'])
+                df = df.drop(columns='src_subject_id')[codes >= 0]
+                df['subject_code'] = codes[codes >= 0]
+                present_vars = [v for v in variables if v in df.columns]
+                block = pivot_file(df, present_vars, variable_events)
+                # Align to the cohort order so blocks can be concatenated without a join
+                blocks.append(block.reindex(cohort_codes))
+                rec.set_output(block)
+        except Exception as e:
+            print(f"Error processing {file_path}: {str(e)}")
+            continue
+
+    if blocks:
+        matrix = pd.concat(blocks, axis=1)
+        # The same variable may be listed under more than one file; keep the first
+        matrix = matrix.loc[:, ~matrix.columns.duplicated()]
+    else:
+        matrix = pd.DataFrame(index=cohort_codes)
+
+    if flatten_columns:
+        matrix.columns = [f"{v}__{EVENT_LABELS.get(e, e)}" for v, e in matrix.columns]
+    # Restore the subject ID strings on output
+    matrix.index = pd.Index(subjects.ids, name='src_subject_id')
+    return matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a subject x (variable, event) matrix for the reference cohort.")
+    parser.add_argument('--events', nargs='+', default=DEFAULT_EVENTS,
+                        help="Event names to take for every variable (default: baseline only).")
+    parser.add_argument('--output', default=os.path.join('results', 'longitudinal_variables.csv'))
+    args = parser.parse_args()
+    PROFILER.start()
+
+    with PROFILER.stage('get_valid_variables'):
+        valid_vars = get_valid_variables()
+    with PROFILER.stage('get_reference_cohort'):
+        reference_cohort, depress_scores = get_reference_cohort()
+
+    print(f"Building longitudinal matrix for events: {', '.join(args.events)}")
+    with PROFILER.stage('build_longitudinal_matrix') as rec:
+        matrix = build_longitudinal_matrix(valid_vars, reference_cohort, events=args.events)
+        rec.set_output(matrix)
+
+    # Attach the 3-year depression score target
+    target = SubjectIndex(reference_cohort).align(depress_scores, ['3_yr_depress_score'])
+    matrix.insert(0, '3_yr_depress_score', target['3_yr_depress_score'])
+    matrix = matrix.reset_index()
+    print(f"Longitudinal matrix shape: {matrix.shape}")
+
+    matrix.to_csv(args.output, index=False)
+    print(f"\nLongitudinal data saved to: {args.output}")
+    PROFILER.write_report()
+
+
+if __name__ == "__main__":
+    main()
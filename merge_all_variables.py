@@ -1,20 +1,48 @@
+import argparse
 import pandas as pd
 import numpy as np
 from pathlib import Path
 import os
+import json
 from sklearn.preprocessing import StandardScaler
+from pipeline_profiling import PipelineProfiler
+from subject_index import SubjectIndex, SUBJECT_ID_DTYPE
+from feature_store import write_feature_store, store_path_for
+from artifacts import write_artifact, read_artifact, stored_file, input_fingerprints
+from column_catalog import load_column_catalog
+from csv_reader import prefetch_csv
+from imputation import BlockImputer, make_imputer, IMPUTER_PATH
+from missing_codes import mask_sentinels
+from sparse_features import encode_sparse, save_sparse_design
+from sharding import in_shard, run_shards, save_shard_result, load_shard_results, add_shard_arguments
+
+# Collects per-stage and per-file timings for this run (see pipeline_profiling.py)
+PROFILER = PipelineProfiler('merge_all_variables')
+
+# Variables kept by analyze_all_domains.py, and the processed matrix this script writes
+VARIABLE_ANALYSIS_PATH = os.path.join('results', 'variable_analysis_results.parquet')
+MERGED_VARIABLES_PATH = os.path.join('results', 'merged_variables.parquet')
+# Fitted imputation/scaling parameters written by main() and bundled with trained models
+PREPROCESSING_STATS_PATH = os.path.join('results', 'preprocessing_stats.json')
+# Cells masked by the sentinel-code policies, per variable and code
+SENTINEL_COUNTS_PATH = os.path.join('results', 'sentinel_counts.csv')
+# 'simple' (mean/mode fill), or a model-based imputer from imputation.py: 'knn' or 'chained'
+IMPUTATION_METHOD = os.environ.get('IMPUTATION_METHOD', 'simple')
+# 'sparse' also writes the features as a sparse design matrix (see sparse_features.py), which
+# prepare_rf_data.py trains on with the same setting; the dense matrix is still written for the other scripts.
+# Only the one-hot columns get smaller: z-scored columns cost more as CSR non-zeros than dense
+FEATURE_ENCODING = os.environ.get('FEATURE_ENCODING', 'dense')
 
 def get_valid_variables():
     """Get list of valid variables from the analysis results."""
-    results_file = Path('results/variable_analysis_results.csv')
-    if not results_file.exists():
-        raise FileNotFoundError("Could not find variable_analysis_results.csv")
+    if stored_file(VARIABLE_ANALYSIS_PATH) is None:
+        raise FileNotFoundError("Could not find variable_analysis_results.parquet")
     
-    # Read the results file
-    results_df = pd.read_csv(results_file)
+    # Read only the columns needed from the results table
+    results_df = read_artifact(VARIABLE_ANALYSIS_PATH, columns=['domain', 'filename', 'variable', 'var_type'])
     
     # Get unique combinations of domain, filename, and variable
-    valid_vars = results_df[['domain', 'filename', 'variable', 'var_type']].drop_duplicates()
+    valid_vars = results_df.drop_duplicates()
     return valid_vars
 
 def get_reference_cohort():
@@ -23,17 +51,17 @@ def get_reference_cohort():
     if not cbcl_file.exists():
         raise FileNotFoundError("Could not find mh_p_cbcl.csv")
     
-    # Read the CBCL file
-    df = pd.read_csv(cbcl_file)
+    # Read only the columns the cohort definition needs
+    with PROFILER.file(cbcl_file) as rec:
+        df = pd.read_csv(cbcl_file, usecols=['src_subject_id', 'eventname', 'cbcl_scr_dsm5_depress_r'])
+        rec.set_input(df)
     
     # Filter for three-year follow-up
     three_year_df = df[df['eventname'] == '3_year_follow_up_y_arm_1']
     
-    # Define invalid values
-    invalid_values = [555, 999, 777, np.nan]
-    
-    # Get subjectkeys with valid responses for cbcl_scr_dsm5_depress_r
-    valid_subjects = three_year_df[~three_year_df['cbcl_scr_dsm5_depress_r'].isin(invalid_values)]['src_subject_id'].unique()
+    # Get subjectkeys with valid responses for cbcl_scr_dsm5_depress_r (sentinel codes masked to NaN)
+    three_year_df, _ = mask_sentinels(three_year_df, ['cbcl_scr_dsm5_depress_r'])
+    valid_subjects = three_year_df[three_year_df['cbcl_scr_dsm5_depress_r'].notna()]['src_subject_id'].unique()
     
     # Get depression scores for valid subjects
     depress_scores = three_year_df[three_year_df['src_subject_id'].isin(valid_subjects)][['src_subject_id', 'cbcl_scr_dsm5_depress_r']]
@@ -41,66 +69,142 @@ def get_reference_cohort():
     
     return valid_subjects, depress_scores
 
-def load_and_prepare_data(valid_vars, reference_cohort, depress_scores):
-    """Load and prepare data from all valid variables."""
-    # Initialize empty DataFrame with reference cohort and depression scores
-    merged_df = pd.DataFrame({'src_subject_id': reference_cohort})
-    merged_df = pd.merge(merged_df, depress_scores, on='src_subject_id', how='left')
+def get_data_file_path(domain, filename):
+    """Return the path of a data file given its analysis domain name."""
+    # Use hyphens for all spaces in domain names to match directory structure
+    domain_path = domain.lower().replace(' & ', '-').replace(' ', '-')
+    return Path(f"data/core/{domain_path}/{filename}")
+
+def group_variables_by_file(valid_vars):
+    """Group valid variables by source file so that each file is only read once.
+
+    Returns a dict mapping (domain, filename) to the list of variables from that file,
+    in the order they appear in valid_vars.
+    """
+    file_groups = {}
+    for domain, filename, variable in zip(valid_vars['domain'], valid_vars['filename'], valid_vars['variable']):
+        variables = file_groups.setdefault((domain, filename), [])
+        if variable not in variables:
+            variables.append(variable)
+    return file_groups
+
+def load_and_prepare_data(valid_vars, reference_cohort, depress_scores, catalog=None, sentinel_counts=None, shard=None):
+    """Load and prepare data from all valid variables.
+
+    Sentinel codes are masked to NaN as each file is loaded (see missing_codes.py).
+    If a `sentinel_counts` list is given, a table of masked cells per variable and
+    code is appended to it for every file. With shard=(index, count) only that
+    subject shard's rows are read into the result and counted.
+    """
+    # Header-only index of the data tree: column lists are settled before any file is read
+    catalog = catalog or load_column_catalog()
+    # Map subject IDs to dense integer codes once; all filtering and joining below uses the codes
+    subjects = SubjectIndex(reference_cohort)
+    
+    # Start from the depression scores, aligned to the reference cohort
+    merged_columns = subjects.align(depress_scores, ['3_yr_depress_score'])
     
     # Create a dictionary to store variable types
     var_types = dict(zip(valid_vars['variable'], valid_vars['var_type']))
     
-    # Process each file
-    for _, row in valid_vars.iterrows():
-        # Use hyphens for all spaces in domain names to match directory structure
-        domain_path = row['domain'].lower().replace(' & ', '-').replace(' ', '-')
-        file_path = Path(f"data/core/{domain_path}/{row['filename']}")
+    # Plan every read from the file headers: each file is read once, taking all of its valid variables together
+    read_plan = []
+    claimed = set(merged_columns)
+    for (domain, filename), variables in group_variables_by_file(valid_vars).items():
+        file_path = get_data_file_path(domain, filename)
+        if not file_path.exists():
+            # The file may have moved to another domain directory
+            file_path = catalog.find_file(filename) or file_path
         if not file_path.exists():
             print(f"Warning: Could not find {file_path}")
             continue
         
         try:
-            # Read the file
-            df = pd.read_csv(file_path)
-            
-            # Filter for baseline visit
-            baseline_df = df[df['eventname'] == 'baseline_year_1_arm_1']
-            
-            # Filter for reference cohort
-            baseline_df = baseline_df[baseline_df['src_subject_id'].isin(reference_cohort)]
-            
-            # Get the variable
-            if row['variable'] in baseline_df.columns:
-                # Create a new DataFrame with just the subject ID and the variable
-                var_df = baseline_df[['src_subject_id', row['variable']]]
+            # Get the variables present in this file from its header
+            header = set(catalog.columns(file_path))
+        except Exception as e:
+            print(f"Error processing {file_path}: {str(e)}")
+            continue
+        present_vars = [v for v in variables if v in header and v not in claimed]
+        missing_vars = [v for v in variables if v not in header]
+        if missing_vars:
+            print(f"Warning: {len(missing_vars)} variables not found in {file_path}: {', '.join(missing_vars[:5])}")
+        if present_vars:
+            claimed.update(present_vars)
+            read_plan.append((file_path, present_vars))
+    
+    # Files are read in background threads, a few ahead of the merge below
+    reads = ((plan, plan[0], {'usecols': ['src_subject_id', 'eventname'] + plan[1], 'dtype': SUBJECT_ID_DTYPE})
+             for plan in read_plan)
+    for (file_path, present_vars), df_future in prefetch_csv(reads):
+        try:
+            with PROFILER.file(file_path) as rec:
+                # Only the ID/event columns and the variables we need were read
+                df = df_future.result()
+                rec.set_input(df)
                 
-                # Merge with the main DataFrame
-                merged_df = pd.merge(merged_df, var_df, on='src_subject_id', how='left')
+                # Filter for baseline visit
+                baseline_df = df[df['eventname'] == 'baseline_year_1_arm_1']
+                if shard is not None:
+                    # Only this shard's subjects, so the sentinel counts of all shards add up to the whole file's
+                    baseline_df = baseline_df[in_shard(baseline_df['src_subject_id'], *shard)]
+                
+                # Mask sentinel codes (missing, not applicable) in one pass over the file's variables
+                baseline_df, file_counts = mask_sentinels(baseline_df, present_vars)
+                if sentinel_counts is not None:
+                    sentinel_counts.append(file_counts.assign(filename=file_path.name))
+                
+                # Filter for the reference cohort and place each variable by subject code
+                merged_columns.update(subjects.align(baseline_df, present_vars))
+                rec.extra['n_columns_merged'] = len(present_vars)
                 
         except Exception as e:
             print(f"Error processing {file_path}: {str(e)}")
             continue
     
+    # Keep the column order of the analysis results and restore the subject ID strings
+    ordered_vars = [v for v in dict.fromkeys(valid_vars['variable']) if v in merged_columns]
+    merged_df = subjects.to_frame({col: merged_columns[col] for col in ['3_yr_depress_score'] + ordered_vars})
+    
     return merged_df, var_types
 
-def handle_missing_values(df):
-    """Handle missing values in the dataset."""
-    # Define invalid values
-    invalid_values = [555, 999, 777, np.nan]
-    
-    # Replace invalid values with NaN
-    df = df.replace(invalid_values, np.nan)
-    
-    return df
+def impute_with_model(df, var_types, method, imputer_path=IMPUTER_PATH):
+    """
+    Fill missing values of all numeric typed columns jointly with a model-based
+    imputer (see imputation.py) and save the fitted imputer for inference.
+    Binary/categorical columns are filled with an observed category.
+    Returns the list of imputed columns.
+    """
+    columns = [c for c in df.columns
+               if var_types.get(c) in ('binary', 'categorical', 'continuous', 'ordinal')
+               and pd.api.types.is_numeric_dtype(df[c]) and df[c].notna().any()]
+    categorical = [i for i, c in enumerate(columns) if var_types[c] in ('binary', 'categorical')]
+    imputer = make_imputer(method, categorical_columns=categorical)
+    df[columns] = imputer.fit_transform(df[columns].to_numpy(dtype=np.float64), feature_names=columns)
+    imputer.save(imputer_path)
+    print(f"{method} imputation of {len(columns)} columns fitted in {imputer.fit_time_s_:.2f}s; imputer saved to {imputer_path}")
+    return columns
 
-def preprocess_variables(df, var_types):
+def preprocess_variables(df, var_types, stats=None, imputation_method='simple'):
     """Preprocess variables based on their types:
     - Binary/Categorical: Mode imputation + One-hot encoding
     - Continuous/Ordinal: Mean imputation + Z-scoring
+
+    With imputation_method 'knn' or 'chained', missing values are first filled
+    by a model-based imputer fitted across all columns; the mode/mean fill then
+    only applies to columns it could not handle.
+
+    If a `stats` dict is given, it is filled with the fitted imputation values,
+    scaling parameters and dummy categories for each column so the same
+    preprocessing can be applied at inference time.
     """
     # Get the reference cohort and depression score columns
     id_cols = ['src_subject_id', '3_yr_depress_score']
     processed_df = df[id_cols].copy()
+
+    model_imputed = set()
+    if imputation_method != 'simple':
+        model_imputed.update(impute_with_model(df, var_types, imputation_method))
     
     # Process each column
     for col in df.columns:
@@ -124,6 +228,15 @@ def preprocess_variables(df, var_types):
             # One-hot encode categorical variables
             dummies = pd.get_dummies(df[col], prefix=col, drop_first=True)
             processed_df = pd.concat([processed_df, dummies], axis=1)
+            if stats is not None:
+                stats[col] = {
+                    'var_type': var_type,
+                    'impute_value': mode_val,
+                    'categories': sorted(df[col].unique().tolist()),
+                    'dummy_columns': dummies.columns.tolist(),
+                }
+                if col in model_imputed:
+                    stats[col]['imputer'] = imputation_method
             
         elif var_type in ['continuous', 'ordinal']:
             # Mean imputation for continuous/ordinal variables
@@ -134,6 +247,15 @@ def preprocess_variables(df, var_types):
             scaler = StandardScaler()
             scaled_values = scaler.fit_transform(df[col].values.reshape(-1, 1))
             processed_df[col] = scaled_values
+            if stats is not None:
+                stats[col] = {
+                    'var_type': var_type,
+                    'impute_value': mean_val,
+                    'mean': float(scaler.mean_[0]),
+                    'std': float(scaler.scale_[0]),
+                }
+                if col in model_imputed:
+                    stats[col]['imputer'] = imputation_method
             
         else:
             print(f"Warning: Unknown variable type for {col}: {var_type}")
@@ -141,26 +263,133 @@ def preprocess_variables(df, var_types):
     
     return processed_df
 
+def apply_preprocessing_stats(df, stats, imputer_path=IMPUTER_PATH):
+    """Preprocess new rows with previously fitted statistics instead of refitting them.
+
+    Uses the imputation values, scaling parameters and dummy categories that
+    preprocess_variables recorded in `stats`, so the output has exactly the
+    columns of the original processed data. Columns that were model-imputed are
+    first filled with the saved imputer. Category values that were not seen
+    when the statistics were fitted get all-zero dummies and are reported.
+    """
+    id_cols = ['src_subject_id', '3_yr_depress_score']
+    df = df.copy()
+    processed_columns = {col: df[col] for col in id_cols}
+
+    imputed_columns = [col for col, col_stats in stats.items() if col_stats.get('imputer') and col in df.columns]
+    if imputed_columns and Path(imputer_path).exists():
+        imputer = BlockImputer.load(imputer_path)
+        columns = imputer.feature_names_ or imputed_columns
+        frame = df.reindex(columns=columns).astype(np.float64)
+        df[columns] = imputer.transform(frame.to_numpy())
+
+    for col, col_stats in stats.items():
+        values = df[col] if col in df.columns else pd.Series(np.nan, index=df.index)
+        values = values.fillna(col_stats['impute_value'])
+        if col_stats['var_type'] in ['binary', 'categorical']:
+            categories = col_stats['categories']
+            unseen = ~values.isin(categories)
+            if unseen.any():
+                print(f"Warning: {unseen.sum()} values of {col} were not seen when fitting; encoded as all-zero dummies")
+            # drop_first: the dummy columns are categories[1:], in order
+            for category, dummy in zip(categories[1:], col_stats['dummy_columns']):
+                processed_columns[dummy] = values == category
+        else:
+            processed_columns[col] = (values.astype(np.float64) - col_stats['mean']) / col_stats['std']
+
+    return pd.DataFrame(processed_columns, index=df.index)
+
+def load_shard(shard_index, n_shards):
+    """Load and merge the variables of one subject shard of the reference cohort (a worker process or --shard-index run)."""
+    valid_vars = get_valid_variables()
+    reference_cohort, depress_scores = get_reference_cohort()
+    shard_cohort = reference_cohort[in_shard(reference_cohort, shard_index, n_shards)]
+    sentinel_counts = []
+    merged_df, var_types = load_and_prepare_data(valid_vars, shard_cohort, depress_scores,
+                                                 sentinel_counts=sentinel_counts, shard=(shard_index, n_shards))
+    print(f"Shard {shard_index + 1}/{n_shards}: {len(merged_df)} subjects merged.")
+    return merged_df, var_types, sentinel_counts
+
+def combine_shards(shard_results, reference_cohort):
+    """
+    Stack the row blocks of all shards back into reference-cohort order, giving the
+    same frame load_and_prepare_data builds for the whole cohort, and add up the
+    per-shard sentinel counts.
+    """
+    merged_df = pd.concat([frame for frame, _, _ in shard_results], ignore_index=True)
+    codes = SubjectIndex(reference_cohort).encode(merged_df['src_subject_id'].astype(str).to_numpy(dtype=object))
+    merged_df = merged_df.iloc[np.argsort(codes, kind='stable')].reset_index(drop=True)
+    var_types = shard_results[0][1]
+    counts = [table for _, _, tables in shard_results for table in tables]
+    sentinel_counts = []
+    if counts:
+        combined = pd.concat(counts, ignore_index=True)
+        sentinel_counts.append(combined.groupby(['variable', 'code', 'policy', 'filename'], sort=False, as_index=False)['count'].sum())
+    return merged_df, var_types, sentinel_counts
+
 def main():
+    parser = argparse.ArgumentParser(description="Merge the valid variables of the reference cohort and preprocess them.")
+    args = add_shard_arguments(parser).parse_args()
+    PROFILER.start()
+    if args.shard_index is not None:
+        # One shard's row block, combined later by a --combine run
+        save_shard_result(load_shard(args.shard_index, args.shards), 'merge', args.shard_index, args.shards)
+        PROFILER.write_report()
+        return
+
     # Get valid variables
-    valid_vars = get_valid_variables()
+    with PROFILER.stage('get_valid_variables') as rec:
+        valid_vars = get_valid_variables()
+        rec.set_output(valid_vars)
     
     # Get reference cohort and depression scores
-    reference_cohort, depress_scores = get_reference_cohort()
+    with PROFILER.stage('get_reference_cohort') as rec:
+        reference_cohort, depress_scores = get_reference_cohort()
+        rec.set_output(depress_scores)
     
     # Load and prepare data
     print("Loading and preparing data...")
-    merged_df, var_types = load_and_prepare_data(valid_vars, reference_cohort, depress_scores)
+    with PROFILER.stage('load_and_prepare_data') as rec:
+        rec.set_input(valid_vars)
+        if args.shards > 1:
+            # Subject shards are loaded independently (local processes or earlier --shard-index runs)
+            shard_results = (load_shard_results('merge', args.shards) if args.combine
+                             else run_shards(load_shard, args.shards, args.workers))
+            merged_df, var_types, sentinel_counts = combine_shards(shard_results, reference_cohort)
+            rec.extra['shards'] = args.shards
+        else:
+            sentinel_counts = []
+            merged_df, var_types = load_and_prepare_data(valid_vars, reference_cohort, depress_scores,
+                                                         sentinel_counts=sentinel_counts)
+        rec.set_output(merged_df)
     
-    # Handle missing values
-    print("Handling missing values...")
-    merged_df = handle_missing_values(merged_df)
+    # Sentinel codes were masked while loading; report what was masked
+    if sentinel_counts:
+        counts_df = pd.concat(sentinel_counts, ignore_index=True)
+        counts_df.to_csv(SENTINEL_COUNTS_PATH, index=False)
+        print("Masked sentinel codes (cells):")
+        print(counts_df.groupby(['code', 'policy'])['count'].sum().to_string())
+        print(f"Per-variable counts saved to: {SENTINEL_COUNTS_PATH}")
     
     # Preprocess variables
     print("Preprocessing variables...")
+    if IMPUTATION_METHOD != 'simple':
+        print(f"- All variables: {IMPUTATION_METHOD} model-based imputation")
     print("- Binary/Categorical variables: Mode imputation + One-hot encoding")
     print("- Continuous/Ordinal variables: Mean imputation + Z-scoring")
-    processed_df = preprocess_variables(merged_df, var_types)
+    if FEATURE_ENCODING == 'sparse':
+        # Encode before preprocess_variables fills the frame in place; model-based imputation
+        # only applies to the dense path
+        with PROFILER.stage('encode_sparse') as rec:
+            rec.set_input(merged_df)
+            save_sparse_design(encode_sparse(merged_df, var_types))
+
+    with PROFILER.stage('preprocess_variables') as rec:
+        rec.set_input(merged_df)
+        preprocessing_stats = {}
+        processed_df = preprocess_variables(merged_df, var_types, stats=preprocessing_stats,
+                                            imputation_method=IMPUTATION_METHOD)
+        rec.set_output(processed_df)
     
     # Count complete cases
     complete_cases = processed_df.dropna().shape[0]
@@ -168,9 +397,26 @@ def main():
     print(f"Percentage of complete cases: {(complete_cases/len(reference_cohort))*100:.2f}%")
     
     # Save the final processed dataset
-    output_path = os.path.join('results', 'merged_variables.csv')
-    processed_df.to_csv(output_path, index=False)
+    output_path = MERGED_VARIABLES_PATH
+    with PROFILER.stage('save_results') as rec:
+        input_files = [stored_file(VARIABLE_ANALYSIS_PATH), 'data/core/mental-health/mh_p_cbcl.csv']
+        input_files += [get_data_file_path(domain, filename) for domain, filename in group_variables_by_file(valid_vars)]
+        write_artifact(processed_df, output_path, stage='merge_all_variables',
+                       parameters={'imputation_method': IMPUTATION_METHOD, 'feature_encoding': FEATURE_ENCODING,
+                                   'shards': args.shards, 'n_subjects': len(reference_cohort)},
+                       inputs=input_fingerprints(input_files))
+        # Memory-mapped copy for fast loading by downstream scripts
+        write_feature_store(processed_df, store_path_for(output_path))
+        rec.set_output(processed_df)
     print(f"\nProcessed data saved to: {output_path}")
 
+    # Save the fitted preprocessing parameters; they are bundled with the trained model
+    with open(PREPROCESSING_STATS_PATH, 'w') as f:
+        json.dump(preprocessing_stats, f, indent=2, default=float)
+    print(f"Preprocessing statistics saved to: {PREPROCESSING_STATS_PATH}")
+
+    PROFILER.print_summary()
+    PROFILER.write_report()
+
 if __name__ == "__main__":
     main() 
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+# What each ABCD sentinel code means for every column:
+# 'missing' and 'not_applicable' (888, branching logic) are masked to NaN, 'keep' leaves the value as data.
+SENTINEL_POLICIES = {
+    555: 'missing',
+    777: 'missing',
+    999: 'missing',
+    888: 'not_applicable',
+}
+
+# Per-column exceptions, applied in order to columns whose lower-cased name contains every
+# substring listed: (substrings, {code: policy})
+COLUMN_POLICY_OVERRIDES = [
+    # Family history yes/no items code "don't know" as 7
+    (('fam_history', 'yes_no'), {7: 'missing'}),
+]
+
+MASKED_POLICIES = ('missing', 'not_applicable')
+
+
+def policy_for(column):
+    """Return the {code: policy} table that applies to one column."""
+    policy = dict(SENTINEL_POLICIES)
+    col_lower = column.lower()
+    for substrings, overrides in COLUMN_POLICY_OVERRIDES:
+        if all(part in col_lower for part in substrings):
+            policy.update(overrides)
+    return policy
+
+
+def mask_sentinels(df, columns=None, integer_na=False):
+    """
+    Mask sentinel codes in the numeric columns of df in one vectorized pass.
+
+    Columns sharing a policy table are checked together as one 2-D block.
+    Returns (masked copy of df, counts) where counts has one row per
+    (variable, code) that occurred, with its policy and number of cells.
+    Masked integer columns become float64, or nullable Int64 with integer_na=True
+    so their values keep printing as integers.
+    """
+    columns = [c for c in (df.columns if columns is None else columns) if pd.api.types.is_numeric_dtype(df[c])]
+    groups = {}
+    for col in columns:
+        groups.setdefault(tuple(sorted(policy_for(col).items())), []).append(col)
+
+    result = df.copy(deep=False)
+    count_rows = []
+    for policy, cols in groups.items():
+        values = df[cols].to_numpy(dtype=np.float64)
+        mask = np.zeros(values.shape, dtype=bool)
+        for code, action in policy:
+            hits = values == code
+            for col, n_hits in zip(cols, hits.sum(axis=0)):
+                if n_hits:
+                    count_rows.append({'variable': col, 'code': code, 'policy': action, 'count': int(n_hits)})
+            if action in MASKED_POLICIES:
+                mask |= hits
+        for j in np.flatnonzero(mask.any(axis=0)):
+            col = cols[j]
+            if integer_na and pd.api.types.is_integer_dtype(df[col]):
+                result[col] = df[col].astype('Int64').mask(mask[:, j])
+            else:
+                result[col] = np.where(mask[:, j], np.nan, values[:, j])
+
+    counts = pd.DataFrame(count_rows, columns=['variable', 'code', 'policy', 'count'])
+    return result, counts
@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+import stat
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import joblib
+
+# Root of the registry: versions/<version>/ holds immutable bundles, pointers/<name> names a version
+REGISTRY_DIR = Path('results/model_registry')
+DEFAULT_POINTER = 'current'
+
+MODEL_FILE = 'model.joblib'
+FEATURES_FILE = 'feature_names.json'
+STATS_FILE = 'preprocessing_stats.json'
+METADATA_FILE = 'metadata.json'
+
+
+def threshold_pointer(label):
+    """Pointer name for the model trained at one target threshold (e.g. 'p75' -> 'threshold-p75')."""
+    return f"threshold-{label}"
+
+
+def family_pointer(name):
+    """Pointer name for the model of one family trained by depression_predictor.py (e.g. 'lasso' -> 'family-lasso')."""
+    return f"family-{name}"
+
+
+def _atomic_write_text(path, text):
+    """Write text to path via a temporary file and rename, so readers never see a partial file."""
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{uuid.uuid4().hex[:6]}.tmp")
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ModelBundle:
+    """A loaded model version: estimator, feature list, preprocessing stats and metadata."""
+
+    def __init__(self, version, model, feature_names, preprocessing_stats=None, metadata=None, path=None):
+        self.version = version
+        self.model = model
+        self.feature_names = feature_names
+        self.preprocessing_stats = preprocessing_stats or {}
+        self.metadata = metadata or {}
+        self.path = Path(path) if path is not None else None
+
+    def __repr__(self):
+        return f"ModelBundle(version={self.version!r}, n_features={len(self.feature_names)})"
+
+
+class ModelRegistry:
+    """
+    Stores every trained model as an immutable, versioned bundle directory and
+    keeps named pointers (e.g. 'current') to the version that should be served.
+
+    A bundle is written to a temporary directory and renamed into versions/ in
+    one step, and pointers are replaced atomically, so a reader always sees
+    either the old or the new version, never a half-written one.
+    """
+
+    def __init__(self, root=REGISTRY_DIR):
+        self.root = Path(root)
+        self.versions_dir = self.root / 'versions'
+        self.pointers_dir = self.root / 'pointers'
+
+    def publish(self, model, feature_names, preprocessing_stats=None, metadata=None,
+                pointer=DEFAULT_POINTER, extra_files=None):
+        """
+        Write a new bundle and (unless pointer is None) point `pointer` at it.
+
+        extra_files is an optional {filename: callable(path)} used to write
+        additional artifacts into the bundle before it is made visible.
+        Returns the new version string.
+        """
+        version = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+        self.versions_dir.mkdir(parents=True, exist_ok=True)
+        tmp_dir = self.versions_dir / f".tmp-{version}"
+        tmp_dir.mkdir()
+        try:
+            joblib.dump(model, tmp_dir / MODEL_FILE)
+            with open(tmp_dir / FEATURES_FILE, 'w') as f:
+                json.dump(list(feature_names), f)
+            with open(tmp_dir / STATS_FILE, 'w') as f:
+                json.dump(preprocessing_stats or {}, f, default=str)
+            bundle_metadata = dict(metadata or {})
+            bundle_metadata.update({'version': version, 'created_at': datetime.now().isoformat(timespec='seconds')})
+            with open(tmp_dir / METADATA_FILE, 'w') as f:
+                json.dump(bundle_metadata, f, indent=2, default=str)
+            for filename, write_fn in (extra_files or {}).items():
+                write_fn(tmp_dir / filename)
+            # Bundles are immutable once published
+            for file_path in tmp_dir.iterdir():
+                file_path.chmod(stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.rename(tmp_dir, self.versions_dir / version)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        print(f"Published model version {version} to {self.versions_dir / version}")
+        if pointer is not None:
+            self.set_pointer(version, pointer)
+        return version
+
+    def set_pointer(self, version, pointer=DEFAULT_POINTER):
+        """Atomically point `pointer` at an existing version."""
+        if not (self.versions_dir / version).is_dir():
+            raise ValueError(f"Unknown model version: {version}")
+        self.pointers_dir.mkdir(parents=True, exist_ok=True)
+        _atomic_write_text(self.pointers_dir / pointer, version)
+        print(f"Pointer '{pointer}' now refers to model version {version}")
+
+    def get_pointer(self, pointer=DEFAULT_POINTER):
+        """Return the version a pointer refers to, or None if it is not set."""
+        try:
+            return (self.pointers_dir / pointer).read_text().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def list_versions(self):
+        if not self.versions_dir.exists():
+            return []
+        return sorted(p.name for p in self.versions_dir.iterdir() if p.is_dir() and not p.name.startswith('.'))
+
+    def version_path(self, version):
+        return self.versions_dir / version
+
+    def load(self, version):
+        """Load a bundle by version."""
+        bundle_dir = self.version_path(version)
+        model = joblib.load(bundle_dir / MODEL_FILE)
+        with open(bundle_dir / FEATURES_FILE) as f:
+            feature_names = json.load(f)
+        with open(bundle_dir / STATS_FILE) as f:
+            preprocessing_stats = json.load(f)
+        with open(bundle_dir / METADATA_FILE) as f:
+            metadata = json.load(f)
+        return ModelBundle(version, model, feature_names, preprocessing_stats, metadata, path=bundle_dir)
+
+    def load_pointer(self, pointer=DEFAULT_POINTER):
+        """Load the bundle a pointer refers to, or None if the pointer is not set."""
+        version = self.get_pointer(pointer)
+        return self.load(version) if version else None
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from scipy.stats import spearmanr
+from sklearn.metrics import roc_auc_score
+
+# Cached importance tables, one file per (model version, evaluation data, settings)
+CACHE_DIR = Path('results/permutation_importance')
+
+
+def build_feature_groups(feature_names, preprocessing_stats=None):
+    """
+    Group model columns by source variable so that all one-hot dummies of a
+    categorical variable are permuted together. Uses the dummy column lists in
+    the preprocessing statistics; every other column is its own group.
+    """
+    feature_names = list(feature_names)
+    position = {f: i for i, f in enumerate(feature_names)}
+    groups = {}
+    grouped = set()
+    for variable, stats in (preprocessing_stats or {}).items():
+        columns = [c for c in stats.get('dummy_columns', []) if c in position]
+        if columns:
+            groups[variable] = [position[c] for c in columns]
+            grouped.update(columns)
+    for feature in feature_names:
+        if feature not in grouped:
+            groups[feature] = [position[feature]]
+    return groups
+
+
+def _score(model, X, y):
+    with warnings.catch_warnings():
+        # Models fitted on DataFrames warn when scored on the plain array
+        warnings.simplefilter('ignore', UserWarning)
+        return roc_auc_score(y, model.predict_proba(X)[:, 1])
+
+
+def _permuted_scores(model, X, y, group_items, seed):
+    """Score the model with each group's columns shuffled (one shared row permutation per group)."""
+    rng = np.random.default_rng(seed)
+    X_work = np.array(X, copy=True)
+    scores = []
+    for _, columns in group_items:
+        order = rng.permutation(len(X_work))
+        original = X_work[:, columns].copy()
+        X_work[:, columns] = original[order]
+        scores.append(_score(model, X_work, y))
+        X_work[:, columns] = original
+    return scores
+
+
+def _cache_key(model_version, X, y, groups, n_repeats, random_state):
+    digest = hashlib.sha1()
+    digest.update(str(model_version).encode())
+    digest.update(np.ascontiguousarray(X).tobytes())
+    digest.update(np.ascontiguousarray(y).tobytes())
+    digest.update(json.dumps(groups, sort_keys=True).encode())
+    digest.update(f"{n_repeats}:{random_state}".encode())
+    return digest.hexdigest()[:16]
+
+
+def grouped_permutation_importance(model, X, y, groups, n_repeats=10, min_repeats=3, rank_tolerance=0.99,
+                                   top_k=50, n_jobs=-1, random_state=42, model_version=None, cache_dir=CACHE_DIR):
+    """
+    Permutation importance (drop in ROC AUC) for groups of columns.
+
+    Groups are scored in parallel across worker processes; the evaluation
+    matrix is memory-mapped to the workers by joblib rather than copied.
+    Repeats are run one round at a time and stop early once the ranking of the
+    top_k groups is stable between rounds (Spearman rho >= rank_tolerance).
+    Results are cached per model version when model_version is given.
+
+    Returns a DataFrame with one row per group, sorted by importance.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y)
+
+    cache_path = None
+    if model_version is not None:
+        key = _cache_key(model_version, X, y, groups, n_repeats, random_state)
+        cache_path = Path(cache_dir) / f"{model_version}_{key}.csv"
+        if cache_path.exists():
+            print(f"Loaded cached permutation importance from {cache_path}")
+            return pd.read_csv(cache_path)
+
+    baseline = _score(model, X, y)
+    group_items = list(groups.items())
+    n_workers = os.cpu_count() if n_jobs == -1 else max(1, n_jobs)
+    chunks = [group_items[i::n_workers] for i in range(n_workers) if group_items[i::n_workers]]
+
+    drops = np.zeros((0, len(group_items)))
+    previous_ranks = None
+    with Parallel(n_jobs=n_jobs) as parallel:
+        for repeat in range(n_repeats):
+            seed = random_state + repeat
+            chunk_scores = parallel(delayed(_permuted_scores)(model, X, y, chunk, seed) for chunk in chunks)
+            round_scores = {}
+            for chunk, scores in zip(chunks, chunk_scores):
+                round_scores.update({name: score for (name, _), score in zip(chunk, scores)})
+            drops = np.vstack([drops, [baseline - round_scores[name] for name, _ in group_items]])
+
+            # Early stopping once the ranking of the most important groups stops changing
+            mean_drop = drops.mean(axis=0)
+            top = np.argsort(-mean_drop)[:top_k]
+            ranks = pd.Series(mean_drop).rank().to_numpy()[top]
+            if previous_ranks is not None and repeat + 1 >= min_repeats:
+                rho = spearmanr(previous_ranks[top], ranks).correlation if len(top) > 1 else 1.0
+                if rho >= rank_tolerance:
+                    print(f"Permutation importance ranks stable after {repeat + 1} repeats (rho={rho:.3f}).")
+                    break
+            previous_ranks = pd.Series(mean_drop).rank().to_numpy()
+
+    result = pd.DataFrame({
+        'feature_group': [name for name, _ in group_items],
+        'n_columns': [len(columns) for _, columns in group_items],
+        'importance_mean': drops.mean(axis=0),
+        'importance_std': drops.std(axis=0),
+        'n_repeats': len(drops),
+        'baseline_auc': baseline,
+    }).sort_values('importance_mean', ascending=False).reset_index(drop=True)
+
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        result.to_csv(cache_path, index=False)
+        print(f"Permutation importance cached to {cache_path}")
+    return result
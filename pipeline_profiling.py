@@ -0,0 +1,245 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows has no resource module; peak RSS is then reported as None
+    resource = None
+
+# Directory where run reports (and optional cProfile dumps) are written
+REPORT_DIR = Path('results/run_reports')
+
+# Comma separated stage names to capture with cProfile, or '*' for every stage.
+# e.g. PIPELINE_PROFILE_STAGES="load_and_prepare_data,preprocess_variables"
+PROFILE_STAGES_ENV = 'PIPELINE_PROFILE_STAGES'
+
+# Profiler of the script currently running (set by start()). Stages timed through any other
+# profiler, e.g. of an imported pipeline module, are recorded into it; outside a run
+# stages are timed but not kept, so long-lived processes do not accumulate records.
+_ACTIVE_PROFILER = None
+
+
+def get_peak_rss_bytes():
+    """Peak resident set size of this process so far, in bytes (None if unavailable)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def frame_shape(df):
+    """Return (rows, columns) for a DataFrame/array-like, or (None, None)."""
+    if df is None:
+        return None, None
+    shape = getattr(df, 'shape', None)
+    if shape is None:
+        return len(df), None
+    if len(shape) == 1:
+        return shape[0], 1
+    return shape[0], shape[1]
+
+
+class StageRecord:
+    """Measurements for one stage (or one file within a stage)."""
+
+    def __init__(self, name, kind='stage', parent=None, path=None):
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.path = str(path) if path is not None else None
+        self.wall_time_s = None
+        self.cpu_time_s = None
+        # Process-lifetime high-water mark at the end of the stage, and how much the stage raised it
+        self.process_peak_rss_bytes = None
+        self.rss_growth_bytes = None
+        self.rows_in = None
+        self.cols_in = None
+        self.rows_out = None
+        self.cols_out = None
+        self.bytes_read = 0
+        self.error = None
+        self.profile_file = None
+        self.extra = {}
+
+    def set_input(self, df):
+        self.rows_in, self.cols_in = frame_shape(df)
+
+    def set_output(self, df):
+        self.rows_out, self.cols_out = frame_shape(df)
+
+    def add_bytes_read(self, path):
+        """Account for a file read in this stage (uses the on-disk size)."""
+        try:
+            self.bytes_read += os.path.getsize(path)
+        except OSError:
+            pass
+
+    def to_dict(self):
+        record = {
+            'name': self.name,
+            'kind': self.kind,
+            'parent': self.parent,
+            'path': self.path,
+            'wall_time_s': self.wall_time_s,
+            'cpu_time_s': self.cpu_time_s,
+            'process_peak_rss_bytes': self.process_peak_rss_bytes,
+            'rss_growth_bytes': self.rss_growth_bytes,
+            'rows_in': self.rows_in,
+            'cols_in': self.cols_in,
+            'rows_out': self.rows_out,
+            'cols_out': self.cols_out,
+            'bytes_read': self.bytes_read,
+            'error': self.error,
+            'profile_file': self.profile_file,
+        }
+        if self.extra:
+            record['extra'] = self.extra
+        return record
+
+
+class PipelineProfiler:
+    """
+    Records wall time, CPU time, peak RSS, rows/columns in and out and bytes read
+    for each stage of a pipeline script, and writes a JSON run report.
+
+    Peak RSS is the process's high-water mark, so per stage it is reported as the
+    mark at the end of the stage (process_peak_rss_bytes) and how much the stage
+    raised it (rss_growth_bytes), not as the stage's own peak.
+
+    Usage:
+        profiler = PipelineProfiler('merge_all_variables')
+        profiler.start()
+        with profiler.stage('load_and_prepare_data') as rec:
+            df = ...
+            rec.set_output(df)
+        profiler.write_report()
+    """
+
+    def __init__(self, run_name, profile_stages=None, report_dir=REPORT_DIR):
+        self.run_name = run_name
+        self.report_dir = Path(report_dir)
+        if profile_stages is None:
+            env_value = os.environ.get(PROFILE_STAGES_ENV, '')
+            profile_stages = [s.strip() for s in env_value.split(',') if s.strip()]
+        self.profile_stages = set(profile_stages)
+        self._reset()
+
+    def _reset(self):
+        self.started_at = datetime.now()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self._stack = []
+        self.records = []
+
+    def start(self):
+        """
+        Begin a run (call at the start of main): clears earlier records, restarts the
+        clock and collects the stages of every profiler until write_report().
+        """
+        global _ACTIVE_PROFILER
+        self._reset()
+        _ACTIVE_PROFILER = self
+        return self
+
+    def _should_profile(self, name):
+        return '*' in self.profile_stages or name in self.profile_stages
+
+    @contextmanager
+    def stage(self, name, kind='stage', path=None):
+        """Time a block of work. Yields a StageRecord that the caller can annotate."""
+        active = _ACTIVE_PROFILER
+        if active is not None and active is not self:
+            with active.stage(name, kind=kind, path=path) as record:
+                yield record
+            return
+        parent = self._stack[-1].name if self._stack else None
+        record = StageRecord(name, kind=kind, parent=parent, path=path)
+        if path is not None and kind == 'file':
+            record.add_bytes_read(path)
+
+        profiler = cProfile.Profile() if self._should_profile(name) else None
+        rss_before = get_peak_rss_bytes()
+        self._stack.append(record)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        except Exception as e:
+            record.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record.wall_time_s = time.perf_counter() - wall_start
+            record.cpu_time_s = time.process_time() - cpu_start
+            record.process_peak_rss_bytes = get_peak_rss_bytes()
+            if rss_before is not None and record.process_peak_rss_bytes is not None:
+                record.rss_growth_bytes = record.process_peak_rss_bytes - rss_before
+            self._stack.pop()
+            # Propagate bytes read by files up to the enclosing stage
+            if self._stack and record.bytes_read:
+                self._stack[-1].bytes_read += record.bytes_read
+            if profiler is not None:
+                record.profile_file = self._dump_profile(name, profiler)
+            if active is self:
+                self.records.append(record)
+
+    def file(self, path, stage_name=None):
+        """Shortcut for timing the processing of a single input file."""
+        return self.stage(stage_name or Path(path).name, kind='file', path=path)
+
+    def _dump_profile(self, name, profiler):
+        self.report_dir.mkdir(parents=True, exist_ok=True)
+        safe_name = name.replace('/', '_').replace(' ', '_')
+        profile_path = self.report_dir / f"{self.run_name}_{self.started_at:%Y%m%d_%H%M%S}_{safe_name}.prof"
+        profiler.dump_stats(profile_path)
+        # Also print the top of the profile so it shows up in the console log
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(15)
+        print(f"\ncProfile for stage '{name}' saved to {profile_path}")
+        print(stream.getvalue())
+        return str(profile_path)
+
+    def report(self):
+        """Return the run report as a JSON-serializable dictionary."""
+        return {
+            'run_name': self.run_name,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'total_wall_time_s': time.perf_counter() - self._start_wall,
+            'total_cpu_time_s': time.process_time() - self._start_cpu,
+            'process_peak_rss_bytes': get_peak_rss_bytes(),
+            'total_bytes_read': sum(r.bytes_read for r in self.records if r.parent is None),
+            'stages': [r.to_dict() for r in self.records if r.kind == 'stage'],
+            'files': [r.to_dict() for r in self.records if r.kind == 'file'],
+        }
+
+    def write_report(self, path=None):
+        """Write the run report as JSON, end the run and return the report's path."""
+        global _ACTIVE_PROFILER
+        if _ACTIVE_PROFILER is self:
+            _ACTIVE_PROFILER = None
+        if path is None:
+            self.report_dir.mkdir(parents=True, exist_ok=True)
+            path = self.report_dir / f"{self.run_name}_{self.started_at:%Y%m%d_%H%M%S}.json"
+        path = Path(path)
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, default=str)
+        print(f"\nRun report saved to: {path}")
+        return path
+
+    def print_summary(self, top_n=10):
+        """Print the slowest stages and files."""
+        print("\nSlowest stages/files (wall time):")
+        for record in sorted(self.records, key=lambda r: r.wall_time_s or 0, reverse=True)[:top_n]:
+            print(f"  {record.kind:<6} {record.name:<45} {record.wall_time_s:8.2f}s wall  {record.cpu_time_s:8.2f}s cpu")
@@ -4,40 +4,243 @@ import numpy as np
 import json
 from pathlib import Path
 import os
+import time
+import threading
 # Import from question_mappings - ONLY import QUESTION_MAPPINGS
 from question_mappings import QUESTION_MAPPINGS #, Z_SCORE_FOR_YES, Z_SCORE_FOR_NO, get_question_by_id # REMOVED UNUSED IMPORTS
+from serving_metrics import SERVING_METRICS
+from model_registry import ModelRegistry, ModelBundle, DEFAULT_POINTER, threshold_pointer
+from prediction_contributions import ForestContributionExplainer, contributions_by_question
+from cohort_percentiles import CohortPercentiles, COHORT_SCORES_FILE
+from answer_bounds import AnswerBounds
+from what_if import what_if_table
 
 # --- Configuration ---
 MODEL_PATH = os.path.join("results", "random_forest_model.joblib")
 FEATURE_NAMES_PATH = os.path.join("results", "model_feature_names.json")
+# Registry pointer to serve (see model_registry.py) and how often, in seconds, to check it for a new version.
+# Set MODEL_RELOAD_INTERVAL=0 to disable hot reloading.
+MODEL_POINTER = os.environ.get("MODEL_POINTER", DEFAULT_POINTER)
+# MODEL_THRESHOLD=p90 (or gt10) serves that threshold's model from train_threshold_family.py instead
+if os.environ.get("MODEL_THRESHOLD"):
+    MODEL_POINTER = threshold_pointer(os.environ["MODEL_THRESHOLD"])
+MODEL_RELOAD_INTERVAL = float(os.environ.get("MODEL_RELOAD_INTERVAL", "10"))
+
+REGISTRY = ModelRegistry()
+
+def load_legacy_bundle():
+    """Load the model and feature names from the single files in results/ (pre-registry layout)."""
+    model = None
+    feature_names = []
+    try:
+        model = joblib.load(MODEL_PATH)
+        print(f"Model loaded successfully from {MODEL_PATH}")
+    except FileNotFoundError:
+        print(f"Error: Model file not found at {MODEL_PATH}. Please ensure the model is trained and saved.")
+        # Depending on the application, you might raise an error here or handle it gracefully.
+    except Exception as e:
+        print(f"Error loading model: {e}")
+
+    try:
+        with open(FEATURE_NAMES_PATH, 'r') as f:
+            feature_names = json.load(f)
+        print(f"Feature names loaded successfully from {FEATURE_NAMES_PATH}. Total features: {len(feature_names)}")
+    except FileNotFoundError:
+        print(f"Error: Feature names file not found at {FEATURE_NAMES_PATH}. Please ensure prepare_rf_data.py has run.")
+    except Exception as e:
+        print(f"Error loading feature names: {e}")
+
+    return ModelBundle('legacy', model, feature_names)
+
+def answer_encodings(bundle):
+    """
+    {question id: {answer option: model input}} for every possible answer, encoded as
+    get_prediction does (raw numeric answers standardized with the bundle's statistics).
+    """
+    encodings = {}
+    for question_map in QUESTION_MAPPINGS:
+        z_score_map = question_map.get('z_score_map')
+        if isinstance(z_score_map, dict):
+            encodings[question_map['id']] = dict(z_score_map)
+        elif question_map['scale_type'] == 'Continuous':
+            options = question_map['options']
+            column_stats = bundle.preprocessing_stats.get(question_map['id'], {})
+            values = range(options['min_value'], options['max_value'] + 1, options.get('step', 1))
+            if column_stats.get('std'):
+                encodings[question_map['id']] = {v: (v - column_stats['mean']) / column_stats['std'] for v in values}
+            else:
+                encodings[question_map['id']] = {v: 0.0 for v in values}
+    return encodings
+
+def prepare_bundle(bundle):
+    """Precompute per-model serving structures (contribution explainer, cohort scores) before a bundle is served."""
+    bundle.explainer = None
+    bundle.cohort = None
+    if bundle.path is not None and (bundle.path / COHORT_SCORES_FILE).exists():
+        try:
+            bundle.cohort = CohortPercentiles.load(bundle.path / COHORT_SCORES_FILE)
+        except Exception as e:
+            print(f"Warning: Could not load the cohort scores: {e}")
+    bundle.answer_bounds = None
+    bundle.answer_encodings = answer_encodings(bundle)
+    forest = getattr(bundle.model, 'regressor', bundle.model)
+    if hasattr(forest, 'estimators_') and hasattr(forest, 'decision_path'):
+        try:
+            bundle.explainer = ForestContributionExplainer(bundle.model)
+        except Exception as e:
+            print(f"Warning: Could not build the contribution explainer: {e}")
+        try:
+            bundle.answer_bounds = AnswerBounds(bundle.model, bundle.feature_names, bundle.answer_encodings)
+        except Exception as e:
+            print(f"Warning: Could not build the answer bounds: {e}")
+    return bundle
+
+def load_initial_bundle():
+    """Load the registry version named by MODEL_POINTER, falling back to the legacy files."""
+    try:
+        bundle = REGISTRY.load_pointer(MODEL_POINTER)
+        if bundle is not None:
+            print(f"Model version {bundle.version} loaded from the registry (pointer '{MODEL_POINTER}'). Total features: {len(bundle.feature_names)}")
+            return prepare_bundle(bundle)
+    except Exception as e:
+        print(f"Error loading model from the registry: {e}")
+    return prepare_bundle(load_legacy_bundle())
 
 # --- Load Model and Feature Names ---
-# These are loaded once when the module is imported for efficiency.
-RF_MODEL = None
-ALL_MODEL_FEATURES = []
-
-try:
-    RF_MODEL = joblib.load(MODEL_PATH)
-    print(f"Model loaded successfully from {MODEL_PATH}")
-except FileNotFoundError:
-    print(f"Error: Model file not found at {MODEL_PATH}. Please ensure the model is trained and saved.")
-    # Depending on the application, you might raise an error here or handle it gracefully.
-except Exception as e:
-    print(f"Error loading model: {e}")
-
-try:
-    with open(FEATURE_NAMES_PATH, 'r') as f:
-        ALL_MODEL_FEATURES = json.load(f)
-    print(f"Feature names loaded successfully from {FEATURE_NAMES_PATH}. Total features: {len(ALL_MODEL_FEATURES)}")
-except FileNotFoundError:
-    print(f"Error: Feature names file not found at {FEATURE_NAMES_PATH}. Please ensure prepare_rf_data.py has run.")
-except Exception as e:
-    print(f"Error loading feature names: {e}")
+# The active bundle is loaded once when the module is imported, and replaced as a whole
+# by activate_bundle() when a new version is published. get_prediction reads it once per
+# request, so in-flight predictions keep using the old model until they finish.
+ACTIVE_BUNDLE = load_initial_bundle()
+RF_MODEL = ACTIVE_BUNDLE.model
+ALL_MODEL_FEATURES = ACTIVE_BUNDLE.feature_names
+
+def activate_bundle(bundle):
+    """Swap in a new model bundle for subsequent predictions."""
+    global ACTIVE_BUNDLE, RF_MODEL, ALL_MODEL_FEATURES
+    ACTIVE_BUNDLE = bundle
+    RF_MODEL = bundle.model
+    ALL_MODEL_FEATURES = bundle.feature_names
+    print(f"Now serving model version {bundle.version}")
+
+def get_model_version():
+    """Version string of the model currently used for predictions."""
+    return ACTIVE_BUNDLE.version
+
+def get_cohort_percentile(probability):
+    """
+    Percentile (0-100) of a P(Higher Risk) estimate among the study cohort as scored by
+    the served model, or None if its bundle has no cohort scores.
+    """
+    cohort = getattr(ACTIVE_BUNDLE, 'cohort', None)
+    return cohort.percentile(probability) if cohort is not None else None
+
+def get_answer_bounds(partial_answers: dict):
+    """
+    Lowest and highest P(Higher Risk) still possible for a partly answered questionnaire,
+    with the class it must end in if that is already settled (see answer_bounds.py).
+    Returns None if the served model does not support it.
+    """
+    answer_bounds = getattr(ACTIVE_BUNDLE, 'answer_bounds', None)
+    if answer_bounds is None:
+        return None
+    start_time = time.perf_counter()
+    result = answer_bounds.bounds(partial_answers)
+    SERVING_METRICS.observe('bounds', time.perf_counter() - start_time)
+    return result
+
+def get_answer_completion(partial_answers: dict, target=None):
+    """
+    Answers for the open questions that give an achievable estimate (closest to
+    `target`, by default the middle of the achievable range), merged with the given
+    answers. Returns None if the served model does not support it.
+    """
+    answer_bounds = getattr(ACTIVE_BUNDLE, 'answer_bounds', None)
+    if answer_bounds is None:
+        return None
+    return answer_bounds.completion(partial_answers, target)[0]
+
+def get_question_priority(partial_answers: dict):
+    """Unanswered question ids, ordered by how much answering each would narrow the achievable range."""
+    answer_bounds = getattr(ACTIVE_BUNDLE, 'answer_bounds', None)
+    if answer_bounds is None:
+        return [q['id'] for q in QUESTION_MAPPINGS if q['id'] not in partial_answers]
+    ranked = [question_id for question_id, _ in answer_bounds.question_priority(partial_answers)]
+    # Questions the model does not split on cannot change the estimate; they go last
+    return ranked + [q['id'] for q in QUESTION_MAPPINGS if q['id'] not in partial_answers and q['id'] not in ranked]
+
+def get_what_if(input_data: dict):
+    """
+    How P(Higher Risk) would change if any single answer were different: all
+    alternatives are scored together in one batched model call (see what_if.py).
+    Returns (P(Higher Risk) of the submission, list of per-alternative rows) or (None, None).
+    """
+    bundle = ACTIVE_BUNDLE
+    if bundle.model is None or not bundle.feature_names:
+        return None, None
+    start_time = time.perf_counter()
+    encodings = getattr(bundle, 'answer_encodings', None) or answer_encodings(bundle)
+    position = {feature: i for i, feature in enumerate(bundle.feature_names)}
+    base_row = np.zeros(len(bundle.feature_names))
+    for feature_id, selected_option in input_data.items():
+        if feature_id in position and feature_id in encodings:
+            base_row[position[feature_id]] = encodings[feature_id].get(selected_option, 0.0)
+    result = what_if_table(bundle.model, base_row, bundle.feature_names, encodings, QUESTION_MAPPINGS, input_data)
+    SERVING_METRICS.observe('what_if', time.perf_counter() - start_time)
+    return result
+
+class ModelWatcher(threading.Thread):
+    """
+    Background thread that polls a registry pointer and, when it changes, loads the
+    new bundle off the request path and then swaps it in with activate_bundle().
+    """
+
+    def __init__(self, registry, pointer=DEFAULT_POINTER, interval=MODEL_RELOAD_INTERVAL):
+        super().__init__(name="model-watcher", daemon=True)
+        self.registry = registry
+        self.pointer = pointer
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def check_once(self):
+        """Load and activate the pointed-to version if it differs from the active one. Returns True on swap."""
+        version = self.registry.get_pointer(self.pointer)
+        if version is None or version == ACTIVE_BUNDLE.version:
+            return False
+        bundle = prepare_bundle(self.registry.load(version))
+        activate_bundle(bundle)
+        SERVING_METRICS.increment('model_reloads')
+        return True
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check_once()
+            except Exception as e:
+                print(f"Error reloading model: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+
+MODEL_WATCHER = None
+_WATCHER_LOCK = threading.Lock()
+
+def start_model_watcher():
+    """
+    Start the hot-reload watcher once per process (no-op if disabled). Called by the
+    serving app at startup, not on import, so scripts and tools importing this module
+    do not poll the registry.
+    """
+    global MODEL_WATCHER
+    with _WATCHER_LOCK:
+        if MODEL_WATCHER is None and MODEL_RELOAD_INTERVAL > 0:
+            MODEL_WATCHER = ModelWatcher(REGISTRY, MODEL_POINTER, MODEL_RELOAD_INTERVAL)
+            MODEL_WATCHER.start()
+    return MODEL_WATCHER
 
 # Create a lookup dictionary for Z-score maps for faster access
 z_score_lookup = {item['id']: item['z_score_map'] for item in QUESTION_MAPPINGS if 'id' in item and 'z_score_map' in item}
 
-def get_prediction(input_data: dict):
+def get_prediction(input_data: dict, return_contributions: bool = False):
     """
     Generates a prediction based on user input from the questionnaire.
 
@@ -45,55 +248,104 @@ def get_prediction(input_data: dict):
         input_data (dict): A dictionary where keys are feature IDs (e.g., 'cbcl_q86_p')
                            and values are the user's selected options 
                            (e.g., 0, 1, 2 for '012' scale; 'Yes', 'No' for 'YN' scale).
+        return_contributions (bool): If True, also return how much each answer moved the
+                           estimate. The breakdown comes from the same tree traversal as the
+                           prediction (see prediction_contributions.py).
 
     Returns:
         tuple: (predicted_class, prediction_probabilities) or (None, None) if model not loaded.
                predicted_class is 0 (Low Risk) or 1 (Higher Risk).
                prediction_probabilities is a list like [prob_class_0, prob_class_1].
+               With return_contributions=True a third element is added: a dict of
+               {question id: change in P(Higher Risk)}, plus 'other' for features not asked
+               and 'baseline' for the cohort average (None if the model does not support it).
     """
-    if RF_MODEL is None or not ALL_MODEL_FEATURES:
+    SERVING_METRICS.increment('requests')
+    # Read the active bundle once; a concurrent hot reload does not affect this request
+    bundle = ACTIVE_BUNDLE
+    model = bundle.model
+    model_features = bundle.feature_names
+    if model is None or not model_features:
         print("Model or feature names not loaded. Cannot make prediction.")
-        return None, None
+        SERVING_METRICS.increment('model_unavailable')
+        return (None, None, None) if return_contributions else (None, None)
+
+    start_time = time.perf_counter()
 
     # Create the full feature vector, ordered according to model_feature_names
     # Default to Z-score 0 (mean) for any feature
-    input_vector_dict = {feature: 0.0 for feature in ALL_MODEL_FEATURES}
+    input_vector_dict = {feature: 0.0 for feature in model_features}
 
     # Populate the vector with Z-scores based on user input
     for feature_id, selected_option in input_data.items():
-        if feature_id in ALL_MODEL_FEATURES:
+        if feature_id in input_vector_dict:
             if feature_id in z_score_lookup:
                 # Find the correct Z-score using the selected option as the key
                 z_score_map = z_score_lookup[feature_id]
                 # Important: Ensure selected_option type matches keys in z_score_map 
                 # (e.g., user input might be int 0, map key might be int 0)
                 # The keys in input_data values should directly map to keys in z_score_map
-                if selected_option in z_score_map:
+                if not isinstance(z_score_map, dict):
+                    # Raw numeric answer: standardize with the training mean/std from the bundle
+                    column_stats = bundle.preprocessing_stats.get(feature_id, {})
+                    if column_stats.get('std'):
+                        input_vector_dict[feature_id] = (float(selected_option) - column_stats['mean']) / column_stats['std']
+                    else:
+                        print(f"Warning: No scaling statistics for raw score feature '{feature_id}'. Defaulting to 0.")
+                        SERVING_METRICS.increment('fallbacks')
+                elif selected_option in z_score_map:
                     input_vector_dict[feature_id] = z_score_map[selected_option]
                 else:
                     print(f"Warning: Selected option '{selected_option}' for feature '{feature_id}' not found in z_score_map. Defaulting to 0.")
+                    SERVING_METRICS.increment('fallbacks')
                     # Keep the default 0.0 assigned earlier
             else:
                 # This case should ideally not happen if QUESTION_MAPPINGS covers all input features
                 print(f"Warning: Z-score map not found for feature '{feature_id}'. Defaulting to 0.")
+                SERVING_METRICS.increment('warnings')
                 # Keep the default 0.0 assigned earlier
         # else:
             # Feature ID from input_data is not in the model's expected features. Ignore it.
             # print(f"Warning: Input feature '{feature_id}' not recognized by the model. Ignoring.")
 
     # Convert the dictionary to a list in the correct order
-    input_vector = [input_vector_dict[feature] for feature in ALL_MODEL_FEATURES]
+    input_vector = [input_vector_dict[feature] for feature in model_features]
 
     # Reshape for the model (expects a 2D array)
     input_array = np.array(input_vector).reshape(1, -1)
+    encoded_time = time.perf_counter()
 
     # Make prediction
-    prediction = RF_MODEL.predict(input_array)
-    probabilities = RF_MODEL.predict_proba(input_array)
+    explainer = getattr(bundle, 'explainer', None) if return_contributions else None
+    try:
+        if explainer is not None:
+            # One decision-path traversal gives the probability and its per-feature breakdown
+            positive_probs, feature_contributions = explainer.explain(input_array)
+            probabilities = np.column_stack([1.0 - positive_probs, positive_probs])
+            prediction = (positive_probs > 0.5).astype(int)
+        else:
+            prediction = model.predict(input_array)
+            probabilities = model.predict_proba(input_array)
+    except Exception:
+        SERVING_METRICS.increment('errors')
+        raise
+    model_time = time.perf_counter()
 
     predicted_class = int(prediction[0])
     prediction_probabilities = probabilities[0].tolist() # Convert to list [prob_0, prob_1]
+    contributions = None
+    if explainer is not None:
+        contributions = contributions_by_question(feature_contributions[0], model_features, list(z_score_lookup))
+        contributions['baseline'] = explainer.bias
+    end_time = time.perf_counter()
+
+    SERVING_METRICS.observe('encode', encoded_time - start_time)
+    SERVING_METRICS.observe('model', model_time - encoded_time)
+    SERVING_METRICS.observe('postprocess', end_time - model_time)
+    SERVING_METRICS.observe('total', end_time - start_time)
 
+    if return_contributions:
+        return predicted_class, prediction_probabilities, contributions
     return predicted_class, prediction_probabilities
 
 # --- Example Usage ---
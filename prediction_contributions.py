@@ -0,0 +1,78 @@
+import numpy as np
+from scipy import sparse
+
+
+def _node_values(tree, class_index):
+    """Per-node prediction of one fitted tree: class probability for classifiers, mean for regressors."""
+    value = tree.value[:, 0, :]
+    if value.shape[1] > 1:
+        totals = value.sum(axis=1)
+        totals[totals == 0] = 1.0
+        return value[:, class_index] / totals
+    return value[:, 0]
+
+
+class ForestContributionExplainer:
+    """
+    Saabas-style path decomposition for a fitted random forest.
+
+    Every node stores the change in predicted probability from its parent and
+    the feature its parent split on. These are precomputed once per model into
+    a sparse (node x feature) matrix, so for any input the per-feature
+    contributions are the product of the forest's decision-path indicator with
+    that matrix: one traversal gives both the prediction and its breakdown, and
+    bias + contributions.sum() reproduces predict_proba exactly.
+    """
+
+    def __init__(self, model, positive_class=1):
+        # Distilled students wrap a regressor forest (see distilled_model.DistilledClassifier)
+        forest = getattr(model, 'regressor', model)
+        self.model = model
+        self.forest = forest
+        classes = list(getattr(forest, 'classes_', [0, 1]))
+        class_index = classes.index(positive_class) if positive_class in classes else len(classes) - 1
+        self.n_features = forest.n_features_in_
+        n_trees = len(forest.estimators_)
+
+        rows, cols, weights, bias = [], [], [], 0.0
+        offset = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            values = _node_values(tree, class_index)
+            bias += values[0]
+            parents = np.full(tree.node_count, -1)
+            internal = np.flatnonzero(tree.children_left >= 0)
+            parents[tree.children_left[internal]] = internal
+            parents[tree.children_right[internal]] = internal
+            children = np.flatnonzero(parents >= 0)
+            rows.append(children + offset)
+            cols.append(tree.feature[parents[children]])
+            weights.append((values[children] - values[parents[children]]) / n_trees)
+            offset += tree.node_count
+
+        self.bias = bias / n_trees
+        self.node_contributions = sparse.csr_matrix(
+            (np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(offset, self.n_features))
+
+    def explain(self, X):
+        """
+        Return (probabilities of the positive class, contributions) for rows of X.
+        contributions has shape (n_rows, n_features); each row sums to probability - bias.
+        """
+        indicator, _ = self.forest.decision_path(X)
+        contributions = np.asarray((indicator @ self.node_contributions).todense())
+        probabilities = self.bias + contributions.sum(axis=1)
+        return probabilities, contributions
+
+
+def contributions_by_question(contributions, feature_names, question_ids):
+    """
+    Collapse one row of per-feature contributions into per-question contributions.
+    Features that are not questionnaire inputs (left at their default value) are
+    summed under 'other'.
+    """
+    by_feature = dict(zip(feature_names, np.asarray(contributions).ravel()))
+    result = {q: float(by_feature.pop(q, 0.0)) for q in question_ids}
+    result['other'] = float(sum(by_feature.values()))
+    return result
@@ -6,22 +6,43 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix
 import joblib
 import json
+from pipeline_profiling import PipelineProfiler
+from feature_store import load_feature_frame, store_path_for
+from artifacts import stored_file
+from model_registry import ModelRegistry, DEFAULT_POINTER
+from permutation_importance import build_feature_groups, grouped_permutation_importance
+from cohort_percentiles import COHORT_SCORES_FILE, HOLDOUT_SUBJECTS_FILE, score_cohort, save_cohort_scores, save_holdout_subjects
+from sparse_features import load_sparse_design, SPARSE_DESIGN_PATH
+from scipy import sparse
+import os
+
+# Collects per-stage timings for this run (see pipeline_profiling.py)
+PROFILER = PipelineProfiler('prepare_rf_data')
+
+MODEL_PATH = 'results/random_forest_model.joblib'
+FEATURE_NAMES_PATH = 'results/model_feature_names.json'
+PREPROCESSING_STATS_PATH = 'results/preprocessing_stats.json'
+# 'sparse' trains on the CSR design merge_all_variables.py saves with the same setting (see sparse_features.py)
+FEATURE_ENCODING = os.environ.get('FEATURE_ENCODING', 'dense')
 
 # DEPRESSION_THRESHOLD will be dynamically calculated, so the global constant is no longer primary.
 # We can leave it commented out or remove if not needed as a fallback.
 # DEPRESSION_THRESHOLD = 5 # Placeholder - PLEASE UPDATE
 
-def load_processed_data(file_path='results/merged_variables.csv'):
-    """Loads the preprocessed data."""
+def load_processed_data(file_path='results/merged_variables.parquet'):
+    """Loads the preprocessed data (from its memory-mapped feature store when available)."""
     data_path = Path(file_path)
-    if not data_path.exists():
+    if stored_file(data_path) is None and not store_path_for(data_path).exists():
         # Here, you might want to add a call to run the main() function of merge_all_variables.py
         # For now, we'll raise an error if the file doesn't exist.
         raise FileNotFoundError(
             f"Processed data file not found: {file_path}. "
             "Please run merge_all_variables.py first or ensure the path is correct."
         )
-    return pd.read_csv(data_path)
+    with PROFILER.file(data_path) as rec:
+        df = load_feature_frame(data_path)
+        rec.set_output(df)
+    return df
 
 def define_features_target(df, target_column='3_yr_depress_score', binarize_target=True, percentile_threshold=None, fixed_threshold=None):
     """
@@ -61,33 +82,122 @@ def define_features_target(df, target_column='3_yr_depress_score', binarize_targ
 
     return X, y
 
+def load_sparse_features(path=SPARSE_DESIGN_PATH, percentile_threshold=0.75):
+    """
+    Sparse counterpart of load_processed_data + define_features_target: returns the CSR
+    feature matrix, the binarized target, the feature names, the score cutoff and the
+    subject ID of every row.
+    """
+    X, feature_names, subject_ids, target = load_sparse_design(path)
+    keep = ~np.isnan(target)
+    X, target, subject_ids = X[keep], target[keep], subject_ids[keep]
+    threshold_value = float(np.quantile(target, percentile_threshold))
+    y = pd.Series((target > threshold_value).astype(int), name='target_binary')
+    print(f"Target binarized using {percentile_threshold*100:.0f}th percentile threshold > {threshold_value:.2f}.")
+    print(f"Class distribution:\n{y.value_counts(normalize=True)}")
+    return X, y, feature_names, threshold_value, subject_ids
+
+def take_rows(X, rows):
+    """Rows of a DataFrame or a sparse matrix by position (a sparse result stays sparse)."""
+    return X[rows] if sparse.issparse(X) else X.iloc[rows]
+
+def load_preprocessing_stats(file_path=PREPROCESSING_STATS_PATH):
+    """Loads the imputation/scaling parameters saved by merge_all_variables.py (empty if missing)."""
+    if not Path(file_path).exists():
+        print(f"Warning: {file_path} not found. The model bundle will not include preprocessing statistics.")
+        return {}
+    with open(file_path) as f:
+        return json.load(f)
+
+def save_model_artifacts(model, feature_names, metadata=None, pointer=DEFAULT_POINTER, registry=None, cohort_X=None,
+                         holdout_subjects=None):
+    """
+    Publishes the model, its feature names and the preprocessing statistics as a new
+    versioned bundle in the model registry, and refreshes the legacy files in results/.
+    The bundle also gets the model's sorted scores for cohort_X, used to rank estimates
+    against the cohort when serving. cohort_X must only hold rows the model was not
+    trained on (their subject IDs are saved from holdout_subjects); without it the
+    bundle has no cohort scores. Returns the new model version.
+    """
+    registry = registry or ModelRegistry()
+    extra_files = {}
+    if cohort_X is None:
+        print("Warning: No held-out rows given; the bundle will not rank estimates against the cohort.")
+    else:
+        try:
+            cohort_scores = score_cohort(model, feature_names, cohort_X)
+            extra_files[COHORT_SCORES_FILE] = lambda path: save_cohort_scores(cohort_scores, path)
+        except Exception as e:
+            print(f"Warning: Could not score the cohort for percentile ranking: {e}")
+    if holdout_subjects is not None:
+        extra_files[HOLDOUT_SUBJECTS_FILE] = lambda path: save_holdout_subjects(holdout_subjects, path)
+    version = registry.publish(model, feature_names, preprocessing_stats=load_preprocessing_stats(),
+                               metadata=metadata, pointer=pointer, extra_files=extra_files)
+
+    # Legacy single-file artifacts, replaced atomically so readers never see a partial file
+    if pointer == DEFAULT_POINTER:
+        tmp_model_path = f"{MODEL_PATH}.{os.getpid()}.tmp"
+        joblib.dump(model, tmp_model_path)
+        os.replace(tmp_model_path, MODEL_PATH)
+        tmp_names_path = f"{FEATURE_NAMES_PATH}.{os.getpid()}.tmp"
+        with open(tmp_names_path, 'w') as f:
+            json.dump(list(feature_names), f)
+        os.replace(tmp_names_path, FEATURE_NAMES_PATH)
+    return version
+
 def main():
     """Main function to prepare data for Random Forest."""
     print("Starting data preparation for Random Forest model...")
+    PROFILER.start()
 
-    # 1. Load processed data
-    # Assumes 'results/merged_variables.csv' is generated by merge_all_variables.py
-    try:
-        processed_df = load_processed_data()
-        print(f"Successfully loaded {len(processed_df)} rows from 'results/merged_variables.csv'.")
-    except FileNotFoundError as e:
-        print(e)
-        return
-
-    # 2. Define Features (X) and Target (y)
-    # Binarizing using the 75th percentile as requested.
     percentile_to_use = 0.75
-    X, y = define_features_target(processed_df, binarize_target=True, percentile_threshold=percentile_to_use)
+    if FEATURE_ENCODING == 'sparse':
+        # 1-2. Sparse path: the CSR design from merge_all_variables.py, never densified for training
+        try:
+            with PROFILER.stage('load_sparse_design') as rec:
+                X, y, feature_names, threshold_value, subject_ids = load_sparse_features(percentile_threshold=percentile_to_use)
+                rec.set_output(X)
+        except FileNotFoundError as e:
+            print(f"{e}\nRun merge_all_variables.py with FEATURE_ENCODING=sparse first.")
+            return
+    else:
+        # 1. Load processed data
+        # Assumes 'results/merged_variables.parquet' is generated by merge_all_variables.py
+        try:
+            with PROFILER.stage('load_processed_data'):
+                processed_df = load_processed_data()
+            print(f"Successfully loaded {len(processed_df)} rows from 'results/merged_variables.parquet'.")
+        except FileNotFoundError as e:
+            print(e)
+            return
+
+        # 2. Define Features (X) and Target (y)
+        # Binarizing using the 75th percentile as requested.
+        with PROFILER.stage('define_features_target') as rec:
+            rec.set_input(processed_df)
+            X, y = define_features_target(processed_df, binarize_target=True, percentile_threshold=percentile_to_use)
+            rec.set_output(X)
+        feature_names = X.columns.tolist()
+        subject_ids = processed_df.loc[X.index, 'src_subject_id'].to_numpy()
+        # Cutoff on the score itself, so later updates (incremental_update.py) keep the same target
+        threshold_value = float(processed_df['3_yr_depress_score'].dropna().quantile(percentile_to_use))
     print(f"Features (X) shape: {X.shape}")
     print(f"Target (y) shape: {y.shape}")
 
-    if X.empty or y.empty:
+    if X.shape[0] == 0 or X.shape[1] == 0 or y.empty:
         print("X or y is empty. Cannot proceed with data splitting. Check data loading and processing.")
         return
         
     # 3. Split Data
+    # Split row positions (same rows as splitting X itself) so a sparse X is sliced, not copied densely.
     # Using a fixed random_state for reproducibility
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y if y.nunique() > 1 else None)
+    with PROFILER.stage('train_test_split') as rec:
+        rec.set_input(X)
+        train_rows, test_rows = train_test_split(np.arange(X.shape[0]), test_size=0.2, random_state=42,
+                                                 stratify=y if y.nunique() > 1 else None)
+        X_train, X_test = take_rows(X, train_rows), take_rows(X, test_rows)
+        y_train, y_test = y.iloc[train_rows], y.iloc[test_rows]
+        rec.set_output(X_train)
 
     print("\nData Splitting Complete:")
     print(f"X_train shape: {X_train.shape}")
@@ -95,13 +205,16 @@ def main():
     print(f"y_train shape: {y_train.shape}")
     print(f"y_test shape: {y_test.shape}")
 
-    # 4. Output: Briefly summarize and list first 5 columns of X_train
-    print("\nFirst 5 columns of X_train:")
-    print(X_train.iloc[:, :5].head())
+    if sparse.issparse(X):
+        print(f"\nSparse X_train: {X_train.nnz} stored values ({X_train.nnz / max(1, np.prod(X_train.shape)):.1%} of cells)")
+    else:
+        # 4. Output: Briefly summarize and list first 5 columns of X_train
+        print("\nFirst 5 columns of X_train:")
+        print(X_train.iloc[:, :5].head())
     
-    # Further check for NaNs introduced or persisting unexpectedly
-    print(f"\nNaNs in X_train: {X_train.isnull().sum().sum()}")
-    print(f"NaNs in X_test: {X_test.isnull().sum().sum()}")
+        # Further check for NaNs introduced or persisting unexpectedly
+        print(f"\nNaNs in X_train: {X_train.isnull().sum().sum()}")
+        print(f"NaNs in X_test: {X_test.isnull().sum().sum()}")
     print(f"NaNs in y_train: {y_train.isnull().sum().sum()}")
     print(f"NaNs in y_test: {y_test.isnull().sum().sum()}")
 
@@ -112,12 +225,16 @@ def main():
     print("Training Random Forest Classifier...")
     # Start with default hyperparameters, set random_state for reproducibility
     rf_classifier = RandomForestClassifier(random_state=42)
-    rf_classifier.fit(X_train, y_train)
+    with PROFILER.stage('train_random_forest') as rec:
+        rec.set_input(X_train)
+        rf_classifier.fit(X_train, y_train)
     print("Model training complete.")
 
     # 2. Evaluate Model
     print("\nEvaluating model on the test set...")
-    y_pred = rf_classifier.predict(X_test)
+    with PROFILER.stage('evaluate') as rec:
+        rec.set_input(X_test)
+        y_pred = rf_classifier.predict(X_test)
 
     accuracy = accuracy_score(y_test, y_pred)
     precision = precision_score(y_test, y_pred) # Default is for class 1
@@ -135,7 +252,6 @@ def main():
     # 3. Feature Importances
     print("\nExtracting feature importances...")
     importances = rf_classifier.feature_importances_
-    feature_names = X.columns
     feature_importance_df = pd.DataFrame({'feature': feature_names, 'importance': importances})
     feature_importance_df = feature_importance_df.sort_values(by='importance', ascending=False)
 
@@ -143,19 +259,39 @@ def main():
     print(feature_importance_df.head(20).to_string())
 
     # 4. Save Model (Recommended)
-    model_filename = 'results/random_forest_model.joblib'
-    print(f"\nSaving trained model to {model_filename}...")
-    joblib.dump(rf_classifier, model_filename)
-    print("Model saved.")
-
-    # Save the feature names (X.columns)
-    feature_names_filename = 'results/model_feature_names.json'
-    print(f"\nSaving feature names to {feature_names_filename}...")
-    with open(feature_names_filename, 'w') as f:
-        json.dump(X.columns.tolist(), f)
-    print("Feature names saved.")
+    # The model, feature names and preprocessing statistics are published
+    # together as a new immutable version in the model registry.
+    print(f"\nSaving trained model and feature names to the model registry...")
+    with PROFILER.stage('save_model'):
+        # Cohort scores from the test rows only: scores of training rows are pushed toward 0 and 1
+        model_version = save_model_artifacts(rf_classifier, feature_names, cohort_X=X_test,
+                                             holdout_subjects=subject_ids[test_rows], metadata={
+            'model_type': 'RandomForestClassifier',
+            'target': '3_yr_depress_score',
+            'percentile_threshold': percentile_to_use,
+            'threshold_value': threshold_value,
+            'feature_encoding': FEATURE_ENCODING,
+            'metrics': {'accuracy': accuracy, 'precision': precision, 'recall': recall, 'f1': f1},
+        })
+    print(f"Model saved as version {model_version} (also written to {MODEL_PATH} and {FEATURE_NAMES_PATH}).")
+
+    # 5. Permutation Importance
+    # Impurity importance favours high-cardinality continuous variables, so also report the
+    # drop in test ROC AUC when each variable (all of its dummy columns together) is shuffled.
+    print("\nComputing permutation importance on the test set...")
+    with PROFILER.stage('permutation_importance'):
+        feature_groups = build_feature_groups(feature_names, load_preprocessing_stats())
+        # Permutation needs a dense matrix; only the test rows are densified
+        X_perm = X_test.toarray() if sparse.issparse(X_test) else X_test
+        permutation_df = grouped_permutation_importance(rf_classifier, X_perm, y_test, feature_groups,
+                                                        model_version=model_version)
+
+    print("\nTop 20 features by permutation importance (drop in ROC AUC):")
+    print(permutation_df.head(20).to_string())
     
     print("\n--- Random Forest Model Training and Evaluation Complete ---")
+    PROFILER.print_summary()
+    PROFILER.write_report()
     # --- End of Prompt 2 Additions ---
 
 if __name__ == "__main__":
@@ -0,0 +1,134 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+# Default file the metrics snapshot is dumped to (read by a local metrics collector)
+METRICS_DUMP_PATH = Path('results/serving_metrics.json')
+
+# Log-spaced latency bucket upper bounds in seconds: 1us .. ~17s, 4 buckets per doubling
+BUCKET_BOUNDS = [1e-6 * 2 ** (i / 4) for i in range(97)]
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram. Recording is a binary search plus an
+    increment, so it is cheap enough to call on every request.
+    """
+
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """Estimate the q-th percentile (0-100) by interpolating within the bucket."""
+        if self.count == 0:
+            return None
+        target = q / 100 * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count == 0:
+                continue
+            if seen + bucket_count >= target:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                fraction = (target - seen) / bucket_count
+                return min(lower + (upper - lower) * fraction, self.max)
+            seen += bucket_count
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': (self.total / self.count * 1000) if self.count else None,
+            'p50_ms': _to_ms(self.percentile(50)),
+            'p95_ms': _to_ms(self.percentile(95)),
+            'p99_ms': _to_ms(self.percentile(99)),
+            'max_ms': self.max * 1000 if self.count else None,
+        }
+
+
+def _to_ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+class ServingMetrics:
+    """Thread-safe request counters and per-phase latency histograms for get_prediction."""
+
+    # 'bounds' and 'what_if' time the achievable-range checks and the what-if table, outside get_prediction
+    PHASES = ('encode', 'model', 'postprocess', 'total', 'bounds', 'what_if')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.now()
+            self.histograms = {phase: LatencyHistogram() for phase in self.PHASES}
+            self.counters = {
+                'requests': 0,
+                'errors': 0,
+                'model_unavailable': 0,
+                'fallbacks': 0,   # option not found in z_score_map, default z-score used
+                'warnings': 0,    # feature without a z_score_map
+                'model_reloads': 0,
+            }
+
+    def observe(self, phase, seconds):
+        with self._lock:
+            self.histograms[phase].record(seconds)
+
+    def increment(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    @contextmanager
+    def timer(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start)
+
+    def snapshot(self):
+        """Return all metrics as a JSON-serializable dictionary."""
+        with self._lock:
+            elapsed = (datetime.now() - self.started_at).total_seconds()
+            return {
+                'pid': os.getpid(),
+                'started_at': self.started_at.isoformat(timespec='seconds'),
+                'snapshot_at': datetime.now().isoformat(timespec='seconds'),
+                'uptime_s': elapsed,
+                'requests_per_s': self.counters['requests'] / elapsed if elapsed > 0 else None,
+                'counters': dict(self.counters),
+                'latency': {phase: hist.summary() for phase, hist in self.histograms.items()},
+            }
+
+    def dump(self, path=METRICS_DUMP_PATH):
+        """Write a snapshot to a JSON file (atomically, so a collector never sees a partial file)."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+
+# Process-wide metrics used by prediction_calculator_logic.get_prediction
+SERVING_METRICS = ServingMetrics()
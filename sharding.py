@@ -0,0 +1,80 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+
+# Partial results of shard workers that run as separate commands (e.g. one per machine)
+SHARD_DIR = Path(os.environ.get('SHARD_DIR', 'results/shards'))
+
+
+def shard_of(subject_ids, n_shards):
+    """
+    Shard number (0..n_shards-1) of each src_subject_id.
+
+    Uses pandas' fixed-key hash of the ID string, so every process and machine
+    assigns a subject to the same shard. Categorical IDs are hashed once per category.
+    """
+    if isinstance(subject_ids, pd.Series):
+        subject_ids = subject_ids.array
+    if isinstance(subject_ids, pd.Categorical):
+        category_shards = shard_of(np.asarray(subject_ids.categories, dtype=object), n_shards)
+        category_shards = np.append(category_shards, -1)  # row code -1 (NaN) belongs to no shard
+        return category_shards[subject_ids.codes]
+    hashes = pd.util.hash_pandas_object(pd.Series(subject_ids, dtype=object).astype(str), index=False)
+    return (hashes.to_numpy() % np.uint64(n_shards)).astype(np.int64)
+
+
+def in_shard(subject_ids, shard_index, n_shards):
+    """Boolean mask of which subject_ids belong to one shard (all of them when n_shards is 1)."""
+    if n_shards <= 1:
+        return np.ones(len(subject_ids), dtype=bool)
+    return shard_of(subject_ids, n_shards) == shard_index
+
+
+def shard_path(name, shard_index, n_shards):
+    return SHARD_DIR / f"{name}_shard{shard_index:03d}_of{n_shards:03d}.joblib"
+
+
+def save_shard_result(result, name, shard_index, n_shards):
+    """Write one shard's partial result for a later --combine run."""
+    SHARD_DIR.mkdir(parents=True, exist_ok=True)
+    path = shard_path(name, shard_index, n_shards)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(result, tmp_path)
+    os.replace(tmp_path, path)
+    print(f"Shard {shard_index + 1}/{n_shards} result saved to: {path}")
+    return path
+
+
+def load_shard_results(name, n_shards):
+    """Load every shard's partial result; fails if any shard has not finished."""
+    paths = [shard_path(name, i, n_shards) for i in range(n_shards)]
+    missing = [str(p) for p in paths if not p.exists()]
+    if missing:
+        raise FileNotFoundError(f"{len(missing)} of {n_shards} shard results are missing: {', '.join(missing[:3])}")
+    return [joblib.load(p) for p in paths]
+
+
+def run_shards(worker, n_shards, max_workers=None, args=()):
+    """Run worker(shard_index, n_shards, *args) for every shard in local processes; results in shard order."""
+    max_workers = min(n_shards, max_workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(worker, i, n_shards, *args) for i in range(n_shards)]
+        return [future.result() for future in futures]
+
+
+def add_shard_arguments(parser):
+    """Command-line options shared by the sharded scripts."""
+    parser.add_argument('--shards', type=int, default=1,
+                        help="Split subjects into this many hash shards, processed independently (default: 1, no sharding).")
+    parser.add_argument('--shard-index', type=int, default=None,
+                        help="Only process this shard (0-based) and save its partial result to the shard directory, "
+                             "e.g. one shard per machine on a shared filesystem.")
+    parser.add_argument('--combine', action='store_true',
+                        help="Combine the saved partial results of all --shards shards instead of processing data.")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Local worker processes when running all shards (default: one per CPU, at most --shards).")
+    return parser
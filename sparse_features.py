@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import train_test_split
+
+# Sparse design matrix written by merge_all_variables.py with FEATURE_ENCODING=sparse
+SPARSE_DESIGN_PATH = os.path.join('results', 'merged_variables_sparse.npz')
+SPARSE_BENCHMARK_PATH = os.path.join('results', 'sparse_encoding_benchmark.csv')
+
+TARGET_COLUMN = '3_yr_depress_score'
+
+
+class SparseDesign:
+    """
+    Preprocessed features kept as a dense block of z-scored continuous/ordinal
+    columns plus a CSR block of one-hot dummies. feature_names gives the column
+    order of the dense path (preprocess_variables), so models trained on either
+    encoding take the same inputs.
+
+    Only the one-hot part saves memory: estimators get the combined CSR matrix,
+    where every dense value is a stored non-zero (8 bytes of data plus a 4-byte
+    column index, against 8 bytes in a dense array). The saving therefore
+    depends on how much of the design is one-hot dummies.
+    """
+
+    def __init__(self, ids, target, dense, dense_columns, onehot, onehot_columns, feature_names):
+        self.ids = ids
+        self.target = target
+        self.dense = dense
+        self.dense_columns = list(dense_columns)
+        self.onehot = onehot
+        self.onehot_columns = list(onehot_columns)
+        self.feature_names = list(feature_names)
+
+    @property
+    def shape(self):
+        return (len(self.ids), len(self.feature_names))
+
+    def matrix(self, fmt='csr'):
+        """Combined sparse matrix in feature_names order (dense columns are stored as non-zeros, see above)."""
+        blocks = sparse.hstack([sparse.csr_matrix(self.dense), self.onehot], format='csc')
+        position = {name: i for i, name in enumerate(self.dense_columns + self.onehot_columns)}
+        return blocks[:, [position[name] for name in self.feature_names]].asformat(fmt)
+
+    def to_frame(self):
+        """Densify into the same layout preprocess_variables produces, for consumers that need a DataFrame."""
+        frame = pd.DataFrame(self.matrix().toarray(), columns=self.feature_names)
+        frame.insert(0, TARGET_COLUMN, self.target)
+        frame.insert(0, 'src_subject_id', self.ids)
+        return frame
+
+    def nbytes(self):
+        """Size of the combined matrix estimators are trained on (not of the separate blocks)."""
+        return csr_nbytes(self.matrix())
+
+
+def csr_nbytes(X):
+    """Memory held by a CSR/CSC matrix: its data, indices and indptr arrays."""
+    return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+
+
+def encode_sparse(df, var_types, stats=None):
+    """
+    Sparse counterpart of merge_all_variables.preprocess_variables: mode fill +
+    one-hot (first category dropped) for binary/categorical variables, mean
+    fill + z-score for continuous/ordinal ones. The dummies are built directly
+    as CSR coordinates from category codes, never as dense columns. Fills
+    `stats` with the same entries preprocess_variables would.
+    """
+    id_cols = ['src_subject_id', TARGET_COLUMN]
+    dense_columns, dense_values = [], []
+    onehot_columns, onehot_rows, onehot_cols = [], [], []
+    feature_names = []
+
+    for col in df.columns:
+        if col in id_cols or df[col].notna().sum() == 0:
+            continue
+        var_type = var_types.get(col, 'unknown')
+
+        if var_type in ['binary', 'categorical']:
+            mode_val = df[col].mode()[0]
+            filled = df[col].fillna(mode_val)
+            categories = sorted(filled.unique().tolist())
+            codes = pd.Categorical(filled, categories=categories).codes
+            # Same names and drop_first behaviour as pd.get_dummies(prefix=col)
+            dummy_columns = [f"{col}_{category}" for category in categories[1:]]
+            hit = codes > 0
+            onehot_rows.append(np.flatnonzero(hit))
+            onehot_cols.append(len(onehot_columns) + codes[hit] - 1)
+            onehot_columns.extend(dummy_columns)
+            feature_names.extend(dummy_columns)
+            if stats is not None:
+                stats[col] = {'var_type': var_type, 'impute_value': mode_val,
+                              'categories': categories, 'dummy_columns': dummy_columns}
+
+        elif var_type in ['continuous', 'ordinal']:
+            mean_val = df[col].mean()
+            filled = df[col].fillna(mean_val).to_numpy(dtype=np.float64)
+            mean, std = filled.mean(), filled.std()
+            std = std if std > 0 else 1.0  # StandardScaler leaves constant columns unscaled
+            dense_values.append((filled - mean) / std)
+            dense_columns.append(col)
+            feature_names.append(col)
+            if stats is not None:
+                stats[col] = {'var_type': var_type, 'impute_value': mean_val, 'mean': float(mean), 'std': float(std)}
+
+        else:
+            print(f"Warning: Unknown variable type for {col}: {var_type}")
+
+    n_rows = len(df)
+    dense = np.column_stack(dense_values) if dense_values else np.empty((n_rows, 0))
+    rows = np.concatenate(onehot_rows) if onehot_rows else np.empty(0, dtype=np.int64)
+    cols = np.concatenate(onehot_cols) if onehot_cols else np.empty(0, dtype=np.int64)
+    onehot = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n_rows, len(onehot_columns)))
+    return SparseDesign(df['src_subject_id'].to_numpy(), df[TARGET_COLUMN].to_numpy(dtype=np.float64),
+                        dense, dense_columns, onehot, onehot_columns, feature_names)
+
+
+def save_sparse_design(design, path=SPARSE_DESIGN_PATH):
+    """Save the combined matrix as .npz with the names, IDs and target in a .json sidecar."""
+    sparse.save_npz(path, design.matrix(), compressed=False)
+    with open(f"{os.path.splitext(path)[0]}.json", 'w') as f:
+        json.dump({'feature_names': design.feature_names, 'dense_columns': design.dense_columns,
+                   'ids': [str(i) for i in design.ids], 'target': design.target.tolist()}, f)
+    print(f"Sparse design matrix saved to: {path} ({design.shape[0]} rows x {design.shape[1]} features)")
+    return path
+
+
+def load_sparse_design(path=SPARSE_DESIGN_PATH):
+    """Return (combined CSR matrix, feature names, subject IDs, target) saved by save_sparse_design."""
+    with open(f"{os.path.splitext(path)[0]}.json") as f:
+        meta = json.load(f)
+    return sparse.load_npz(path).tocsr(), meta['feature_names'], np.array(meta['ids'], dtype=object), np.array(meta['target'])
+
+
+def _run_path(name, build, random_state=42):
+    """Encode + split under tracemalloc, then fit and score a forest."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    X, y, x_bytes = build()
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=random_state, stratify=y)
+    encode_split_s = time.perf_counter() - start
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    model = RandomForestClassifier(random_state=random_state)
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_s = time.perf_counter() - start
+    return {
+        'encoding': name,
+        'n_features': X.shape[1],
+        'X_mb': x_bytes / 1e6,
+        'encode_split_peak_mb': peak_bytes / 1e6,
+        'encode_split_s': encode_split_s,
+        'fit_s': fit_s,
+        'test_auc': roc_auc_score(y_test, model.predict_proba(X_test)[:, 1]),
+    }
+
+
+def main():
+    # Imported here so that merge_all_variables can import this module without a cycle
+    from merge_all_variables import get_valid_variables, get_reference_cohort, load_and_prepare_data, preprocess_variables
+    from prepare_rf_data import define_features_target
+
+    parser = argparse.ArgumentParser(description="Compare memory and fit time of the dense and sparse one-hot encodings.")
+    parser.add_argument('--percentile', type=float, default=0.75, help="Target binarization percentile (default: 0.75).")
+    args = parser.parse_args()
+
+    valid_vars = get_valid_variables()
+    reference_cohort, depress_scores = get_reference_cohort()
+    merged_df, var_types = load_and_prepare_data(valid_vars, reference_cohort, depress_scores)
+    merged_df = merged_df.dropna(subset=[TARGET_COLUMN]).reset_index(drop=True)
+    cutoff = merged_df[TARGET_COLUMN].quantile(args.percentile)
+
+    def build_dense():
+        processed = preprocess_variables(merged_df.copy(), var_types)
+        X, y = define_features_target(processed, percentile_threshold=args.percentile)
+        return X, y.to_numpy(), int(X.memory_usage(deep=True).sum())
+
+    def build_sparse():
+        design = encode_sparse(merged_df, var_types)
+        X = design.matrix()
+        # The matrix that is actually trained on, dense block included
+        return X, (design.target > cutoff).astype(int), csr_nbytes(X)
+
+    results = pd.DataFrame([_run_path('dense', build_dense), _run_path('sparse', build_sparse)])
+    print("\nDense versus sparse one-hot encoding:")
+    print(results.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    results.to_csv(SPARSE_BENCHMARK_PATH, index=False)
+    print(f"\nBenchmark saved to: {SPARSE_BENCHMARK_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+# Read subject IDs as a categorical so each distinct ID string is parsed and hashed once per file
+SUBJECT_ID_DTYPE = {'src_subject_id': 'category'}
+
+
+class SubjectIndex:
+    """
+    Dictionary from src_subject_id strings to dense int32 codes 0..n-1.
+
+    Built once from the reference cohort; codes follow the cohort order, so
+    arrays indexed by code line up with the cohort without any join. Filters
+    and joins work on the codes and the ID strings are only restored on output.
+    """
+
+    def __init__(self, subject_ids):
+        self.ids = pd.unique(np.asarray(subject_ids, dtype=object))
+        # pandas builds the hash table for the index once and reuses it for every lookup
+        self._index = pd.Index(self.ids, name='src_subject_id')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def encode(self, subject_ids):
+        """Return int32 codes for subject_ids, -1 for IDs that are not in the cohort."""
+        if isinstance(subject_ids, pd.Series):
+            subject_ids = subject_ids.array
+        if isinstance(subject_ids, pd.Categorical):
+            # Look up each distinct category once, then map row codes through that table
+            category_codes = self._index.get_indexer(subject_ids.categories).astype(np.int32)
+            category_codes = np.append(category_codes, np.int32(-1))  # row code -1 (NaN) maps to -1
+            return category_codes[subject_ids.codes]
+        return self._index.get_indexer(subject_ids).astype(np.int32)
+
+    def contains(self, subject_ids):
+        """Boolean mask of which subject_ids belong to the cohort."""
+        return self.encode(subject_ids) >= 0
+
+    def decode(self, codes):
+        """Restore ID strings from codes."""
+        return self.ids[np.asarray(codes)]
+
+    def scatter(self, codes, values, complete=None):
+        """
+        Place values into a cohort-length array by direct indexing on codes.
+
+        Rows for subjects without a value are NaN (None for non-numeric data);
+        integer/bool data keeps its dtype when every subject has a value, matching
+        what a left merge onto the cohort would produce.
+        """
+        values = np.asarray(values)
+        codes = np.asarray(codes)
+        if complete is None:
+            complete = self.covers(codes)
+        if complete or values.dtype.kind == 'f':
+            out = np.empty(len(self), dtype=values.dtype)
+            if not complete:
+                out.fill(np.nan)
+        elif values.dtype.kind in 'biu':
+            out = np.full(len(self), np.nan)
+        else:
+            out = np.full(len(self), None, dtype=object)
+        out[codes] = values
+        return out
+
+    def covers(self, codes):
+        """True if codes (all >= 0) include every subject in the cohort."""
+        seen = np.zeros(len(self), dtype=bool)
+        seen[codes] = True
+        return bool(seen.all())
+
+    def align(self, df, columns, subject_col='src_subject_id'):
+        """Return {column: cohort-aligned array} for rows of df that belong to the cohort."""
+        codes = self.encode(df[subject_col])
+        in_cohort = codes >= 0
+        codes = codes[in_cohort]
+        complete = self.covers(codes)
+        return {col: self.scatter(codes, df[col].to_numpy()[in_cohort], complete) for col in columns}
+
+    def to_frame(self, columns):
+        """Build an output DataFrame from cohort-aligned arrays, restoring the ID strings."""
+        frame = pd.DataFrame(columns, copy=False)
+        frame.insert(0, 'src_subject_id', self.ids)
+        return frame
@@ -0,0 +1,145 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score
+from sklearn.model_selection import train_test_split
+
+from pipeline_profiling import PipelineProfiler
+from prepare_rf_data import load_processed_data, save_model_artifacts
+from model_registry import threshold_pointer
+
+# Collects per-stage timings for this run (see pipeline_profiling.py)
+PROFILER = PipelineProfiler('train_threshold_family')
+
+TARGET_COLUMN = '3_yr_depress_score'
+DEFAULT_PERCENTILES = [0.75]
+
+# One row per threshold: class balance, test metrics, fit time and published version
+COMPARISON_RESULTS_PATH = os.path.join('results', 'threshold_family.csv')
+
+
+def resolve_thresholds(scores, percentiles=None, fixed_thresholds=None):
+    """
+    Turn requested percentiles and fixed cutoffs into (label, cutoff, spec) tuples.
+    Percentile cutoffs are computed on the full cohort, as in define_features_target.
+    """
+    thresholds = []
+    for percentile in percentiles or []:
+        label = f"p{percentile * 100:g}"
+        thresholds.append((label, float(np.quantile(scores, percentile)), {'percentile_threshold': percentile}))
+    for fixed in fixed_thresholds or []:
+        label = f"gt{fixed:g}"
+        thresholds.append((label, float(fixed), {'fixed_threshold': fixed}))
+    return thresholds
+
+
+def fit_threshold_model(label, cutoff, X_train, scores_train, X_test, scores_test, random_state=42):
+    """Binarize the shared score arrays at one cutoff, then train and evaluate a forest."""
+    y_train = (scores_train > cutoff).astype(int)
+    y_test = (scores_test > cutoff).astype(int)
+    model = RandomForestClassifier(random_state=random_state)
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_time = time.perf_counter() - start
+
+    y_pred = model.predict(X_test)
+    # A cutoff above every score leaves a single class, which RF reports with one probability column
+    probs = model.predict_proba(X_test)[:, -1]
+    metrics = {
+        'accuracy': accuracy_score(y_test, y_pred),
+        'precision': precision_score(y_test, y_pred, zero_division=0),
+        'recall': recall_score(y_test, y_pred, zero_division=0),
+        'f1': f1_score(y_test, y_pred, zero_division=0),
+        'roc_auc': roc_auc_score(y_test, probs) if len(np.unique(y_test)) > 1 else float('nan'),
+    }
+    return label, model, metrics, fit_time, float(y_train.mean())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Train one Random Forest per target threshold from a single data load and split.")
+    parser.add_argument('--percentiles', type=float, nargs='*', default=None,
+                        help="Percentile cutoffs in (0, 1), e.g. 0.5 0.75 0.9 (default: 0.75 unless fixed thresholds are given).")
+    parser.add_argument('--fixed-thresholds', type=float, nargs='*', default=None,
+                        help="Fixed score cutoffs; the positive class is score > cutoff.")
+    parser.add_argument('--n-jobs', type=int, default=-1,
+                        help="Number of thresholds trained at the same time (default: all CPUs).")
+    parser.add_argument('--no-publish', action='store_true',
+                        help="Only write the comparison table, do not publish bundles.")
+    args = parser.parse_args()
+    PROFILER.start()
+
+    percentiles = args.percentiles
+    if percentiles is None and not args.fixed_thresholds:
+        percentiles = DEFAULT_PERCENTILES
+
+    with PROFILER.stage('load_processed_data'):
+        processed_df = load_processed_data()
+    processed_df = processed_df.dropna(subset=[TARGET_COLUMN])
+
+    with PROFILER.stage('prepare_arrays') as rec:
+        rec.set_input(processed_df)
+        feature_names = processed_df.columns.drop(['src_subject_id', TARGET_COLUMN]).tolist()
+        # Plain contiguous arrays: joblib memory-maps these to the workers instead of copying them
+        X = np.ascontiguousarray(processed_df[feature_names].to_numpy(dtype=np.float64))
+        scores = processed_df[TARGET_COLUMN].to_numpy(dtype=np.float64)
+        thresholds = resolve_thresholds(scores, percentiles, args.fixed_thresholds)
+        rec.set_output(X)
+    if not thresholds:
+        print("No thresholds requested.")
+        return
+
+    # One split shared by every threshold, stratified on the first threshold's classes so that
+    # the first model matches the one prepare_rf_data.py trains at the same cutoff.
+    with PROFILER.stage('train_test_split'):
+        first_labels = (scores > thresholds[0][1]).astype(int)
+        stratify = first_labels if len(np.unique(first_labels)) > 1 else None
+        X_train, X_test, scores_train, scores_test, _, ids_test = train_test_split(
+            X, scores, processed_df['src_subject_id'].to_numpy(), test_size=0.2, random_state=42, stratify=stratify)
+    print(f"Training {len(thresholds)} threshold models on {X_train.shape[0]} rows x {X_train.shape[1]} features...")
+
+    with PROFILER.stage('train_models') as rec:
+        rec.set_input(X_train)
+        fitted = Parallel(n_jobs=args.n_jobs, max_nbytes='1M')(
+            delayed(fit_threshold_model)(label, cutoff, X_train, scores_train, X_test, scores_test)
+            for label, cutoff, _ in thresholds)
+
+    rows = []
+    with PROFILER.stage('publish_models'):
+        for (label, cutoff, spec), (_, model, metrics, fit_time, positive_rate) in zip(thresholds, fitted):
+            version = None
+            if not args.no_publish:
+                pointer = threshold_pointer(label)
+                # Cohort scores from the shared test rows only: scores of training rows are pushed toward 0 and 1
+                version = save_model_artifacts(model, feature_names, pointer=pointer,
+                                               cohort_X=pd.DataFrame(X_test, columns=feature_names),
+                                               holdout_subjects=ids_test, metadata={
+                    'model_type': 'RandomForestClassifier',
+                    'target': TARGET_COLUMN,
+                    'threshold_label': label,
+                    'threshold_value': cutoff,
+                    **spec,
+                    'metrics': metrics,
+                })
+            rows.append({'threshold': label, 'cutoff': cutoff, 'positive_rate': positive_rate,
+                         **metrics, 'fit_time_s': fit_time, 'version': version})
+
+    results_df = pd.DataFrame(rows)
+    print("\nThreshold comparison:")
+    print(results_df.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    results_df.to_csv(COMPARISON_RESULTS_PATH, index=False)
+    print(f"\nComparison table saved to: {COMPARISON_RESULTS_PATH}")
+    if not args.no_publish:
+        print("Serve one of these models with MODEL_THRESHOLD=<threshold> (e.g. MODEL_THRESHOLD=p75).")
+
+    PROFILER.print_summary()
+    PROFILER.write_report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import numpy as np
+
+# Alternative values tried for a numeric (Continuous) question: evenly spaced over its range
+CONTINUOUS_WHAT_IF_POINTS = 5
+
+
+def alternative_options(question_map):
+    """Answer options to try for one question (all options, or a few points across a numeric range)."""
+    options = question_map['options']
+    if question_map['scale_type'] == 'Continuous':
+        points = np.linspace(options['min_value'], options['max_value'], CONTINUOUS_WHAT_IF_POINTS)
+        return sorted({int(round(v)) for v in points})
+    return list(options.values())
+
+
+def what_if_matrix(base_row, feature_names, answer_encodings, question_mappings, answers):
+    """
+    Every single-answer change of a submission as rows of one model input matrix.
+
+    base_row is the encoded submission. Returns (matrix, changes) where changes[i]
+    is (question id, alternative option) for matrix row i; the submitted answer itself
+    is skipped, as are questions that are not model inputs.
+    """
+    position = {name: i for i, name in enumerate(feature_names)}
+    changes, columns, values = [], [], []
+    for question_map in question_mappings:
+        question_id = question_map['id']
+        if question_id not in position or question_id not in answer_encodings:
+            continue
+        for option in alternative_options(question_map):
+            if option == answers.get(question_id) or option not in answer_encodings[question_id]:
+                continue
+            changes.append((question_id, option))
+            columns.append(position[question_id])
+            values.append(answer_encodings[question_id][option])
+    matrix = np.repeat(np.asarray(base_row, dtype=np.float64)[None, :], len(changes), axis=0)
+    matrix[np.arange(len(changes)), columns] = values
+    return matrix, changes
+
+
+def what_if_table(model, base_row, feature_names, answer_encodings, question_mappings, answers):
+    """
+    Score all single-answer changes in one predict_proba call.
+    Returns (P(Higher Risk) of the submission, [{'question_id', 'answer', 'alternative',
+    'probability', 'delta'}, ...]) with delta = alternative probability - submitted probability.
+    """
+    matrix, changes = what_if_matrix(base_row, feature_names, answer_encodings, question_mappings, answers)
+    probabilities = model.predict_proba(np.vstack([np.asarray(base_row, dtype=np.float64)[None, :], matrix]))[:, 1]
+    base_probability = float(probabilities[0])
+    rows = [{'question_id': question_id, 'answer': answers.get(question_id), 'alternative': option,
+             'probability': float(p), 'delta': float(p) - base_probability}
+            for (question_id, option), p in zip(changes, probabilities[1:])]
+    return base_probability, rows